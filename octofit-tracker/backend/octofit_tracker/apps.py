@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Connect the workout catalog's invalidation signals
+        from . import workouts  # noqa: F401
+        # Every process (web, run_jobs, other commands) reports its pool
+        # usage; ready() runs before djongo creates its MongoClient
+        from .metrics import install_listeners
+        from .profiling import install_listener
+        install_listeners()
+        install_listener()
@@ -0,0 +1,319 @@
+"""Async versions of the read-heavy endpoints, served under ``/api/async/``.
+
+DRF and djongo are synchronous, so under ASGI every ORM round-trip in the
+regular views holds a worker thread. These views read MongoDB through
+motor instead, so one ASGI worker interleaves the database waits of many
+requests, and lookups that do not depend on each other are issued
+together with ``asyncio.gather``. Responses have the same shape, ordering
+and pagination as the synchronous endpoints. The gain only shows under an
+ASGI server such as ``uvicorn octofit_tracker.asgi:application``.
+``manage.py load_test`` compares that with the WSGI deployment.
+"""
+import asyncio
+import base64
+import functools
+import json
+from asgiref.sync import sync_to_async
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import DateTimeField
+from . import leaderboard_windows, leaderboards, mongo
+from .metrics import record_cache_lookup
+from .pagination import KeysetPagination
+from .views import parse_date_param
+
+_clients = {}
+
+# Dates rendered exactly as the DRF serializers render them
+_datetime = DateTimeField().to_representation
+
+
+def database():
+    """The motor database for the running event loop
+
+    A motor client belongs to the loop it was first used on, so each loop
+    (normally one per ASGI worker) gets its own, configured like djongo's
+    and reading with the read-only endpoints' read preference.
+    """
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError as exc:
+        raise ImproperlyConfigured(
+            f'The async API requires motor 2.5 on Python 3.10 or older, see requirements.txt ({exc})'
+        )
+    options = settings.DATABASES['default']
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncIOMotorClient(tz_aware=True, **options.get('CLIENT', {}))
+    # Every view here only reads
+    return client.get_database(options['NAME'], read_preference=mongo.read_preference())
+
+
+class QueryParams:
+    """Wraps a Django request for helpers written against DRF's ``query_params``"""
+
+    def __init__(self, request):
+        self.query_params = request.GET
+
+
+def async_get(view):
+    """GET-only async view that answers the shared parameter parsers' errors with a 400
+
+    Django's ``require_GET`` is not async-aware before 5.0.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return HttpResponseNotAllowed(['GET'])
+        try:
+            return await view(request, *args, **kwargs)
+        except ValidationError as exc:
+            return JsonResponse(exc.detail, status=400)
+    return wrapper
+
+
+@async_get
+async def leaderboard(request):
+    """Top users by points, optionally for a time window"""
+    limit = int(request.GET.get('limit', 10))
+    window = request.GET.get('window')
+    if window is not None and window not in leaderboard_windows.WINDOWS:
+        raise ValidationError({'window': f'Choose one of: {", ".join(leaderboard_windows.WINDOWS)}.'})
+    if limit < 1:
+        return JsonResponse([], safe=False)
+    db = database()
+
+    if window is None:
+        rows = await top_ranked(db.user_profiles, {}, 'total_points', limit)
+        team_ids = {row['user_id']: row.get('primary_team_id') for row in rows}
+        users, teams = await asyncio.gather(
+            _usernames(db, team_ids),
+            _team_names(db, team_ids.values()),
+        )
+        score_field = 'total_points'
+    else:
+        # Advancing a window writes through the ORM, at most once a day
+        await sync_to_async(leaderboard_windows.ensure_current)()
+        rows = await top_ranked(db.window_scores, {'window': window, 'activity_count': {'$gt': 0}}, 'points', limit)
+        user_ids = [row['user_id'] for row in rows]
+        users, profiles = await asyncio.gather(
+            _usernames(db, user_ids),
+            db.user_profiles.find({'user_id': {'$in': user_ids}}, {'user_id': 1, 'primary_team_id': 1}).to_list(None),
+        )
+        team_ids = {profile['user_id']: profile.get('primary_team_id') for profile in profiles}
+        teams = await _team_names(db, team_ids.values())
+        score_field = 'points'
+
+    return JsonResponse([
+        {
+            'user_id': row['user_id'],
+            'username': users.get(row['user_id']),
+            'total_points': row[score_field],
+            'activity_count': row['activity_count'],
+            'total_calories': row['total_calories'],
+            'team_name': teams.get(team_ids.get(row['user_id'])),
+            'rank': rank
+        }
+        for rank, row in enumerate(rows, start=1)
+    ], safe=False)
+
+
+async def top_ranked(collection, match, score_field, limit):
+    """``leaderboards.top_ranked`` over raw documents: the first ``limit`` by (-score, user_id)"""
+    rows = await collection.find(match).sort([(score_field, -1), ('user_id', -1)]).limit(limit).to_list(None)
+    if not rows:
+        return rows
+    boundary = rows[-1][score_field]
+    above = sorted(
+        (row for row in rows if row[score_field] > boundary),
+        key=lambda row: (-row[score_field], row['user_id'])
+    )
+    tied = await collection.find({**match, score_field: boundary}).sort('user_id', 1).limit(
+        limit - len(above)
+    ).to_list(None)
+    return above + tied
+
+
+@async_get
+async def team_leaderboard(request):
+    """Team leaderboard, sharing the synchronous view's cache entries and ETags"""
+    limit = int(request.GET.get('limit', 10))
+    version = await cache.aget_or_set(leaderboards.TEAM_LEADERBOARD_VERSION_KEY, 1, None)
+    key = f'team-leaderboard:{version}:{limit}'
+    cached = await cache.aget(key)
+    record_cache_lookup('team_leaderboard', hit=cached is not None)
+    if cached is None:
+        teams = []
+        if limit > 0:
+            teams = await database().teams.find(
+                {}, {'name': 1, 'total_points': 1, 'member_count': 1}
+            ).sort([('total_points', -1), ('_id', 1)]).limit(limit).to_list(None)
+        data = [
+            {
+                'team_id': str(team['_id']),
+                'team_name': team['name'],
+                'total_points': team['total_points'],
+                'member_count': team['member_count'],
+                'rank': rank
+            }
+            for rank, team in enumerate(teams, start=1)
+        ]
+        cached = (data, leaderboards.payload_etag(data))
+        await cache.aset(key, cached, leaderboards.TEAM_LEADERBOARD_TIMEOUT)
+
+    data, etag = cached
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponse(status=304)
+    else:
+        response = JsonResponse(data, safe=False)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@async_get
+async def activity_list(request):
+    """Activities newest first, filtered and paged like ``/api/activities/``"""
+    user = await sync_to_async(get_user)(request)
+    db = database()
+    match = {}
+
+    user_id = request.GET.get('user')
+    team_id = request.GET.get('team')
+    if user_id:
+        try:
+            match['user_id'] = int(user_id)
+        except ValueError:
+            raise ValidationError({'user': 'Enter a whole number.'})
+    elif team_id:
+        try:
+            team_id = ObjectId(team_id)
+        except InvalidId:
+            raise ValidationError({'team': 'Enter a valid team id.'})
+        memberships = await db.teams_members.find({'team_id': team_id}, {'user_id': 1}).to_list(None)
+        match['user_id'] = {'$in': [membership['user_id'] for membership in memberships]}
+    elif user.is_authenticated and not user.is_staff:
+        match['user_id'] = user.id
+
+    activity_type = request.GET.get('type')
+    if activity_type:
+        match['activity_type'] = activity_type
+    match.update(_date_match(request))
+
+    # Same page sizes and cursors as KeysetPagination over ('-date', '_id')
+    paginator = KeysetPagination()
+    page_size = paginator.get_page_size(QueryParams(request))
+    cursor = request.GET.get(paginator.cursor_query_param)
+    if cursor:
+        try:
+            date, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            date, pk = parse_datetime(date), ObjectId(pk)
+            if date is None:
+                raise ValueError(cursor)
+        except Exception:
+            return JsonResponse({'detail': paginator.invalid_cursor_message}, status=404)
+        match = {'$and': [match, {'$or': [
+            {'date': {'$lt': date}},
+            {'date': date, '_id': {'$gt': pk}},
+        ]}]}
+
+    rows = await db.activities.find(match).sort([('date', -1), ('_id', 1)]).limit(page_size + 1).to_list(None)
+    page = rows[:page_size]
+    users = await _usernames(db, {row['user_id'] for row in page})
+
+    next_link = None
+    if len(rows) > page_size:
+        last = page[-1]
+        position = json.dumps([last['date'].isoformat(), str(last['_id'])])
+        query = request.GET.copy()
+        query[paginator.cursor_query_param] = base64.urlsafe_b64encode(position.encode()).decode()
+        next_link = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+    return JsonResponse({
+        'next': next_link,
+        'results': [
+            {
+                '_id': str(row['_id']),
+                'user': row['user_id'],
+                'user_name': users.get(row['user_id']),
+                'activity_type': row['activity_type'],
+                'duration': row['duration'],
+                'distance': row.get('distance'),
+                'calories': row.get('calories'),
+                'points_earned': row['points_earned'],
+                'notes': row.get('notes'),
+                'date': _datetime(row['date']),
+                'created_at': _datetime(row['created_at']) if row.get('created_at') else None,
+            }
+            for row in page
+        ],
+    })
+
+
+@async_get
+async def activity_summary(request):
+    """Activity summary for the current user, like ``/api/activities/summary/``"""
+    user = await sync_to_async(get_user)(request)
+    match = {'user_id': user.id, **_date_match(request)}
+    groups = await database().activities.aggregate([
+        {'$match': match},
+        {'$group': {
+            '_id': '$activity_type',
+            'count': {'$sum': 1},
+            'duration': {'$sum': '$duration'},
+            'distance': {'$sum': '$distance'},
+            'points': {'$sum': '$points_earned'},
+        }},
+        {'$sort': {'_id': 1}},
+    ]).to_list(None)
+
+    summary = {
+        'total_activities': 0,
+        'total_duration': 0,
+        'total_distance': 0,
+        'total_points': 0,
+        'activity_breakdown': {}
+    }
+    for group in groups:
+        summary['total_activities'] += group['count']
+        summary['total_duration'] += group['duration']
+        summary['total_distance'] += group['distance']
+        summary['total_points'] += group['points']
+        summary['activity_breakdown'][group['_id']] = group['count']
+    return JsonResponse(summary)
+
+
+async def _usernames(db, user_ids):
+    users = await db.auth_user.find({'id': {'$in': list(user_ids)}}, {'id': 1, 'username': 1}).to_list(None)
+    return {user['id']: user['username'] for user in users}
+
+
+async def _team_names(db, team_ids):
+    team_ids = list({team_id for team_id in team_ids if team_id is not None})
+    if not team_ids:
+        return {}
+    teams = await db.teams.find({'_id': {'$in': team_ids}}, {'name': 1}).to_list(None)
+    return {team['_id']: team['name'] for team in teams}
+
+
+def _date_match(request):
+    start_date = parse_date_param(QueryParams(request), 'start_date')
+    end_date = parse_date_param(QueryParams(request), 'end_date')
+    if not (start_date or end_date):
+        return {}
+    match = {}
+    if start_date:
+        match['$gte'] = start_date
+    if end_date:
+        match['$lte'] = end_date
+    return {'date': match}
@@ -0,0 +1,299 @@
+"""Incremental challenge progress.
+
+Each participant's progress is a ``ChallengeProgress`` document. Joining a
+challenge builds it from the activities already logged inside the
+challenge's dates; after that ``scoring`` forwards activity writes here and
+every matching change is one ``$inc`` on the participant's document.
+Activity changes reach this module through the job queue, so a change can
+still be queued when a rebuild has already counted it. The rebuild stamps
+``rebuilt_at`` and changes recorded before it are skipped.
+Standings and a participant's rank are read from those documents, never by
+aggregating activities.
+
+Completion is claimed with a conditional update that only matches a
+progress document at or past the target with no ``completed_at``, so the
+reward is granted exactly once even when concurrent writes cross the
+target together. A completion is final: removing activities later does not
+take the reward back, and leaving and rejoining does not grant it again.
+Editing a challenge's dates, target, type or activity types rebuilds its
+participants' progress under the new definition, which can complete it.
+The caller adds the returned rewards to the winners' points.
+
+Challenge status (upcoming, active or ended) is derived from the dates.
+The ids of the active challenges are cached until the next time any
+challenge starts or ends, so listing active challenges is a lookup by id
+rather than a two-sided date range scan. Creating, editing or deleting a
+challenge invalidates the cached ids.
+"""
+import math
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from . import jobs
+from .leaderboards import neighborhood, top_ranked
+from .metrics import record_cache_lookup
+from .models import Activity, Challenge, ChallengeProgress
+
+STATUSES = ('upcoming', 'active', 'ended')
+
+# Fields that decide which activities count and when a participant completes
+DEFINITION_FIELDS = ('challenge_type', 'target_value', 'activity_types', 'start_date', 'end_date')
+
+ACTIVE_CHALLENGES_VERSION_KEY = 'active-challenges:version'
+
+# Safety net for changes made outside the API (admin, shell)
+ACTIVE_CHALLENGES_TIMEOUT = 300
+
+
+def status_filter(status, now):
+    """Filter for challenges in ``status`` at ``now``
+
+    Ended challenges also started before ``now``, which bounds the leading
+    ``start_date`` column of the (start_date, end_date) index.
+    """
+    if status == 'upcoming':
+        return Q(start_date__gt=now)
+    if status == 'ended':
+        return Q(start_date__lt=now, end_date__lt=now)
+    return Q(pk__in=active_challenge_ids(now))
+
+
+def active_challenge_ids(now):
+    """Ids of the challenges active at ``now``, cached until the next boundary"""
+    version = cache.get_or_set(ACTIVE_CHALLENGES_VERSION_KEY, 1, None)
+    key = f'active-challenges:{version}'
+    cached = cache.get(key)
+    hit = cached is not None and (cached[1] is None or now < cached[1])
+    record_cache_lookup('active_challenges', hit=hit)
+    if hit:
+        return cached[0]
+
+    active = list(
+        Challenge.objects.filter(start_date__lte=now, end_date__gte=now).values_list('pk', 'end_date')
+    )
+    next_start = Challenge.objects.filter(start_date__gt=now).order_by('start_date').values_list(
+        'start_date', flat=True
+    ).first()
+    boundaries = [end_date for pk, end_date in active] + ([next_start] if next_start else [])
+    valid_until = min(boundaries, default=None)
+    timeout = ACTIVE_CHALLENGES_TIMEOUT
+    if valid_until is not None:
+        timeout = max(min(math.ceil((valid_until - now).total_seconds()), timeout), 1)
+    ids = [pk for pk, end_date in active]
+    cache.set(key, (ids, valid_until), timeout)
+    return ids
+
+
+def invalidate_active_challenges():
+    """Mark the cached active challenge ids as stale"""
+    try:
+        cache.incr(ACTIVE_CHALLENGES_VERSION_KEY)
+    except ValueError:
+        cache.set(ACTIVE_CHALLENGES_VERSION_KEY, 1, None)
+
+
+def contribution(challenge, stats):
+    """How much an activity snapshot adds to ``challenge``, or None if it does not count"""
+    if not challenge.start_date <= stats['date'] <= challenge.end_date:
+        return None
+    if challenge.activity_types and stats['activity_type'] not in challenge.activity_types:
+        return None
+    if challenge.challenge_type == 'distance':
+        return stats['distance'] or 0
+    if challenge.challenge_type == 'duration':
+        return stats['duration']
+    if challenge.challenge_type == 'points':
+        return stats['points_earned']
+    return 1
+
+
+def activities_changed(changes, recorded_at=None, marker=None):
+    """Apply ``(snapshot, sign)`` pairs to the owners' challenges
+
+    ``recorded_at`` is when the changes were made; progress rebuilt since
+    then already includes them. ``marker`` is the job step's, see
+    ``jobs``. Returns ``(user_id, points)`` for every completion this caused.
+    """
+    user_ids = {stats['user_id'] for stats, sign in changes}
+    memberships = list(
+        Challenge.participants.through.objects.filter(user_id__in=list(user_ids))
+        .values_list('user_id', 'challenge_id')
+    )
+    if not memberships:
+        return []
+    challenges = Challenge.objects.in_bulk({challenge_id for user_id, challenge_id in memberships})
+
+    deltas = {}
+    for stats, sign in changes:
+        for user_id, challenge_id in memberships:
+            if user_id != stats['user_id']:
+                continue
+            amount = contribution(challenges[challenge_id], stats)
+            if amount is None:
+                continue
+            delta = deltas.setdefault((challenge_id, user_id), {'value': 0, 'activity_count': 0})
+            delta['value'] += sign * amount
+            delta['activity_count'] += sign
+
+    awards = []
+    for (challenge_id, user_id), delta in deltas.items():
+        challenge = challenges[challenge_id]
+        participant = {'challenge_id': challenge_id, 'user_id': user_id}
+        match = {**participant, **jobs.unapplied(marker)}
+        if recorded_at is not None:
+            match['$or'] = [{'rebuilt_at': None}, {'rebuilt_at': {'$lt': recorded_at}}]
+        progress = ChallengeProgress.objects.mongo_find_one_and_update(
+            match, jobs.mark_applied({'$inc': delta}, marker), return_document=ReturnDocument.AFTER,
+        )
+        if progress is None:
+            if ChallengeProgress.objects.mongo_find_one(participant, {'_id': 1}) is None:
+                # Joined before progress was tracked; build it from the history
+                awards += participant_joined(challenge, user_id)
+        elif progress['completed_at'] is None and progress['value'] >= challenge.target_value:
+            awards += _complete(challenge, user_id)
+    return awards
+
+
+def participant_joined(challenge, user_id):
+    """Build or refresh a participant's progress from their activities
+
+    Returns ``(user_id, points)`` if the participant completes on joining.
+    """
+    # Taken before reading, so changes recorded after it are applied on top
+    rebuilt_at = timezone.now()
+    activities = Activity.objects.filter(
+        user_id=user_id,
+        date__gte=challenge.start_date,
+        date__lte=challenge.end_date,
+    )
+    if challenge.activity_types:
+        activities = activities.filter(activity_type__in=challenge.activity_types)
+    totals = activities.aggregate(
+        distance=Sum('distance'),
+        duration=Sum('duration'),
+        points=Sum('points_earned'),
+        count=Count('pk'),
+    )
+    value = {
+        'distance': totals['distance'],
+        'duration': totals['duration'],
+        'points': totals['points'],
+        'frequency': totals['count'],
+    }[challenge.challenge_type] or 0
+
+    update = (
+        {'challenge_id': challenge.pk, 'user_id': user_id},
+        {
+            '$set': {
+                'value': value, 'activity_count': totals['count'] or 0, 'left_at': None, 'rebuilt_at': rebuilt_at,
+            },
+            '$setOnInsert': {'completed_at': None, 'points_awarded': 0},
+        },
+    )
+    try:
+        ChallengeProgress.objects.mongo_update_one(*update, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent join created the document first; now it matches
+        ChallengeProgress.objects.mongo_update_one(*update)
+    if value >= challenge.target_value:
+        return _complete(challenge, user_id)
+    return []
+
+
+def participant_left(challenge, user_id):
+    """Drop a participant from the standings, keeping any completion on record"""
+    ChallengeProgress.objects.mongo_update_one(
+        {'challenge_id': challenge.pk, 'user_id': user_id},
+        {'$set': {'left_at': timezone.now()}},
+    )
+
+
+def rebuild_challenge(challenge):
+    """Recompute the progress of every participant in one challenge
+
+    Returns ``(user_id, points)`` for completions this caused.
+    """
+    awards = []
+    participants = Challenge.participants.through.objects.filter(challenge_id=challenge.pk)
+    for user_id in participants.values_list('user_id', flat=True):
+        awards += participant_joined(challenge, user_id)
+    return awards
+
+
+def rebuild():
+    """Recompute every participant's progress from the activity history
+
+    Returns ``(user_id, points)`` for completions that had not been recorded.
+    """
+    awards = []
+    participants = set(Challenge.participants.through.objects.values_list('challenge_id', 'user_id'))
+    challenges = Challenge.objects.in_bulk({challenge_id for challenge_id, user_id in participants})
+    for challenge_id, user_id in participants:
+        awards += participant_joined(challenges[challenge_id], user_id)
+    for challenge_id, user_id in _current().values_list('challenge_id', 'user_id'):
+        if (challenge_id, user_id) not in participants:
+            ChallengeProgress.objects.mongo_update_one(
+                {'challenge_id': challenge_id, 'user_id': user_id},
+                {'$set': {'left_at': timezone.now()}},
+            )
+    return awards
+
+
+def standings(challenge, limit):
+    """Standings rows for the ``limit`` participants furthest along"""
+    return progress_entries(challenge, top_ranked(_participants(challenge), 'value', limit), first_rank=1)
+
+
+def participant_progress(challenge, user_id):
+    """The participant's standings row with their rank, or None if not participating"""
+    rank, rows = neighborhood(
+        _participants(challenge), 'value', user_id, 0,
+        lambda rows, first_rank: progress_entries(challenge, rows, first_rank)
+    )
+    return rows[0] if rows else None
+
+
+def progress_entries(challenge, rows, first_rank):
+    """Standings rows for consecutively ranked progress documents"""
+    return [
+        {
+            'user_id': progress.user_id,
+            'username': progress.user.username,
+            'value': progress.value,
+            'target_value': challenge.target_value,
+            'percent_complete': round(min(progress.value / challenge.target_value, 1) * 100, 1)
+            if challenge.target_value else 100.0,
+            'activity_count': progress.activity_count,
+            'completed': progress.completed_at is not None,
+            'completed_at': progress.completed_at,
+            'points_awarded': progress.points_awarded,
+            'rank': rank
+        }
+        for rank, progress in enumerate(rows, start=first_rank)
+    ]
+
+
+def _current():
+    return ChallengeProgress.objects.filter(left_at__isnull=True)
+
+
+def _participants(challenge):
+    return _current().filter(challenge=challenge).select_related('user')
+
+
+def _complete(challenge, user_id):
+    """Record the completion if nobody has yet; the winner gets the reward"""
+    claimed = ChallengeProgress.objects.mongo_find_one_and_update(
+        {
+            'challenge_id': challenge.pk,
+            'user_id': user_id,
+            'completed_at': None,
+            'value': {'$gte': challenge.target_value},
+        },
+        {'$set': {'completed_at': timezone.now(), 'points_awarded': challenge.points_reward}},
+    )
+    if claimed is None or not challenge.points_reward:
+        return []
+    return [(user_id, challenge.points_reward)]
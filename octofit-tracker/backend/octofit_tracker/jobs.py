@@ -0,0 +1,308 @@
+"""Durable in-process job queue for side effects of API writes.
+
+``enqueue`` inserts a document into the ``jobs`` collection, so a queued
+job survives restarts without any broker. Worker threads in the same
+process claim jobs with a conditional update that sets a lease. A job is
+deleted once its handler succeeds. A failed job is retried after a delay,
+and is left ``failed`` after too many attempts. If the worker dies, the
+lease runs out and another worker claims the job again. Delivery is
+therefore at least once.
+
+The worker renews its lease while the handler runs, and a claim gives
+the job a new lease token. A worker that loses its lease stops at the
+next step. It leaves the job alone: deleting it and recording a failure
+are both conditional on the token.
+
+Handlers split their work into named steps with ``QueuedJob.step``. Each
+step that succeeds is recorded on the job, and a redelivered job skips
+completed steps. A step that fails part way is run again, so its writes
+must be idempotent on their own. Each step gets a marker. It filters its
+updates with ``unapplied(marker)`` and records the marker with
+``mark_applied``. The marker is pushed onto an ``applied_jobs`` array in
+each document, which keeps the last ``APPLIED_HISTORY`` markers. A
+redelivered step therefore skips the documents it already wrote, unless
+that many other steps have written the same document in between. The
+rebuild and recompute commands reconcile that case.
+
+The pool starts on the first ``enqueue`` in a process, and
+``manage.py run_jobs`` works through the queue from a separate process.
+Settings come from ``OCTOFIT_JOBS``.
+"""
+import logging
+import threading
+import time
+import traceback
+from datetime import timedelta
+from bson import ObjectId
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from pymongo import ReturnDocument
+from . import mongo
+from .metrics import JOB_DURATION, JOBS_PROCESSED
+from .models import Job
+
+logger = logging.getLogger('octofit_tracker.jobs')
+
+DEFAULTS = {
+    'EAGER': False,
+    'WORKERS': 2,
+    'POLL_INTERVAL': 1.0,
+    'LEASE_SECONDS': 60,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_DELAY': 5,
+}
+
+# Job step markers kept on each document, newest last
+APPLIED_HISTORY = 200
+
+HANDLERS = {}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_JOBS', {})}
+
+
+def handler(kind):
+    """Register the decorated function as the handler for jobs of ``kind``"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+class LeaseLost(Exception):
+    """Another worker claimed the job after this worker's lease ran out"""
+
+
+class QueuedJob:
+    """A claimed job as seen by its handler"""
+
+    def __init__(self, document):
+        self.id = document.get('_id')
+        self.kind = document['kind']
+        self.payload = document['payload']
+        self.attempts = document.get('attempts', 0)
+        self.done_steps = list(document.get('done_steps', []))
+        self.lease = document.get('lease')
+        self.lease_lost = False
+
+    def step(self, name, func, *args):
+        """Run one side effect unless an earlier delivery of this job completed it
+
+        ``func`` is called with ``marker=`` for its idempotent writes.
+        """
+        if self.lease_lost:
+            raise LeaseLost(f'Job {self.id} was claimed by another worker')
+        if name in self.done_steps:
+            return None
+        result = func(*args, marker=None if self.id is None else f'{self.id}:{name}')
+        if self.id is not None:
+            Job.objects.mongo_update_one({'_id': self.id}, {'$addToSet': {'done_steps': name}})
+        self.done_steps.append(name)
+        return result
+
+    def owned(self):
+        """Filter matching the job while this worker holds its lease"""
+        return {'_id': self.id, 'lease': self.lease}
+
+
+class Heartbeat(threading.Thread):
+    """Renews a running job's lease until stopped, noting when it was lost
+
+    Renewals go through a pymongo collection rather than the ORM, whose
+    connections belong to the worker's thread.
+    """
+
+    def __init__(self, job, collection, lease_seconds):
+        super().__init__(name=f'octofit-jobs-lease-{job.id}', daemon=True)
+        self.job = job
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.lease_seconds / 3):
+            locked_until = timezone.now() + timedelta(seconds=self.lease_seconds)
+            try:
+                result = self.collection.update_one(self.job.owned(), {'$set': {'locked_until': locked_until}})
+            except Exception:
+                logger.exception('Could not renew the lease of job %s', self.job.id)
+                continue
+            if result.matched_count == 0:
+                self.job.lease_lost = True
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def unapplied(marker):
+    """Filter for documents that the job step behind ``marker`` has not written yet"""
+    return {} if marker is None else {'applied_jobs': {'$ne': marker}}
+
+
+def mark_applied(update, marker):
+    """Add recording ``marker`` on the written document to ``update``"""
+    if marker is not None:
+        update['$push'] = {'applied_jobs': {'$each': [marker], '$slice': -APPLIED_HISTORY}}
+    return update
+
+
+def enqueue(kind, payload):
+    """Queue a job, or run it straight away when ``EAGER`` is set"""
+    if kind not in HANDLERS:
+        raise ValueError(f'No handler registered for {kind} jobs')
+    if options()['EAGER']:
+        _execute(QueuedJob({'kind': kind, 'payload': payload}))
+        return
+    now = timezone.now()
+    Job.objects.mongo_insert_one({
+        'kind': kind,
+        'payload': payload,
+        'status': 'pending',
+        'attempts': 0,
+        'run_after': now,
+        'locked_until': None,
+        'lease': None,
+        'done_steps': [],
+        'last_error': '',
+        'created_at': now,
+    })
+    start().wake()
+
+
+def claim():
+    """Lease the oldest due job, including jobs whose worker's lease ran out"""
+    now = timezone.now()
+    document = Job.objects.mongo_find_one_and_update(
+        {'$or': [
+            {'status': 'pending', 'run_after': {'$lte': now}},
+            {'status': 'running', 'locked_until': {'$lte': now}},
+        ]},
+        {
+            '$set': {
+                'status': 'running',
+                'locked_until': now + timedelta(seconds=options()['LEASE_SECONDS']),
+                'lease': ObjectId(),
+            },
+            '$inc': {'attempts': 1},
+        },
+        sort=[('run_after', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    return None if document is None else QueuedJob(document)
+
+
+def run_next():
+    """Claim and run one job; False when none is due"""
+    job = claim()
+    if job is None:
+        return False
+    heartbeat = Heartbeat(job, mongo.database()[Job._meta.db_table], options()['LEASE_SECONDS'])
+    heartbeat.start()
+    try:
+        _execute(job)
+    except LeaseLost:
+        logger.warning('Job %s (%s) outlived its lease and was left to the worker that claimed it', job.id, job.kind)
+    except Exception:
+        _failed(job, traceback.format_exc())
+    else:
+        Job.objects.mongo_delete_one(job.owned())
+    finally:
+        heartbeat.stop()
+    return True
+
+
+def drain():
+    """Run due jobs in this thread until none are left; returns how many ran"""
+    count = 0
+    while run_next():
+        count += 1
+    return count
+
+
+def start():
+    """The worker pool for this process, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(options()['WORKERS'], options()['POLL_INTERVAL'])
+            _pool.start()
+        return _pool
+
+
+def stop(timeout=None):
+    """Stop this process's worker pool, if it was started"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.stop(timeout)
+
+
+class WorkerPool:
+    """Daemon threads that claim and run jobs until the process exits"""
+
+    def __init__(self, workers, poll_interval):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'octofit-jobs-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        """Tell idle workers a job was queued"""
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                close_old_connections()
+                ran = run_next()
+            except Exception:
+                logger.exception('Job worker could not reach the queue')
+                ran = False
+            if not ran:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+
+def _execute(job):
+    started = time.perf_counter()
+    try:
+        HANDLERS[job.kind](job)
+    except Exception:
+        JOBS_PROCESSED.inc(kind=job.kind, outcome='error')
+        raise
+    finally:
+        JOB_DURATION.observe(time.perf_counter() - started, kind=job.kind)
+    JOBS_PROCESSED.inc(kind=job.kind, outcome='success')
+
+
+def _failed(job, error):
+    config = options()
+    if job.attempts >= config['MAX_ATTEMPTS']:
+        logger.error('Job %s (%s) failed for good after %d attempts:\n%s', job.id, job.kind, job.attempts, error)
+        update = {'status': 'failed', 'locked_until': None, 'last_error': error}
+    else:
+        logger.warning('Job %s (%s) failed on attempt %d, will retry:\n%s', job.id, job.kind, job.attempts, error)
+        retry_at = timezone.now() + timedelta(seconds=config['RETRY_DELAY'] * job.attempts)
+        update = {'status': 'pending', 'locked_until': None, 'run_after': retry_at, 'last_error': error}
+    Job.objects.mongo_update_one(job.owned(), {'$set': update})
@@ -0,0 +1,213 @@
+"""Windowed leaderboards for the last 7 days, the last 30 days and the season.
+
+Each user's score in each window is a ``WindowScore`` document, indexed on
+``(window, points, user)`` so top-N reads and rank counts are index range
+scans instead of aggregations over the window's activities. Ties rank
+the same way as on the overall leaderboard, see ``leaderboards``.
+
+Activity writes add to every window whose range includes the activity's
+day. ``LeaderboardWindow`` records the day each window was last advanced
+to. Once a day the first windowed read advances it and subtracts the
+daily rollup buckets that slid out of the range. Seasons are calendar
+quarters, and a new season is rebuilt from the rollups. Windows without
+a state yet are built from the rollups on first use.
+"""
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from django.utils import timezone
+from . import jobs, rollups
+from .leaderboards import neighborhood, top_ranked
+from .models import ActivityRollup, LeaderboardWindow, UserProfile, WindowScore
+
+# Days per sliding window; None marks the season, which resets instead
+WINDOWS = {
+    '7d': 7,
+    '30d': 30,
+    'season': None,
+}
+
+SEASON_MONTHS = 3
+
+TOTALS = ('points', 'activity_count', 'total_calories')
+
+DUPLICATE_KEY = 11000
+
+
+def season_start(day):
+    """First day of the season (calendar quarter) containing ``day``"""
+    month = (day.month - 1) // SEASON_MONTHS * SEASON_MONTHS + 1
+    return day.replace(month=month, day=1)
+
+
+def window_start(window, day):
+    """First day counted by ``window`` when its newest day is ``day``"""
+    days = WINDOWS[window]
+    if days is None:
+        return season_start(day)
+    return day - timedelta(days=days - 1)
+
+
+def activities_changed(changes, marker=None):
+    """Apply ``(snapshot, sign)`` pairs from ``scoring.snapshot`` to the window scores"""
+    states = dict(LeaderboardWindow.objects.values_list('window', 'as_of'))
+    deltas = defaultdict(lambda: dict.fromkeys(TOTALS, 0))
+    for stats, sign in changes:
+        day = rollups.period_start(stats['date'], 'day')
+        for window, as_of in states.items():
+            if day >= window_start(window, _naive(as_of)):
+                delta = deltas[(window, stats['user_id'])]
+                delta['points'] += sign * stats['points_earned']
+                delta['activity_count'] += sign
+                delta['total_calories'] += sign * stats['calories']
+    _write(deltas, marker)
+
+
+def ensure_current():
+    """Advance every window to today, building any that do not exist yet"""
+    today = rollups.period_start(timezone.now(), 'day')
+    states = dict(LeaderboardWindow.objects.values_list('window', 'as_of'))
+    for window in WINDOWS:
+        if window not in states:
+            try:
+                LeaderboardWindow.objects.mongo_insert_one({'window': window, 'as_of': today})
+            except DuplicateKeyError:
+                continue
+            rebuild(window, today)
+        elif _naive(states[window]) < today:
+            _advance(window, _naive(states[window]), today)
+
+
+def rebuild(window, today):
+    """Recompute one window's scores from the daily rollup buckets"""
+    WindowScore.objects.mongo_delete_many({'window': window})
+    totals = _user_totals({'$gte': window_start(window, today)})
+    _write({(window, user_id): row for user_id, row in totals.items()})
+
+
+def rebuild_all():
+    """Recompute every window as of today, e.g. after the rollups were rebuilt"""
+    today = rollups.period_start(timezone.now(), 'day')
+    for window in WINDOWS:
+        LeaderboardWindow.objects.mongo_update_one(
+            {'window': window}, {'$set': {'as_of': today}}, upsert=True
+        )
+        rebuild(window, today)
+
+
+def leaderboard(window, limit):
+    """Leaderboard rows for the top ``limit`` users of ``window``"""
+    if limit < 1:
+        return []
+    ensure_current()
+    return _entries(top_ranked(_scores(window), 'points', limit), first_rank=1)
+
+
+def user_neighborhood(window, user_id, radius):
+    """``(rank, rows)`` around ``user_id`` on the ``window`` leaderboard"""
+    ensure_current()
+    return neighborhood(_scores(window), 'points', user_id, radius, _entries)
+
+
+def _scores(window):
+    return WindowScore.objects.filter(window=window, activity_count__gt=0).select_related('user')
+
+
+def _entries(scores, first_rank):
+    teams = dict(
+        UserProfile.objects.filter(user_id__in=[score.user_id for score in scores])
+        .values_list('user_id', 'primary_team__name')
+    )
+    return [
+        {
+            'user_id': score.user_id,
+            'username': score.user.username,
+            'total_points': score.points,
+            'activity_count': score.activity_count,
+            'total_calories': score.total_calories,
+            'team_name': teams.get(score.user_id),
+            'rank': rank
+        }
+        for rank, score in enumerate(scores, start=first_rank)
+    ]
+
+
+def _advance(window, as_of, today):
+    # Only the process whose conditional update wins expires the old days
+    claimed = LeaderboardWindow.objects.mongo_find_one_and_update(
+        {'window': window, 'as_of': as_of}, {'$set': {'as_of': today}}
+    )
+    if claimed is None:
+        return
+    old_start, new_start = window_start(window, as_of), window_start(window, today)
+    if WINDOWS[window] is None:
+        if new_start != old_start:
+            rebuild(window, today)
+        return
+
+    expired = _user_totals({'$gte': old_start, '$lt': new_start})
+    _write({
+        (window, user_id): {field: -value for field, value in row.items()}
+        for user_id, row in expired.items()
+    })
+    WindowScore.objects.mongo_delete_many({'window': window, 'activity_count': {'$lte': 0}})
+
+
+def _user_totals(period):
+    """Sum each user's daily rollup buckets whose start matches ``period``"""
+    groups = ActivityRollup.objects.mongo_aggregate([
+        {'$match': {'team_id': None, 'granularity': 'day', 'period_start': period}},
+        {'$group': {
+            '_id': '$user_id',
+            'points': {'$sum': '$points'},
+            'activity_count': {'$sum': '$count'},
+            'total_calories': {'$sum': '$calories'},
+        }},
+    ])
+    return {group.pop('_id'): group for group in groups}
+
+
+def _naive(value):
+    """Stored datetimes as naive UTC, matching the rollup bucket starts"""
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _write(deltas, marker=None):
+    """Upsert each user's window score with ``$inc``, skipping scores the ``marker``'s job step wrote"""
+    operations = []
+    for (window, user_id), delta in deltas.items():
+        inc = {field: value for field, value in delta.items() if value}
+        if not inc:
+            continue
+        operations.append(UpdateOne(
+            {'window': window, 'user_id': user_id, **jobs.unapplied(marker)},
+            jobs.mark_applied(
+                {'$inc': inc, '$setOnInsert': {field: 0 for field in TOTALS if field not in inc}}, marker
+            ),
+            upsert=True
+        ))
+    if not operations:
+        return
+    try:
+        WindowScore.objects.mongo_bulk_write(operations, ordered=False)
+    except BulkWriteError as exc:
+        retry = _duplicates(exc, operations)
+        # A concurrent writer created the score first; now it matches
+        try:
+            WindowScore.objects.mongo_bulk_write(retry, ordered=False)
+        except BulkWriteError as exc:
+            if marker is None:
+                raise
+            # The score exists and carries the marker: already applied
+            _duplicates(exc, retry)
+
+
+def _duplicates(exc, operations):
+    """The operations of a bulk write that failed on the unique index, re-raising any other error"""
+    errors = exc.details['writeErrors']
+    if any(error['code'] != DUPLICATE_KEY for error in errors):
+        raise exc
+    return [operations[error['index']] for error in errors]
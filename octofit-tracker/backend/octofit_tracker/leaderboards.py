@@ -0,0 +1,164 @@
+"""Leaderboard rankings and cached leaderboard payloads.
+
+Rankings are built from the denormalized totals kept by ``scoring``. Users
+are ordered by score, highest first, and users with the same score by
+ascending user id, so every user has one stable rank: one plus the number
+of users ahead of them. A user's rank and neighbours are found with
+counts and short index range reads around their own score, never by
+reading the ranking from the top.
+
+Team rankings are stored in the Django cache under a version number. Any
+change to team points or membership bumps the version, so the next
+request rebuilds the ranking while unchanged rankings are served without
+touching MongoDB.
+"""
+import hashlib
+import json
+from django.core.cache import cache
+from django.db.models import Q
+from . import repository
+from .models import Team, UserProfile
+from .metrics import record_cache_lookup
+
+TEAM_LEADERBOARD_VERSION_KEY = 'team-leaderboard:version'
+
+# Safety net for changes made outside the API (admin, shell)
+TEAM_LEADERBOARD_TIMEOUT = 300
+
+
+def invalidate_team_leaderboard():
+    """Mark every cached team ranking as stale"""
+    try:
+        cache.incr(TEAM_LEADERBOARD_VERSION_KEY)
+    except ValueError:
+        cache.set(TEAM_LEADERBOARD_VERSION_KEY, 1, None)
+
+
+def team_leaderboard(limit):
+    """Return ``(data, etag)`` for the top ``limit`` teams"""
+    version = cache.get_or_set(TEAM_LEADERBOARD_VERSION_KEY, 1, None)
+    key = f'team-leaderboard:{version}:{limit}'
+    cached = cache.get(key)
+    record_cache_lookup('team_leaderboard', hit=cached is not None)
+    if cached is None:
+        teams = repository.find(
+            Team, {}, fields=['name', 'total_points', 'member_count'], sort=['-total_points', '_id'], limit=limit,
+            read_only=True,
+        ) if limit > 0 else []
+        data = [
+            {
+                'team_id': str(team.pk),
+                'team_name': team.name,
+                'total_points': team.total_points,
+                'member_count': team.member_count,
+                'rank': rank
+            }
+            for rank, team in enumerate(teams, start=1)
+        ]
+        cached = (data, payload_etag(data))
+        cache.set(key, cached, TEAM_LEADERBOARD_TIMEOUT)
+    return cached
+
+
+def payload_etag(data):
+    """Strong ETag for a JSON-serializable payload"""
+    digest = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def user_leaderboard(limit):
+    """Leaderboard rows for the top ``limit`` users by total points
+
+    The busiest read in the API, so it goes through ``repository`` with the
+    read-only endpoints' read preference.
+    """
+    if limit < 1:
+        return []
+    profiles = repository.top_ranked(
+        UserProfile, {}, 'total_points', limit,
+        fields=['user_id', 'total_points', 'activity_count', 'total_calories', 'primary_team_id'],
+        read_only=True,
+    )
+    repository.attach(profiles, 'user', fields=['username'], read_only=True)
+    repository.attach(profiles, 'primary_team', fields=['name'], read_only=True)
+    return profile_entries(profiles, first_rank=1)
+
+
+def user_neighborhood(user_id, radius):
+    """``(rank, rows)`` around ``user_id`` on the overall leaderboard, see ``neighborhood``"""
+    return neighborhood(_profiles(), 'total_points', user_id, radius, profile_entries)
+
+
+def profile_entries(profiles, first_rank):
+    """Leaderboard rows for consecutively ranked profiles"""
+    return [
+        {
+            'user_id': profile.user_id,
+            'username': profile.user.username,
+            'total_points': profile.total_points,
+            'activity_count': profile.activity_count,
+            'total_calories': profile.total_calories,
+            'team_name': profile.primary_team.name if profile.primary_team else None,
+            'rank': rank
+        }
+        for rank, profile in enumerate(profiles, start=first_rank)
+    ]
+
+
+def neighborhood(queryset, score_field, user_id, radius, entries):
+    """Rank of ``user_id`` and the rows from ``radius`` places above to ``radius`` below
+
+    ``entries(rows, first_rank)`` turns the ranked rows into leaderboard
+    rows. Returns ``(None, [])`` when the user has no row in ``queryset``.
+    """
+    row = queryset.filter(user_id=user_id).first()
+    if row is None:
+        return None, []
+    score = getattr(row, score_field)
+    ahead = Q(**{f'{score_field}__gt': score}) | Q(**{score_field: score, 'user_id__lt': user_id})
+    behind = Q(**{f'{score_field}__lt': score}) | Q(**{score_field: score, 'user_id__gt': user_id})
+    rank = queryset.filter(ahead).count() + 1
+    above = bottom_ranked(queryset.filter(ahead), score_field, radius)
+    below = top_ranked(queryset.filter(behind), score_field, radius)
+    return rank, entries(above + [row] + below, first_rank=rank - len(above))
+
+
+def top_ranked(queryset, score_field, limit):
+    """The first ``limit`` rows ordered by (-score, user_id)
+
+    Index keys are ascending only, so MongoDB reads the (score, user) index
+    backwards, which orders ties by descending user id. The group tied at
+    the cut-off is re-read in ascending user order to keep ties stable.
+    """
+    rows = list(queryset.order_by(f'-{score_field}', '-user_id')[:limit])
+    if not rows:
+        return rows
+    boundary = getattr(rows[-1], score_field)
+    above = sorted(
+        (row for row in rows if getattr(row, score_field) > boundary),
+        key=lambda row: (-getattr(row, score_field), row.user_id)
+    )
+    tied = queryset.filter(**{score_field: boundary}).order_by('user_id')[:limit - len(above)]
+    return above + list(tied)
+
+
+def bottom_ranked(queryset, score_field, limit):
+    """The last ``limit`` rows in (-score, user_id) order, in that order
+
+    The mirror image of ``top_ranked``: the index is read forwards and the
+    group tied at the cut-off is re-read by descending user id.
+    """
+    rows = list(queryset.order_by(score_field, 'user_id')[:limit])
+    if not rows:
+        return rows
+    boundary = getattr(rows[-1], score_field)
+    below = [row for row in rows if getattr(row, score_field) < boundary]
+    tied = queryset.filter(**{score_field: boundary}).order_by('-user_id')[:limit - len(below)]
+    return sorted(
+        below + list(tied),
+        key=lambda row: (-getattr(row, score_field), row.user_id)
+    )
+
+
+def _profiles():
+    return UserProfile.objects.select_related('user', 'primary_team')
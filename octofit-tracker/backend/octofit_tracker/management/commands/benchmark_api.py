@@ -0,0 +1,397 @@
+import io
+import itertools
+import json
+import math
+import platform
+import time
+import tracemalloc
+from collections import Counter
+from datetime import timedelta
+import django
+from bson import ObjectId
+from pymongo import monitoring
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from octofit_tracker import jobs
+from octofit_tracker.models import Activity, Team, Challenge, WorkoutSuggestion
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Count every command sent to MongoDB, including raw pymongo calls"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class Scenario:
+    """One benchmarked request
+
+    ``path`` may be a callable taking the value returned by ``setup``, for
+    requests that target an object created just before them. ``setup`` and
+    ``teardown`` run outside the timed section and keep every iteration
+    starting from the same state.
+    """
+
+    def __init__(self, name, method, path, user=None, data=None, headers=None, setup=None, teardown=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.user = user
+        self.data = data
+        self.headers = headers or {}
+        self.setup = setup
+        self.teardown = teardown
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = max(1, math.ceil(pct / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every API route against a freshly seeded test database and report '
+        'latency percentiles, query counts and peak memory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Users to seed (default: 200)')
+        parser.add_argument('--activities-per-user', type=int, default=20, help='Activities per user (default: 20)')
+        parser.add_argument('--teams', type=int, default=10, help='Teams to seed (default: 10)')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the generated data (default: 1)')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per route (default: 50)')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per route first (default: 5)')
+        parser.add_argument('--route', action='append', dest='routes', help='Only run this route (repeatable)')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Baseline JSON file from an earlier run to diff against')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Allowed p95 slowdown against the baseline before a route counts as a regression (default: 0.25)'
+        )
+        parser.add_argument(
+            '--in-memory', action='store_true',
+            help='Run against an in-memory mongomock database instead of the configured mongod'
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+        if options['in_memory']:
+            self.use_in_memory_database()
+
+        # Registered before the test database connects so the new client reports to it
+        self.commands = CommandCounter()
+        monitoring.register(self.commands)
+
+        # Queued side effects are applied by call() between requests, never
+        # by worker threads racing the timed requests
+        queue = override_settings(OCTOFIT_JOBS={**jobs.options(), 'EAGER': False, 'WORKERS': 0})
+        queue.enable()
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f'Seeding {options["users"]} users x {options["activities_per_user"]} activities...')
+            started = time.perf_counter()
+            self.seed(options)
+            self.stdout.write(f'Seeded in {time.perf_counter() - started:.1f}s\n')
+
+            scenarios = self.build_scenarios()
+            if options['routes']:
+                unknown = set(options['routes']) - {scenario.name for scenario in scenarios}
+                if unknown:
+                    raise CommandError(f'Unknown routes: {", ".join(sorted(unknown))}')
+                scenarios = [scenario for scenario in scenarios if scenario.name in options['routes']]
+
+            results = {}
+            for scenario in scenarios:
+                results[scenario.name] = self.run_scenario(scenario, options['iterations'], options['warmup'])
+                self.write_row(scenario.name, results[scenario.name])
+        finally:
+            jobs.stop()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            queue.disable()
+
+        report = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': 'in-memory' if options['in_memory'] else 'mongodb',
+                'users': options['users'],
+                'activities_per_user': options['activities_per_user'],
+                'teams': options['teams'],
+                'seed': options['seed'],
+                'iterations': options['iterations'],
+            },
+            'routes': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'\nResults written to {options["output"]}'))
+
+        if baseline is not None:
+            regressions = self.compare(baseline, report, options['tolerance'])
+            if regressions:
+                raise CommandError(f'{regressions} routes regressed against {options["compare"]}')
+
+    def use_in_memory_database(self):
+        try:
+            import mongomock
+        except ImportError:
+            raise CommandError('--in-memory requires mongomock (pip install mongomock)')
+        from djongo import database
+
+        client = mongomock.MongoClient()
+        connection.close()
+        database.connect = lambda *args, **kwargs: client
+
+    def seed(self, options):
+        call_command(
+            'populate_db',
+            users=options['users'],
+            activities_per_user=options['activities_per_user'],
+            teams=options['teams'],
+            seed=options['seed'],
+            stdout=io.StringIO(),
+        )
+        now = timezone.now()
+        challenge = Challenge.objects.create(
+            _id=ObjectId(),
+            title='Benchmark Challenge',
+            description='Log 500 minutes this month',
+            challenge_type='duration',
+            target_value=500,
+            activity_types=['running', 'cycling'],
+            start_date=now - timedelta(days=7),
+            end_date=now + timedelta(days=21),
+            points_reward=100,
+        )
+        challenge.participants.add(*User.objects.order_by('id')[1:min(options['users'], 50)])
+        call_command('rebuild_challenge_progress', stdout=io.StringIO())
+        cache.clear()
+
+    def build_scenarios(self):
+        # The first seeded user coaches the first team and belongs to no other
+        user = User.objects.order_by('id').first()
+        other = User.objects.exclude(pk=user.pk).order_by('id').first() or user
+        own_team = Team.objects.get(coach=user)
+        other_team = Team.objects.exclude(pk=own_team.pk).first()
+        activity = Activity.objects.filter(user=user).first()
+        challenge = Challenge.objects.first()
+        workout = WorkoutSuggestion.objects.first()
+        team_names = (f'Benchmark Team {i}' for i in itertools.count(1))
+
+        def new_activity():
+            return {
+                'activity_type': 'running',
+                'duration': 30,
+                'distance': 5.0,
+                'calories': 300,
+                'date': timezone.now().isoformat(),
+            }
+
+        def create_activity(client):
+            client.post('/api/activities/', new_activity(), content_type='application/json')
+            return Activity.objects.filter(user=user).order_by('-created_at').values_list('pk', flat=True).first()
+
+        def delete_team(client, response):
+            team = Team.objects.get(name=response.json()['name'])
+            client.delete(f'/api/teams/{team.pk}/')
+
+        def team_etag(client):
+            return client.get('/api/team-leaderboard/')['ETag']
+
+        scenarios = [
+            Scenario('api_root', 'get', '/api/'),
+            Scenario('user_list', 'get', '/api/users/'),
+            Scenario('user_detail', 'get', f'/api/users/{other.pk}/'),
+            Scenario('profile_list', 'get', '/api/profiles/', user=user),
+            Scenario('profile_me', 'get', '/api/profiles/me/', user=user),
+            Scenario('profile_update_me', 'patch', '/api/profiles/update_me/', user=user, data={'age': 30}),
+            Scenario('activity_list', 'get', '/api/activities/'),
+            Scenario('activity_list_team', 'get', f'/api/activities/?team={own_team.pk}'),
+            Scenario('activity_detail', 'get', f'/api/activities/{activity.pk}/'),
+            Scenario('activity_create', 'post', '/api/activities/', user=user, data=new_activity()),
+            Scenario('activity_update', 'patch', f'/api/activities/{activity.pk}/', user=user, data={'duration': 45}),
+            Scenario(
+                'activity_delete', 'delete', lambda pk: f'/api/activities/{pk}/',
+                user=user, setup=create_activity
+            ),
+            Scenario('activity_bulk', 'post', '/api/activities/bulk/', user=user, data=[new_activity()] * 100),
+            Scenario('activity_export', 'get', f'/api/activities/export/?user={user.pk}'),
+            Scenario('activity_my', 'get', '/api/activities/my_activities/', user=user),
+            Scenario('activity_summary', 'get', '/api/activities/summary/', user=user),
+            Scenario('activity_trends', 'get', '/api/activities/trends/?granularity=week', user=user),
+            Scenario('team_list', 'get', '/api/teams/'),
+            Scenario('team_detail', 'get', f'/api/teams/{own_team.pk}/'),
+            Scenario(
+                'team_create', 'post', '/api/teams/', user=user,
+                data=lambda: {'name': next(team_names), 'description': 'Created by the benchmark'},
+                teardown=delete_team,
+            ),
+            Scenario('team_my', 'get', '/api/teams/my_teams/', user=user),
+            Scenario('challenge_list', 'get', '/api/challenges/', user=user),
+            Scenario('challenge_active', 'get', '/api/challenges/?status=active', user=user),
+            Scenario('challenge_detail', 'get', f'/api/challenges/{challenge.pk}/', user=user),
+            Scenario(
+                'challenge_join', 'post', f'/api/challenges/{challenge.pk}/join/', user=user,
+                teardown=lambda client, response: client.post(f'/api/challenges/{challenge.pk}/leave/'),
+            ),
+            Scenario(
+                'challenge_leave', 'post', f'/api/challenges/{challenge.pk}/leave/', user=user,
+                setup=lambda client: client.post(f'/api/challenges/{challenge.pk}/join/'),
+            ),
+            Scenario('challenge_my', 'get', '/api/challenges/my_challenges/', user=user),
+            Scenario('challenge_progress', 'get', f'/api/challenges/{challenge.pk}/progress/', user=other),
+            Scenario('challenge_standings', 'get', f'/api/challenges/{challenge.pk}/standings/', user=user),
+            Scenario('workout_list', 'get', '/api/workouts/'),
+            Scenario('workout_detail', 'get', f'/api/workouts/{workout.pk}/'),
+            Scenario('workout_for_me', 'get', '/api/workouts/for_me/', user=user),
+            Scenario('leaderboard', 'get', '/api/leaderboard/'),
+            Scenario('leaderboard_100', 'get', '/api/leaderboard/?limit=100'),
+            Scenario('leaderboard_7d', 'get', '/api/leaderboard/?window=7d'),
+            Scenario('leaderboard_season', 'get', '/api/leaderboard/?window=season&limit=100'),
+            Scenario('leaderboard_me', 'get', '/api/leaderboard/me/', user=user),
+            Scenario('leaderboard_around', 'get', f'/api/leaderboard/around/{user.pk}/?radius=10'),
+            Scenario('team_leaderboard', 'get', '/api/team-leaderboard/'),
+            Scenario(
+                'team_leaderboard_not_modified', 'get', '/api/team-leaderboard/',
+                headers=lambda etag: {'HTTP_IF_NONE_MATCH': etag}, setup=team_etag,
+            ),
+        ]
+        if other_team is not None:
+            scenarios += [
+                Scenario(
+                    'team_join', 'post', f'/api/teams/{other_team.pk}/join/', user=user,
+                    teardown=lambda client, response: client.post(f'/api/teams/{other_team.pk}/leave/'),
+                ),
+                Scenario(
+                    'team_leave', 'post', f'/api/teams/{other_team.pk}/leave/', user=user,
+                    setup=lambda client: client.post(f'/api/teams/{other_team.pk}/join/'),
+                ),
+            ]
+        return scenarios
+
+    def run_scenario(self, scenario, iterations, warmup):
+        client = Client()
+        if scenario.user is not None:
+            client.force_login(scenario.user)
+        for _ in range(warmup):
+            self.call(client, scenario)
+
+        timings, queries, commands, statuses = [], [], [], Counter()
+        for _ in range(iterations):
+            elapsed, query_count, command_count, response = self.call(client, scenario)
+            timings.append(elapsed)
+            queries.append(query_count)
+            commands.append(command_count)
+            statuses[response.status_code] += 1
+
+        # Peak memory comes from a separate traced request, since tracing
+        # slows every allocation and would skew the timings above
+        tracemalloc.start()
+        try:
+            self.call(client, scenario, trace=True)
+            peak = self.peak_memory
+        finally:
+            tracemalloc.stop()
+
+        timings.sort()
+        return {
+            'method': scenario.method.upper(),
+            'status': {str(code): count for code, count in sorted(statuses.items())},
+            'p50_ms': round(percentile(timings, 50) * 1000, 3),
+            'p95_ms': round(percentile(timings, 95) * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+            'max_ms': round(timings[-1] * 1000, 3),
+            'queries': max(queries),
+            # mongomock does not emit command monitoring events
+            'db_commands': max(commands) if self.commands.count else None,
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def call(self, client, scenario, trace=False):
+        """Issue one request, timing only the request itself"""
+        state = scenario.setup(client) if scenario.setup else None
+        path = scenario.path(state) if callable(scenario.path) else scenario.path
+        headers = scenario.headers(state) if callable(scenario.headers) else scenario.headers
+        data = scenario.data() if callable(scenario.data) else scenario.data
+        kwargs = dict(headers)
+        if data is not None:
+            kwargs.update(data=json.dumps(data), content_type='application/json')
+
+        # The query log is a bounded deque, so an overfull log would hide new queries
+        reset_queries()
+        commands_before = self.commands.count
+        if trace:
+            tracemalloc.reset_peak()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(client, scenario.method)(path, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        if trace:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+        command_count = self.commands.count - commands_before
+
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{scenario.name}: {scenario.method.upper()} {path} returned '
+                f'{response.status_code}: {response.content[:500].decode(errors="replace")}'
+            )
+        if scenario.teardown:
+            scenario.teardown(client, response)
+        # Apply what the request queued before the next one is timed
+        jobs.drain()
+        return elapsed, len(captured), command_count, response
+
+    def write_row(self, name, result):
+        self.stdout.write(
+            f'{name:<32} p50 {result["p50_ms"]:>8.2f}ms  p95 {result["p95_ms"]:>8.2f}ms  '
+            f'p99 {result["p99_ms"]:>8.2f}ms  queries {result["queries"]:>3}  '
+            f'peak {result["peak_memory_kb"]:>8.1f}KB'
+        )
+
+    def compare(self, baseline, report, tolerance):
+        """Print per-route changes against a baseline and return the number of regressions"""
+        self.stdout.write(f'\nCompared with baseline from {baseline["meta"].get("created_at", "unknown")}:')
+        regressions = 0
+        for name, result in report['routes'].items():
+            before = baseline['routes'].get(name)
+            if before is None:
+                self.stdout.write(f'{name:<32} new route')
+                continue
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0
+            line = (
+                f'{name:<32} p95 {before["p95_ms"]:>8.2f} -> {result["p95_ms"]:>8.2f}ms ({change:+.0%})  '
+                f'queries {before["queries"]} -> {result["queries"]}'
+            )
+            if change > tolerance or result['queries'] > before['queries']:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        return regressions
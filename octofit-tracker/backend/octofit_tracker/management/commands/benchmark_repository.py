@@ -0,0 +1,180 @@
+import json
+import platform
+import time
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from djongo.sql2mongo.query import Query
+from octofit_tracker import repository
+from octofit_tracker.models import Activity, Team, UserProfile
+from .benchmark_api import Command as BenchmarkCommand, percentile
+
+
+class Comparison:
+    """One hot-path query, through the ORM and through ``repository``
+
+    ``queryset`` builds the ORM query; ``orm`` evaluates it the way the
+    code path did, and ``native`` is the repository replacement.
+    """
+
+    def __init__(self, name, queryset, orm, native):
+        self.name = name
+        self.queryset = queryset
+        self.orm = orm
+        self.native = native
+
+
+class Command(BenchmarkCommand):
+    help = (
+        'Measure how much of each hot-path ORM query is spent compiling SQL and translating it '
+        'with djongo, against the native pymongo reads in octofit_tracker.repository'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Users to seed (default: 200)')
+        parser.add_argument('--activities-per-user', type=int, default=20, help='Activities per user (default: 20)')
+        parser.add_argument('--teams', type=int, default=10, help='Teams to seed (default: 10)')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the generated data (default: 1)')
+        parser.add_argument('--iterations', type=int, default=200, help='Timed runs per query (default: 200)')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument(
+            '--in-memory', action='store_true',
+            help='Run against an in-memory mongomock database instead of the configured mongod'
+        )
+
+    def handle(self, *args, **options):
+        if options['in_memory']:
+            self.use_in_memory_database()
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f'Seeding {options["users"]} users x {options["activities_per_user"]} activities...')
+            self.seed(options)
+            self.stdout.write(
+                f'\n{"query":<24} {"compile":>9} {"translate":>10} {"orm":>9} {"native":>9} {"saved":>7}   (p50, us)'
+            )
+            results = {}
+            for comparison in self.build_comparisons():
+                results[comparison.name] = self.measure(comparison, options['iterations'])
+                self.write_result(comparison.name, results[comparison.name])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            report = {
+                'meta': {
+                    'created_at': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'database': 'in-memory' if options['in_memory'] else 'mongodb',
+                    'users': options['users'],
+                    'activities_per_user': options['activities_per_user'],
+                    'iterations': options['iterations'],
+                },
+                'queries': results,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'\nResults written to {options["output"]}'))
+
+    def build_comparisons(self):
+        user_id = User.objects.order_by('id').values_list('id', flat=True).first()
+        page_size = 21
+        profile_fields = ['user_id', 'total_points', 'activity_count', 'total_calories', 'primary_team_id']
+
+        def activity_page():
+            activities = repository.find(
+                Activity, repository.match(Activity, user_id=user_id), sort=['-date', '_id'], limit=page_size
+            )
+            return repository.attach(activities, 'user', fields=['username'])
+
+        def leaderboard():
+            profiles = repository.find(
+                UserProfile, {}, fields=profile_fields, sort=['-total_points', '-user_id'], limit=10
+            )
+            repository.attach(profiles, 'user', fields=['username'])
+            return repository.attach(profiles, 'primary_team', fields=['name'])
+
+        return [
+            Comparison(
+                'activity_page',
+                lambda: Activity.objects.select_related('user').filter(user_id=user_id).order_by(
+                    '-date', '_id'
+                )[:page_size],
+                list,
+                activity_page,
+            ),
+            Comparison(
+                'leaderboard_top',
+                lambda: UserProfile.objects.select_related('user', 'primary_team').order_by(
+                    '-total_points', '-user_id'
+                )[:10],
+                list,
+                leaderboard,
+            ),
+            Comparison(
+                'team_ranking',
+                lambda: Team.objects.order_by('-total_points', '_id').only(
+                    '_id', 'name', 'total_points', 'member_count'
+                )[:10],
+                list,
+                lambda: repository.find(
+                    Team, {}, fields=['name', 'total_points', 'member_count'], sort=['-total_points', '_id'], limit=10
+                ),
+            ),
+            Comparison(
+                'user_memberships',
+                lambda: Team.members.through.objects.filter(user_id=user_id).values_list('team_id', flat=True),
+                list,
+                lambda: repository.find(
+                    Team.members.through, repository.match(Team.members.through, user_id=user_id), fields=['team_id']
+                ),
+            ),
+        ]
+
+    def measure(self, comparison, iterations):
+        cursor = connection.cursor().cursor
+        timings = {'compile': [], 'translate': [], 'orm': [], 'native': []}
+        for _ in range(iterations):
+            queryset = comparison.queryset()
+            started = time.perf_counter()
+            sql, params = queryset.query.get_compiler(connection.alias).as_sql()
+            timings['compile'].append(time.perf_counter() - started)
+
+            # Parsing a SELECT builds the Mongo command without running it
+            started = time.perf_counter()
+            Query(cursor.client_conn, cursor.db_conn, cursor.connection_properties, sql, params)
+            timings['translate'].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            comparison.orm(comparison.queryset())
+            timings['orm'].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            comparison.native()
+            timings['native'].append(time.perf_counter() - started)
+
+        result = {}
+        for name, samples in timings.items():
+            samples.sort()
+            result[f'{name}_p50_us'] = round(percentile(samples, 50) * 1e6, 1)
+            result[f'{name}_p95_us'] = round(percentile(samples, 95) * 1e6, 1)
+        if not result['orm_p50_us']:
+            raise CommandError(f'{comparison.name}: the ORM query did not run')
+        result['translation_share'] = round(
+            (result['compile_p50_us'] + result['translate_p50_us']) / result['orm_p50_us'], 3
+        )
+        return result
+
+    def write_result(self, name, result):
+        saved = 1 - result['native_p50_us'] / result['orm_p50_us']
+        self.stdout.write(
+            f'{name:<24} {result["compile_p50_us"]:>9.1f} {result["translate_p50_us"]:>10.1f} '
+            f'{result["orm_p50_us"]:>9.1f} {result["native_p50_us"]:>9.1f} {saved:>7.0%}'
+        )
@@ -0,0 +1,85 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from datetime import timedelta
+from octofit_tracker.models import UserProfile, Activity, Team, Challenge
+
+
+class Command(BaseCommand):
+    help = 'Print MongoDB query plans for the hot API queries to verify they use indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='User id to use in per-user queries')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the full explain() output')
+
+    def handle(self, *args, **options):
+        connection.ensure_connection()
+        db = connection.connection
+
+        user_id = options['user']
+        if user_id is None:
+            profile = UserProfile.objects.order_by('-total_points').first()
+            user_id = profile.user_id if profile else 0
+        now = timezone.now()
+        month_ago = now - timedelta(days=30)
+
+        activities = db[Activity._meta.db_table]
+        challenges = db[Challenge._meta.db_table]
+        memberships = db[Team.members.through._meta.db_table]
+
+        queries = [
+            ('activities by user', activities.find({'user_id': user_id}).sort('date', -1)),
+            ('activities by user, type and date range', activities.find({
+                'user_id': user_id,
+                'activity_type': 'running',
+                'date': {'$gte': month_ago, '$lte': now},
+            }).sort('date', -1)),
+            ('activity feed', activities.find().sort('date', -1).limit(20)),
+            ('active challenges', challenges.find({
+                'start_date': {'$lte': now},
+                'end_date': {'$gte': now},
+            }).sort('start_date', -1)),
+            ('user leaderboard', db[UserProfile._meta.db_table].find().sort('total_points', -1).limit(10)),
+            ('team leaderboard', db[Team._meta.db_table].find().sort('total_points', -1).limit(10)),
+            ('teams of user', memberships.find({'user_id': user_id})),
+        ]
+
+        collection_scans = 0
+        for name, cursor in queries:
+            plan = cursor.explain()
+            stages, indexes = self._winning_plan(plan['queryPlanner']['winningPlan'])
+            execution = plan.get('executionStats', {})
+            if 'COLLSCAN' in stages:
+                collection_scans += 1
+                style = self.style.WARNING
+            else:
+                style = self.style.SUCCESS
+            self.stdout.write(style(f'{name}: {" <- ".join(stages)}'))
+            self.stdout.write(f'  indexes: {", ".join(indexes) or "none"}')
+            if execution:
+                self.stdout.write(
+                    f'  returned {execution.get("nReturned")} of '
+                    f'{execution.get("totalDocsExamined")} documents examined'
+                )
+            if options['verbose_plans']:
+                self.stdout.write(json.dumps(plan, indent=2, default=str))
+
+        if collection_scans:
+            self.stdout.write(self.style.WARNING(f'\n{collection_scans} queries use a collection scan'))
+        else:
+            self.stdout.write(self.style.SUCCESS('\nAll hot queries are served by indexes'))
+
+    def _winning_plan(self, plan):
+        """Flatten a winning plan into its stage names and the indexes it uses"""
+        stages, indexes = [], []
+        pending = [plan]
+        while pending:
+            node = pending.pop()
+            stages.append(node.get('stage', '?'))
+            if 'indexName' in node:
+                indexes.append(node['indexName'])
+            if 'inputStage' in node:
+                pending.append(node['inputStage'])
+            pending.extend(node.get('inputStages', []))
+        return stages, indexes
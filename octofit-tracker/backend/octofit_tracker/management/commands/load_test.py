@@ -0,0 +1,152 @@
+import http.client
+import json
+import platform
+import threading
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from .benchmark_api import percentile
+
+DEFAULT_PATHS = [
+    '/api/leaderboard/',
+    '/api/team-leaderboard/',
+    '/api/activities/',
+    '/api/activities/summary/',
+]
+
+
+class Client(threading.Thread):
+    """One simulated client sending requests back to back over a keep-alive connection"""
+
+    def __init__(self, base_url, paths, headers, start_line):
+        super().__init__(daemon=True)
+        url = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.connect = lambda: connection_class(url.hostname, url.port, timeout=30)
+        self.prefix = url.path.rstrip('/')
+        self.paths = paths
+        self.headers = headers
+        self.deadline = None
+        self.start_line = start_line
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        connection = self.connect()
+        try:
+            connection.connect()
+        except OSError:
+            self.errors += 1
+            return
+        self.start_line.wait()
+        index = 0
+        while time.perf_counter() < self.deadline:
+            path = self.prefix + self.paths[index % len(self.paths)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=self.headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                connection.close()
+                connection = self.connect()
+                continue
+            if response.status >= 400:
+                self.errors += 1
+            else:
+                self.latencies.append((time.perf_counter() - started) * 1000)
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Load a running server with concurrent keep-alive clients and report throughput and '
+        'latency percentiles. Compare deployments by running it once against '
+        '"gunicorn octofit_tracker.wsgi" and once against "uvicorn octofit_tracker.asgi:application", '
+        'with --path pointing at /api/... and /api/async/... respectively'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000', help='Server to load (default: http://localhost:8000)')
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Path to request, cycled by every client (repeatable; default: the synchronous read endpoints)'
+        )
+        parser.add_argument(
+            '--concurrency', action='append', type=int,
+            help='Concurrent clients; repeat to measure several levels in turn (default: 1, 8 and 32)'
+        )
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level (default: 10)')
+        parser.add_argument(
+            '--header', action='append', default=[],
+            help='Extra request header as "Name: value", e.g. a session cookie (repeatable)'
+        )
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or DEFAULT_PATHS
+        levels = options['concurrency'] or [1, 8, 32]
+        if any(level < 1 for level in levels):
+            raise CommandError('--concurrency must be at least 1')
+        headers = {'Accept': 'application/json'}
+        for header in options['header']:
+            name, sep, value = header.partition(':')
+            if not sep:
+                raise CommandError(f'Headers look like "Name: value", got {header!r}')
+            headers[name.strip()] = value.strip()
+
+        self.stdout.write(f'Loading {options["base_url"]} for {options["duration"]:g}s per level: {", ".join(paths)}\n')
+        self.stdout.write(f'{"clients":>8} {"req/s":>10} {"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10} {"errors":>8}')
+        results = []
+        for level in levels:
+            result = self.run_level(options['base_url'], paths, headers, level, options['duration'])
+            results.append(result)
+            self.stdout.write(
+                f'{level:>8} {result["throughput"]:>10.1f} {result["p50_ms"]:>10.2f} '
+                f'{result["p95_ms"]:>10.2f} {result["p99_ms"]:>10.2f} {result["errors"]:>8}'
+            )
+
+        if options['output']:
+            report = {
+                'meta': {
+                    'created_at': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'base_url': options['base_url'],
+                    'paths': paths,
+                    'duration': options['duration'],
+                },
+                'levels': results,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'\nResults written to {options["output"]}'))
+
+    def run_level(self, base_url, paths, headers, concurrency, duration):
+        start_line = threading.Event()
+        clients = [Client(base_url, paths, headers, start_line) for _ in range(concurrency)]
+        for client in clients:
+            client.start()
+        # Clients connect before the start line so the timed window covers requests only
+        started = time.perf_counter()
+        for client in clients:
+            client.deadline = started + duration
+        start_line.set()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - started
+
+        samples = sorted(latency for client in clients for latency in client.latencies)
+        if not samples:
+            raise CommandError(f'No successful requests at concurrency {concurrency}; is the server running?')
+        return {
+            'concurrency': concurrency,
+            'requests': len(samples),
+            'errors': sum(client.errors for client in clients),
+            'throughput': round(len(samples) / elapsed, 1),
+            'p50_ms': round(percentile(samples, 50), 2),
+            'p95_ms': round(percentile(samples, 95), 2),
+            'p99_ms': round(percentile(samples, 99), 2),
+        }
@@ -1,284 +1,253 @@
-from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from octofit_tracker.models import UserProfile, Activity, Team, WorkoutSuggestion
-from datetime import datetime, timedelta
 import random
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from multiprocessing import get_context
+from bson import ObjectId
+from pymongo import UpdateOne
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+from octofit_tracker import challenges, leaderboard_windows, rollups, workouts
+from octofit_tracker.models import (
+    UserProfile, Activity, ActivityRollup, Job, LeaderboardWindow, Team, Challenge, ChallengeProgress, WindowScore,
+    WorkoutSuggestion
+)
+from octofit_tracker.leaderboards import invalidate_team_leaderboard
+
+# The first teams and users keep the original superhero demo data;
+# anything beyond them is synthetic
+TEAMS = [
+    ('Team Marvel', 'Earth\'s Mightiest Heroes'),
+    ('Team DC', 'Justice League United'),
+]
+
+HEROES = [
+    ('ironman', 'tony.stark@marvel.com', 'Tony', 'Stark', 'advanced'),
+    ('captainamerica', 'steve.rogers@marvel.com', 'Steve', 'Rogers', 'advanced'),
+    ('thor', 'thor.odinson@marvel.com', 'Thor', 'Odinson', 'advanced'),
+    ('blackwidow', 'natasha.romanoff@marvel.com', 'Natasha', 'Romanoff', 'advanced'),
+    ('hulk', 'bruce.banner@marvel.com', 'Bruce', 'Banner', 'advanced'),
+    ('superman', 'clark.kent@dc.com', 'Clark', 'Kent', 'advanced'),
+    ('batman', 'bruce.wayne@dc.com', 'Bruce', 'Wayne', 'advanced'),
+    ('wonderwoman', 'diana.prince@dc.com', 'Diana', 'Prince', 'advanced'),
+    ('flash', 'barry.allen@dc.com', 'Barry', 'Allen', 'intermediate'),
+    ('aquaman', 'arthur.curry@dc.com', 'Arthur', 'Curry', 'intermediate'),
+]
+
+ACTIVITY_TYPES = ['running', 'cycling', 'swimming', 'strength_training', 'yoga', 'walking', 'sports']
+DISTANCE_TYPES = ['running', 'walking', 'cycling']
+FITNESS_LEVELS = ['beginner', 'intermediate', 'advanced']
+
+WORKOUTS = [
+    {
+        'title': 'Super Soldier Training',
+        'description': 'Captain America\'s intense workout routine for building strength and endurance',
+        'activity_type': 'strength_training',
+        'fitness_level': 'advanced',
+        'duration': 60,
+        'instructions': 'Push-ups: 5 sets of 50. Pull-ups: 5 sets of 20. Running: 30 minutes. Core exercises: 3 sets of 30.'
+    },
+    {
+        'title': 'Asgardian Strength Training',
+        'description': 'Thor\'s legendary workout for gods',
+        'activity_type': 'strength_training',
+        'fitness_level': 'advanced',
+        'duration': 90,
+        'instructions': 'Deadlifts: 5 sets of 10. Hammer swings: 4 sets of 20. Battle rope: 15 minutes. Overhead press: 5 sets of 12.'
+    },
+    {
+        'title': 'Spy Agility Training',
+        'description': 'Black Widow\'s agility and flexibility routine',
+        'activity_type': 'yoga',
+        'fitness_level': 'intermediate',
+        'duration': 45,
+        'instructions': 'Yoga flow: 20 minutes. Jump rope: 10 minutes. Martial arts practice: 15 minutes.'
+    },
+    {
+        'title': 'Kryptonian Power Workout',
+        'description': 'Superman\'s high-intensity training',
+        'activity_type': 'strength_training',
+        'fitness_level': 'advanced',
+        'duration': 75,
+        'instructions': 'Bench press: 5 sets of 15. Squats: 5 sets of 20. Box jumps: 4 sets of 15. Plank: 5 minutes.'
+    },
+    {
+        'title': 'Dark Knight Training',
+        'description': 'Batman\'s tactical fitness routine',
+        'activity_type': 'sports',
+        'fitness_level': 'advanced',
+        'duration': 60,
+        'instructions': 'Parkour training: 20 minutes. Martial arts drills: 20 minutes. Stealth exercises: 20 minutes.'
+    },
+    {
+        'title': 'Speedster Cardio Blast',
+        'description': 'Flash\'s speed and endurance training',
+        'activity_type': 'running',
+        'fitness_level': 'intermediate',
+        'duration': 40,
+        'instructions': 'Sprint intervals: 10 sets of 1 minute. High knees: 5 sets of 50. Burpees: 5 sets of 20.'
+    },
+    {
+        'title': 'Amazon Warrior Training',
+        'description': 'Wonder Woman\'s combat conditioning',
+        'activity_type': 'strength_training',
+        'fitness_level': 'advanced',
+        'duration': 70,
+        'instructions': 'Sword training: 20 minutes. Shield work: 20 minutes. Combat drills: 30 minutes.'
+    },
+    {
+        'title': 'Atlantean Swimming',
+        'description': 'Aquaman\'s underwater fitness program',
+        'activity_type': 'swimming',
+        'fitness_level': 'intermediate',
+        'duration': 50,
+        'instructions': 'Swimming laps: 30 minutes. Underwater resistance training: 15 minutes. Breath control: 5 minutes.'
+    }
+]
 
 
 class Command(BaseCommand):
-    help = 'Populate the octofit_db database with test data'
+    help = 'Populate the octofit_db database with seeded test data at any scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users (default: 10)')
+        parser.add_argument('--activities-per-user', type=int, default=8, help='Activities per user (default: 8)')
+        parser.add_argument('--teams', type=int, default=2, help='Number of teams (default: 2)')
+        parser.add_argument('--days', type=int, default=30, help='Spread activities over this many past days (default: 30)')
+        parser.add_argument('--seed', type=int, help='Random seed; the same seed always generates the same data')
+        parser.add_argument(
+            '--anchor-date', type=date.fromisoformat,
+            help='Generate activities in the --days before midnight UTC starting this date (YYYY-MM-DD), '
+                 'so a seed gives the same data on any day (default: now)'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000, help='Documents per bulk insert (default: 5000)')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to generate activities (default: 1)')
 
-    def handle(self, *args, **kwargs):
-        self.stdout.write(self.style.SUCCESS('Starting database population...'))
+    def handle(self, *args, **options):
+        num_users = options['users']
+        num_teams = options['teams']
+        if num_users < 1 or num_teams < 1 or num_teams > num_users:
+            raise CommandError('Need at least one user and one team, and no more teams than users')
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        batch_size = options['batch_size']
+        rng = random.Random(seed)
+
+        self.stdout.write(self.style.SUCCESS(f'Starting database population (seed {seed})...'))
 
         # Clear existing data
         self.stdout.write('Clearing existing data...')
-        Activity.objects.all().delete()
-        WorkoutSuggestion.objects.all().delete()
-        Team.objects.all().delete()
-        UserProfile.objects.all().delete()
-        User.objects.all().delete()
+        self.clear_data()
         self.stdout.write(self.style.SUCCESS('Cleared existing data'))
 
         # Create Teams
         self.stdout.write('Creating teams...')
-        team_marvel = Team.objects.create(
-            name='Team Marvel',
-            description='Earth\'s Mightiest Heroes',
-            total_points=0
-        )
-        team_dc = Team.objects.create(
-            name='Team DC',
-            description='Justice League United',
-            total_points=0
-        )
-        self.stdout.write(self.style.SUCCESS('Created 2 teams'))
-
-        # Create Users (Superheroes) - Marvel
-        self.stdout.write('Creating users...')
-        marvel_heroes = [
-            {
-                'username': 'ironman',
-                'email': 'tony.stark@marvel.com',
-                'first_name': 'Tony',
-                'last_name': 'Stark',
-                'fitness_level': 'advanced'
-           },
-            {
-                'username': 'captainamerica',
-                'email': 'steve.rogers@marvel.com',
-                'first_name': 'Steve',
-                'last_name': 'Rogers',
-                'fitness_level': 'advanced'
-            },
-            {
-                'username': 'thor',
-                'email': 'thor.odinson@marvel.com',
-                'first_name': 'Thor',
-                'last_name': 'Odinson',
-                'fitness_level': 'advanced'
-            },
-            {
-                'username': 'blackwidow',
-                'email': 'natasha.romanoff@marvel.com',
-                'first_name': 'Natasha',
-                'last_name': 'Romanoff',
-                'fitness_level': 'advanced'
-            },
-            {
-                'username': 'hulk',
-                'email': 'bruce.banner@marvel.com',
-                'first_name': 'Bruce',
-                'last_name': 'Banner',
-                'fitness_level': 'advanced'
-            }
-        ]
-
-        # Create Users - DC
-        dc_heroes = [
-            {
-                'username': 'superman',
-                'email': 'clark.kent@dc.com',
-                'first_name': 'Clark',
-                'last_name': 'Kent',
-                'fitness_level': 'advanced'
-            },
-            {
-                'username': 'batman',
-                'email': 'bruce.wayne@dc.com',
-                'first_name': 'Bruce',
-                'last_name': 'Wayne',
-                'fitness_level': 'advanced'
-            },
-            {
-                'username': 'wonderwoman',
-                'email': 'diana.prince@dc.com',
-                'first_name': 'Diana',
-                'last_name': 'Prince',
-                'fitness_level': 'advanced'
-            },
-            {
-                'username': 'flash',
-                'email': 'barry.allen@dc.com',
-                'first_name': 'Barry',
-                'last_name': 'Allen',
-                'fitness_level': 'intermediate'
-            },
-            {
-                'username': 'aquaman',
-                'email': 'arthur.curry@dc.com',
-                'first_name': 'Arthur',
-                'last_name': 'Curry',
-                'fitness_level': 'intermediate'
-            }
-        ]
-
-        # Create Marvel users and add to Team Marvel
-        marvel_users = []
-        for hero in marvel_heroes:
-            user = User.objects.create_user(
-                username=hero['username'],
-                email=hero['email'],
-                first_name=hero['first_name'],
-                last_name=hero['last_name'],
-                password='test123'
-            )
-            UserProfile.objects.create(
-                user=user,
-                fitness_level=hero['fitness_level'],
-                height=random.randint(165, 195),
-                weight=random.randint(65, 95),
-                age=random.randint(25, 45),
+        teams = [
+            Team(
+                _id=ObjectId(),
+                name=TEAMS[i][0] if i < len(TEAMS) else f'Team {i + 1:04d}',
+                description=TEAMS[i][1] if i < len(TEAMS) else f'Synthetic team {i + 1}',
                 total_points=0
             )
-            team_marvel.members.add(user)
-            marvel_users.append(user)
-
-        # Set first Marvel hero as coach
-        team_marvel.coach = marvel_users[0]
-        team_marvel.save()
-
-        # Create DC users and add to Team DC
-        dc_users = []
-        for hero in dc_heroes:
-            user = User.objects.create_user(
-                username=hero['username'],
-                email=hero['email'],
-                first_name=hero['first_name'],
-                last_name=hero['last_name'],
-                password='test123'
-            )
-            UserProfile.objects.create(
-                user=user,
-                fitness_level=hero['fitness_level'],
-                height=random.randint(165, 195),
-                weight=random.randint(65, 95),
-                age=random.randint(25, 45),
-                total_points=0
-            )
-            team_dc.members.add(user)
-            dc_users.append(user)
+            for i in range(num_teams)
+        ]
+        Team.objects.bulk_create(teams, batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Created {len(teams)} teams'))
 
-        # Set first DC hero as coach
-        team_dc.coach = dc_users[0]
-        team_dc.save()
+        # Create Users; every user shares one password hash, which keeps
+        # large runs from spending minutes in the password hasher
+        self.stdout.write('Creating users...')
+        password = make_password('test123')
+        user_ids = []
+        for start in range(0, num_users, batch_size):
+            batch = [self.build_user(i, password) for i in range(start, min(start + batch_size, num_users))]
+            User.objects.bulk_create(batch)
+            # djongo does not return generated ids from bulk inserts
+            ids = dict(User.objects.filter(username__in=[user.username for user in batch]).values_list('username', 'id'))
+            user_ids.extend(ids[user.username] for user in batch)
+        self.stdout.write(self.style.SUCCESS(f'Created {len(user_ids)} users'))
 
-        all_users = marvel_users + dc_users
-        self.stdout.write(self.style.SUCCESS(f'Created {len(all_users)} users'))
+        # Users are split into contiguous blocks, one per team
+        team_of = [teams[i * num_teams // num_users] for i in range(num_users)]
+        Membership = Team.members.through
+        for start in range(0, num_users, batch_size):
+            Membership.objects.bulk_create([
+                Membership(team_id=team_of[i].pk, user_id=user_ids[i])
+                for i in range(start, min(start + batch_size, num_users))
+            ])
 
         # Create Activities
         self.stdout.write('Creating activities...')
-        activity_types = ['running', 'cycling', 'swimming', 'strength_training', 'yoga', 'walking', 'sports']
-        activities_created = 0
-
-        for user in all_users:
-            # Create 5-10 activities per user
-            num_activities = random.randint(5, 10)
-            for i in range(num_activities):
-                days_ago = random.randint(0, 30)
-                activity_date = datetime.now() - timedelta(days=days_ago)
-                
-                activity_type = random.choice(activity_types)
-                duration = random.randint(20, 120)
-                
-                Activity.objects.create(
-                    user=user,
-                    activity_type=activity_type,
-                    duration=duration,
-                    distance=round(random.uniform(1.0, 15.0), 2) if activity_type in ['running', 'walking', 'cycling'] else None,
-                    calories=random.randint(100, 800),
-                    date=activity_date,
-                    notes=f'{user.first_name}\'s {activity_type} session'
-                )
-                activities_created += 1
-
+        activities_per_user = options['activities_per_user']
+        chunk = max(1, batch_size // max(1, activities_per_user))
+        indexed = list(enumerate(user_ids))
+        # Every task generates dates in the same window
+        if options['anchor_date'] is not None:
+            anchor = datetime.combine(options['anchor_date'], time(), tzinfo=dt_timezone.utc)
+        else:
+            anchor = timezone.now()
+        tasks = [
+            (seed, indexed[start:start + chunk], activities_per_user, options['days'], anchor)
+            for start in range(0, num_users, chunk)
+        ]
+        totals = {}
+        if options['workers'] > 1:
+            # Forked workers must not share the parent's MongoClient
+            connections.close_all()
+            with get_context('fork').Pool(options['workers']) as pool:
+                for result in pool.imap_unordered(generate_activities, tasks):
+                    totals.update(result)
+        else:
+            for task in tasks:
+                totals.update(generate_activities(task))
+        activities_created = sum(count for points, calories, count in totals.values())
         self.stdout.write(self.style.SUCCESS(f'Created {activities_created} activities'))
 
-        # Update team points
-        team_marvel.update_points()
-        team_dc.update_points()
+        # Profiles carry the totals computed while generating activities
+        self.stdout.write('Creating profiles...')
+        for start in range(0, num_users, batch_size):
+            profiles = []
+            for i in range(start, min(start + batch_size, num_users)):
+                points, calories, count = totals.get(user_ids[i], (0, 0, 0))
+                profiles.append(UserProfile(
+                    _id=ObjectId(),
+                    user_id=user_ids[i],
+                    fitness_level=HEROES[i][4] if i < len(HEROES) else rng.choice(FITNESS_LEVELS),
+                    height=rng.randint(165, 195),
+                    weight=rng.randint(65, 95),
+                    age=rng.randint(25, 45),
+                    total_points=points,
+                    total_calories=calories,
+                    activity_count=count,
+                    primary_team=team_of[i]
+                ))
+            UserProfile.objects.bulk_create(profiles)
 
-        # Update user profile points
-        for user in all_users:
-            from django.db.models import Sum
-            total_points = Activity.objects.filter(user=user).aggregate(Sum('points_earned'))['points_earned__sum'] or 0
-            profile = user.profile
-            profile.total_points = total_points
-            profile.save()
+        # Team totals, member counts and coaches (the first member of each team)
+        team_totals = {team.pk: [0, 0, None] for team in teams}
+        for i, user_id in enumerate(user_ids):
+            stats = team_totals[team_of[i].pk]
+            stats[0] += totals.get(user_id, (0, 0, 0))[0]
+            stats[1] += 1
+            if stats[2] is None:
+                stats[2] = user_id
+        Team.objects.mongo_bulk_write([
+            UpdateOne({'_id': team_id}, {'$set': {'total_points': points, 'member_count': members, 'coach_id': coach_id}})
+            for team_id, (points, members, coach_id) in team_totals.items()
+        ])
+        invalidate_team_leaderboard()
+
+        # Trend buckets are built in one pass over the new activities
+        self.stdout.write('Building activity rollups...')
+        buckets = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Created {buckets} rollup buckets'))
+        leaderboard_windows.rebuild_all()
 
         # Create Workouts (suggested workout plans)
         self.stdout.write('Creating workout suggestions...')
-        workouts_data = [
-            {
-                'title': 'Super Soldier Training',
-                'description': 'Captain America\'s intense workout routine for building strength and endurance',
-                'activity_type': 'strength_training',
-                'fitness_level': 'advanced',
-                'duration': 60,
-                'instructions': 'Push-ups: 5 sets of 50. Pull-ups: 5 sets of 20. Running: 30 minutes. Core exercises: 3 sets of 30.'
-            },
-            {
-                'title': 'Asgardian Strength Training',
-                'description': 'Thor\'s legendary workout for gods',
-                'activity_type': 'strength_training',
-                'fitness_level': 'advanced',
-                'duration': 90,
-                'instructions': 'Deadlifts: 5 sets of 10. Hammer swings: 4 sets of 20. Battle rope: 15 minutes. Overhead press: 5 sets of 12.'
-            },
-            {
-                'title': 'Spy Agility Training',
-                'description': 'Black Widow\'s agility and flexibility routine',
-                'activity_type': 'yoga',
-                'fitness_level': 'intermediate',
-                'duration': 45,
-                'instructions': 'Yoga flow: 20 minutes. Jump rope: 10 minutes. Martial arts practice: 15 minutes.'
-            },
-            {
-                'title': 'Kryptonian Power Workout',
-                'description': 'Superman\'s high-intensity training',
-                'activity_type': 'strength_training',
-                'fitness_level': 'advanced',
-                'duration': 75,
-                'instructions': 'Bench press: 5 sets of 15. Squats: 5 sets of 20. Box jumps: 4 sets of 15. Plank: 5 minutes.'
-            },
-            {
-                'title': 'Dark Knight Training',
-                'description': 'Batman\'s tactical fitness routine',
-                'activity_type': 'sports',
-                'fitness_level': 'advanced',
-                'duration': 60,
-                'instructions': 'Parkour training: 20 minutes. Martial arts drills: 20 minutes. Stealth exercises: 20 minutes.'
-            },
-            {
-                'title': 'Speedster Cardio Blast',
-                'description': 'Flash\'s speed and endurance training',
-                'activity_type': 'running',
-                'fitness_level': 'intermediate',
-                'duration': 40,
-                'instructions': 'Sprint intervals: 10 sets of 1 minute. High knees: 5 sets of 50. Burpees: 5 sets of 20.'
-            },
-            {
-                'title': 'Amazon Warrior Training',
-                'description': 'Wonder Woman\'s combat conditioning',
-                'activity_type': 'strength_training',
-                'fitness_level': 'advanced',
-                'duration': 70,
-                'instructions': 'Sword training: 20 minutes. Shield work: 20 minutes. Combat drills: 30 minutes.'
-            },
-            {
-                'title': 'Atlantean Swimming',
-                'description': 'Aquaman\'s underwater fitness program',
-                'activity_type': 'swimming',
-                'fitness_level': 'intermediate',
-                'duration': 50,
-                'instructions': 'Swimming laps: 30 minutes. Underwater resistance training: 15 minutes. Breath control: 5 minutes.'
-            }
-        ]
-
-        for workout in workouts_data:
-            WorkoutSuggestion.objects.create(**workout)
-
-        self.stdout.write(self.style.SUCCESS(f'Created {len(workouts_data)} workouts'))
+        WorkoutSuggestion.objects.bulk_create([WorkoutSuggestion(_id=ObjectId(), **workout) for workout in WORKOUTS])
+        workouts.invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f'Created {len(WORKOUTS)} workouts'))
 
         # Print summary
         self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
@@ -287,5 +256,68 @@ class Command(BaseCommand):
         self.stdout.write(f'Profiles: {UserProfile.objects.count()}')
         self.stdout.write(f'Activities: {Activity.objects.count()}')
         self.stdout.write(f'Workouts: {WorkoutSuggestion.objects.count()}')
-        self.stdout.write(self.style.SUCCESS('\nDatabase successfully populated with superhero data!'))
+        self.stdout.write(self.style.SUCCESS(f'\nDatabase successfully populated with seed {seed}!'))
 
+    def clear_data(self):
+        """Drop all generated documents with native deletes instead of ORM cascades"""
+        connection.ensure_connection()
+        db = connection.connection
+        models = [
+            Activity, ActivityRollup, WindowScore, LeaderboardWindow, Challenge, ChallengeProgress,
+            WorkoutSuggestion, Team, UserProfile, User, Job,
+            Team.members.through, Challenge.participants.through,
+            User.groups.through, User.user_permissions.through,
+        ]
+        for model in models:
+            db[model._meta.db_table].delete_many({})
+        challenges.invalidate_active_challenges()
+
+    def build_user(self, index, password):
+        if index < len(HEROES):
+            username, email, first_name, last_name, fitness_level = HEROES[index]
+        else:
+            username = f'athlete{index + 1:06d}'
+            email = f'{username}@octofit.example'
+            first_name, last_name = 'Athlete', f'{index + 1:06d}'
+        return User(
+            username=username,
+            email=email,
+            first_name=first_name,
+            last_name=last_name,
+            password=password
+        )
+
+
+def generate_activities(task):
+    """Insert the activities for a chunk of users and return their totals
+
+    Each user gets its own random stream derived from the seed and the
+    user's position, so output does not depend on how work is split
+    between processes.
+    """
+    seed, users, activities_per_user, days, anchor = task
+    activities = []
+    totals = {}
+    for index, user_id in users:
+        rng = random.Random(f'{seed}-{index}')
+        points = calories = 0
+        for _ in range(activities_per_user):
+            activity_type = rng.choice(ACTIVITY_TYPES)
+            duration = rng.randint(20, 120)
+            activity = Activity(
+                _id=ObjectId(),
+                user_id=user_id,
+                activity_type=activity_type,
+                duration=duration,
+                distance=round(rng.uniform(1.0, 15.0), 2) if activity_type in DISTANCE_TYPES else None,
+                calories=rng.randint(100, 800),
+                points_earned=Activity.calculate_points(activity_type, duration),
+                date=anchor - timedelta(seconds=rng.randint(0, days * 24 * 3600)),
+                notes=f'{activity_type} session'
+            )
+            points += activity.points_earned
+            calories += activity.calories
+            activities.append(activity)
+        totals[user_id] = (points, calories, activities_per_user)
+    Activity.objects.bulk_create(activities)
+    return totals
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker import challenges, scoring
+
+
+class Command(BaseCommand):
+    help = 'Rebuild challenge progress from the activity history, rewarding unrecorded completions'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Rebuilding challenge progress...')
+        awards = challenges.rebuild()
+        scoring.rewards_awarded(awards)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt challenge progress, {len(awards)} new completions rewarded'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker import leaderboard_windows, rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the activity rollups and the windowed leaderboards from the activity history'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Rebuilding activity rollups...')
+        written = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup buckets'))
+        leaderboard_windows.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the {", ".join(leaderboard_windows.WINDOWS)} leaderboards'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.models import UserProfile, Team
+from octofit_tracker.leaderboards import invalidate_team_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recompute profile stats and team points from activities (reconciliation only)'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Recomputing user profile stats...')
+        profiles = 0
+        for profile in UserProfile.objects.all():
+            profile.refresh_stats()
+            profiles += 1
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {profiles} profiles'))
+
+        self.stdout.write('Recomputing team points and member counts...')
+        teams = 0
+        for team in Team.objects.all():
+            team.member_count = team.members.count()
+            team.update_points()
+            teams += 1
+        invalidate_team_leaderboard()
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {teams} teams'))
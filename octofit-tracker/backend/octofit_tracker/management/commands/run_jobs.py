@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from octofit_tracker import jobs, scoring  # noqa: F401 registers the handlers
+
+
+class Command(BaseCommand):
+    help = 'Process queued background jobs, e.g. after a restart or as a dedicated worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of polling')
+
+    def handle(self, *args, **options):
+        poll_interval = jobs.options()['POLL_INTERVAL']
+        processed = 0
+        while True:
+            ran = jobs.drain()
+            processed += ran
+            if ran:
+                self.stdout.write(f'Processed {ran} jobs')
+            if options['once']:
+                break
+            time.sleep(poll_interval)
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs'))
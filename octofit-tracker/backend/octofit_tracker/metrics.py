@@ -0,0 +1,402 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms live in this process's memory and are
+rendered by the ``/metrics`` view, so any local Prometheus-compatible
+collector can scrape them without extra services or dependencies. Each
+worker process keeps its own values; scrape every worker, or aggregate by
+instance in the collector.
+"""
+import asyncio
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import monitoring
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+class Metric:
+    """Base class for a named metric family with optional labels"""
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Yield ``(suffix, labels, value)`` for every series"""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield '', dict(zip(self.labelnames, key)), value
+
+    def expose(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down"""
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block; also usable as a decorator"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def summary(self, **labels):
+        """Count, mean and estimated percentiles of one series
+
+        Percentiles are the upper bound of the bucket holding them, or None
+        when they fall past the largest bucket.
+        """
+        with self._lock:
+            counts, total, count = self._values.get(self._key(labels)) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts = list(counts)
+        result = {'count': count, 'mean': total / count if count else None}
+        for pct in (50, 95, 99):
+            bound = None
+            if count:
+                rank = pct / 100 * count
+                cumulative = 0
+                for upper, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    if cumulative >= rank:
+                        bound = upper
+                        break
+            result[f'p{pct}'] = bound
+        return result
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', {**labels, 'le': _format_value(bound)}, cumulative
+            yield '_bucket', {**labels, 'le': '+Inf'}, count
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+
+def render():
+    """All registered metrics in the text exposition format"""
+    return '\n'.join(metric.expose() for metric in REGISTRY) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return f'{value:.1f}'
+    return str(value)
+
+
+# API requests
+
+REQUEST_DURATION = Histogram(
+    'octofit_request_duration_seconds',
+    'Time spent handling API requests',
+    ['view', 'method'],
+)
+REQUESTS = Counter(
+    'octofit_requests_total',
+    'API requests handled',
+    ['view', 'method', 'status'],
+)
+
+# Scoring
+
+ACTIVITIES_CREATED = Counter(
+    'octofit_activities_created_total',
+    'Activities logged through the API',
+)
+POINTS_AWARDED = Counter(
+    'octofit_points_awarded_total',
+    'Points earned by newly logged activities',
+)
+TEAM_UPDATE_POINTS_DURATION = Histogram(
+    'octofit_team_update_points_seconds',
+    'Time spent recomputing a team total with Team.update_points',
+)
+
+# Caches
+
+CACHE_LOOKUPS = Counter(
+    'octofit_cache_lookups_total',
+    'Cache lookups by outcome',
+    ['cache', 'result'],
+)
+CACHE_HIT_RATIO = Gauge(
+    'octofit_cache_hit_ratio',
+    'Share of cache lookups served from the cache since startup',
+    ['cache'],
+)
+
+# Background jobs
+
+JOBS_PROCESSED = Counter(
+    'octofit_jobs_processed_total',
+    'Background job deliveries by outcome',
+    ['kind', 'outcome'],
+)
+JOB_DURATION = Histogram(
+    'octofit_job_duration_seconds',
+    'Time spent running background job handlers',
+    ['kind'],
+)
+
+# MongoDB connection pools
+
+POOL_CONNECTIONS = Gauge(
+    'octofit_mongo_pool_connections',
+    'Open connections in the MongoDB connection pools',
+    ['address'],
+)
+POOL_CHECKED_OUT = Gauge(
+    'octofit_mongo_pool_checked_out',
+    'MongoDB connections currently checked out of the pools',
+    ['address'],
+)
+POOL_CHECKOUTS = Counter(
+    'octofit_mongo_pool_checkouts_total',
+    'MongoDB connection checkouts',
+    ['address'],
+)
+POOL_CHECKOUT_FAILURES = Counter(
+    'octofit_mongo_pool_checkout_failures_total',
+    'MongoDB connection checkouts that failed',
+    ['address', 'reason'],
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    'octofit_mongo_pool_checkout_wait_seconds',
+    'Time spent waiting to check a connection out of the MongoDB connection pools',
+    ['address'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+
+def record_cache_lookup(cache, hit):
+    """Count a cache lookup and refresh that cache's hit ratio"""
+    CACHE_LOOKUPS.inc(cache=cache, result='hit' if hit else 'miss')
+    hits = CACHE_LOOKUPS.value(cache=cache, result='hit')
+    misses = CACHE_LOOKUPS.value(cache=cache, result='miss')
+    CACHE_HIT_RATIO.set(hits / (hits + misses), cache=cache)
+
+
+def pool_stats():
+    """Usage of this process's MongoDB connection pools, per server address"""
+    failures = {}
+    for suffix, labels, value in POOL_CHECKOUT_FAILURES.samples():
+        failures[labels['address']] = failures.get(labels['address'], 0) + value
+    addresses = set(failures)
+    for metric in (POOL_CONNECTIONS, POOL_CHECKOUTS):
+        addresses.update(labels['address'] for suffix, labels, value in metric.samples())
+    return {
+        address: {
+            'connections': POOL_CONNECTIONS.value(address=address),
+            'checked_out': POOL_CHECKED_OUT.value(address=address),
+            'checkouts': POOL_CHECKOUTS.value(address=address),
+            'checkout_failures': failures.get(address, 0),
+            'checkout_wait_seconds': POOL_CHECKOUT_WAIT.summary(address=address),
+        }
+        for address in sorted(addresses)
+    }
+
+
+def view_name(request):
+    """Label for the view that handled ``request``, e.g. ``ActivityViewSet.create``"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view = match.func
+    # DRF views carry their class as ``cls`` (named after the function for
+    # @api_view) and viewsets add the method-to-action mapping
+    cls = getattr(view, 'cls', None) or getattr(view, 'view_class', None)
+    if cls is None:
+        return view.__name__
+    actions = getattr(view, 'actions', None)
+    if actions:
+        return f'{cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    return cls.__name__
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Track MongoDB connection pool usage from pymongo's CMAP events
+
+    A checkout runs in the requesting thread from its started event to its
+    checked-out (or failed) event, so the wait is timed per thread.
+    """
+
+    def __init__(self):
+        self._checkout = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.inc(address=_address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.dec(address=_address(event))
+
+    def connection_check_out_started(self, event):
+        self._checkout.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        POOL_CHECKOUT_FAILURES.inc(address=_address(event), reason=event.reason)
+        self._observe_wait(event)
+
+    def connection_checked_out(self, event):
+        POOL_CHECKOUTS.inc(address=_address(event))
+        self._observe_wait(event)
+        POOL_CHECKED_OUT.inc(address=_address(event))
+
+    def connection_checked_in(self, event):
+        POOL_CHECKED_OUT.dec(address=_address(event))
+
+    def _observe_wait(self, event):
+        started = getattr(self._checkout, 'started', None)
+        if started is not None:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started, address=_address(event))
+            self._checkout.started = None
+
+
+def _address(event):
+    host, port = event.address
+    return f'{host}:{port}'
+
+
+_pool_listener = None
+
+
+def install_listeners():
+    """Register the pool listener once per process, before djongo connects"""
+    global _pool_listener
+    if _pool_listener is None:
+        _pool_listener = PoolMetrics()
+        monitoring.register(_pool_listener)
+
+
+class MetricsMiddleware:
+    """Record latency and outcome of every request, labelled by view
+
+    Runs natively under both WSGI and ASGI, so async views are not pushed
+    through a thread by this middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, elapsed):
+        view = view_name(request)
+        REQUEST_DURATION.observe(elapsed, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_leaderboard_stats(apps, schema_editor):
+    from django.db.models import Count, Sum
+    UserProfile = apps.get_model('octofit_tracker', 'UserProfile')
+    Activity = apps.get_model('octofit_tracker', 'Activity')
+    Team = apps.get_model('octofit_tracker', 'Team')
+    for profile in UserProfile.objects.all():
+        totals = Activity.objects.filter(user_id=profile.user_id).aggregate(
+            calories=Sum('calories'),
+            count=Count('pk'),
+        )
+        profile.total_calories = totals['calories'] or 0
+        profile.activity_count = totals['count'] or 0
+        profile.primary_team = Team.objects.filter(members=profile.user_id).order_by('created_at').first()
+        profile.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='activity_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='primary_team',
+            field=models.ForeignKey(blank=True, help_text='Oldest team the user belongs to, shown on the leaderboard', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='octofit_tracker.team'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='total_calories',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_leaderboard_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+def backfill_member_count(apps, schema_editor):
+    Team = apps.get_model('octofit_tracker', 'Team')
+    for team in Team.objects.all():
+        team.member_count = team.members.count()
+        team.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0003_query_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='member_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_member_count, migrations.RunPython.noop),
+    ]
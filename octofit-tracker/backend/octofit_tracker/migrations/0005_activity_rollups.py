@@ -0,0 +1,49 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import djongo.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('octofit_tracker', '0004_team_member_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('_id', djongo.models.fields.ObjectIdField(auto_created=True, primary_key=True, serialize=False)),
+                ('granularity', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=10)),
+                ('period_start', models.DateTimeField()),
+                ('activity_type', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+                ('duration', models.IntegerField(default=0, help_text='Total duration in minutes')),
+                ('distance', models.FloatField(default=0, help_text='Total distance in km')),
+                ('calories', models.IntegerField(default=0)),
+                ('points', models.IntegerField(default=0)),
+                ('team', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='octofit_tracker.team')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'activity_rollups',
+                'ordering': ['period_start'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activityrollup',
+            index=models.Index(fields=['user', 'granularity', 'period_start'], name='rollup_user_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityrollup',
+            index=models.Index(fields=['team', 'granularity', 'period_start'], name='rollup_team_period_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='activityrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'team', 'granularity', 'period_start', 'activity_type'), name='rollup_bucket_unique'),
+        ),
+    ]
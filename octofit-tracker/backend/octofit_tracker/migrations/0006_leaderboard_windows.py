@@ -0,0 +1,50 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import djongo.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('octofit_tracker', '0005_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardWindow',
+            fields=[
+                ('_id', djongo.models.fields.ObjectIdField(auto_created=True, primary_key=True, serialize=False)),
+                ('window', models.CharField(max_length=10, unique=True)),
+                ('as_of', models.DateTimeField(help_text='Start of the newest UTC day the window covers')),
+            ],
+            options={
+                'db_table': 'leaderboard_windows',
+            },
+        ),
+        migrations.CreateModel(
+            name='WindowScore',
+            fields=[
+                ('_id', djongo.models.fields.ObjectIdField(auto_created=True, primary_key=True, serialize=False)),
+                ('window', models.CharField(choices=[('7d', 'Last 7 days'), ('30d', 'Last 30 days'), ('season', 'This season')], max_length=10)),
+                ('points', models.IntegerField(default=0)),
+                ('activity_count', models.IntegerField(default=0)),
+                ('total_calories', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'window_scores',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='windowscore',
+            index=models.Index(fields=['window', 'points', 'user'], name='window_points_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='windowscore',
+            constraint=models.UniqueConstraint(fields=('window', 'user'), name='window_user_unique'),
+        ),
+    ]
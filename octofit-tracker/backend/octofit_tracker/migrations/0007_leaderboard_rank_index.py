@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0006_leaderboard_windows'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userprofile',
+            name='profile_points_idx',
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['total_points', 'user'], name='profile_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import djongo.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('octofit_tracker', '0007_leaderboard_rank_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChallengeProgress',
+            fields=[
+                ('_id', djongo.models.fields.ObjectIdField(auto_created=True, primary_key=True, serialize=False)),
+                ('value', models.FloatField(default=0, help_text="Progress in the challenge's unit")),
+                ('activity_count', models.IntegerField(default=0)),
+                ('left_at', models.DateTimeField(blank=True, help_text='Set while the user is not participating', null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('points_awarded', models.IntegerField(default=0)),
+                ('challenge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='octofit_tracker.challenge')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='challenge_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'challenge_progress',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='challengeprogress',
+            index=models.Index(fields=['challenge', 'left_at', 'value', 'user'], name='progress_standings_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='challengeprogress',
+            constraint=models.UniqueConstraint(fields=('challenge', 'user'), name='progress_participant_unique'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:00
+
+from django.db import migrations, models
+import djongo.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0008_challenge_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('_id', djongo.models.fields.ObjectIdField(auto_created=True, primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=50)),
+                ('payload', djongo.models.fields.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('run_after', models.DateTimeField(help_text='Earliest time a worker may pick the job up')),
+                ('locked_until', models.DateTimeField(blank=True, help_text="End of the running worker's lease", null=True)),
+                ('done_steps', djongo.models.fields.JSONField(default=list, help_text='Steps completed by earlier deliveries')),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_after'], name='job_queue_idx'),
+        ),
+    ]
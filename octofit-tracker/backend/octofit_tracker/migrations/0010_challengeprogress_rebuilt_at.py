@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0009_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='challengeprogress',
+            name='rebuilt_at',
+            field=models.DateTimeField(blank=True, help_text='When value was last rebuilt from the activity history', null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from djongo import models
 from django.contrib.auth.models import User
+from .metrics import TEAM_UPDATE_POINTS_DURATION
 
 
 class UserProfile(models.Model):
@@ -19,16 +20,49 @@ class UserProfile(models.Model):
         default='beginner'
     )
     total_points = models.IntegerField(default=0)
+    activity_count = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    primary_team = models.ForeignKey(
+        'Team',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        help_text="Oldest team the user belongs to, shown on the leaderboard"
+    )
     avatar = models.URLField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = models.DjongoManager()
+
     class Meta:
         db_table = 'user_profiles'
+        # Index keys are ascending only: djongo cannot translate DESC index
+        # columns, and MongoDB walks a single-field index in either direction
+        indexes = [
+            # Ties rank by user id, so the index serves rank counts and neighbour reads
+            models.Index(fields=['total_points', 'user'], name='profile_rank_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+    def refresh_stats(self):
+        """Recalculate denormalized leaderboard stats from the user's activities"""
+        from django.db.models import Count, Sum
+        totals = Activity.objects.filter(user_id=self.user_id).aggregate(
+            points=Sum('points_earned'),
+            calories=Sum('calories'),
+            count=Count('pk'),
+        )
+        rewards = ChallengeProgress.objects.filter(user_id=self.user_id).aggregate(Sum('points_awarded'))
+        self.total_points = (totals['points'] or 0) + (rewards['points_awarded__sum'] or 0)
+        self.total_calories = totals['calories'] or 0
+        self.activity_count = totals['count'] or 0
+        self.primary_team = Team.objects.filter(members=self.user_id).order_by('created_at').first()
+        self.save()
+
 
 class Activity(models.Model):
     """Activity log for tracking workouts"""
@@ -55,27 +89,43 @@ class Activity(models.Model):
     date = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = models.DjongoManager()
+
     class Meta:
         db_table = 'activities'
         ordering = ['-date']
+        # Compound keys follow the list filters (user, type, date range)
+        # ordered by date; MongoDB serves the -date sort by walking them
+        # backwards
+        indexes = [
+            models.Index(fields=['user', 'date'], name='activity_user_date_idx'),
+            models.Index(fields=['user', 'activity_type', 'date'], name='activity_user_type_date_idx'),
+            models.Index(fields=['date'], name='activity_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.activity_type} on {self.date.strftime('%Y-%m-%d')}"
 
+    # Points earned per 10 minutes of each activity type
+    POINTS_MULTIPLIER = {
+        'running': 3,
+        'walking': 1,
+        'cycling': 2,
+        'swimming': 3,
+        'strength_training': 2,
+        'yoga': 1,
+        'sports': 2,
+        'other': 1,
+    }
+
+    @classmethod
+    def calculate_points(cls, activity_type, duration):
+        """Points for an activity; also used for bulk inserts that bypass save()"""
+        return (duration // 10) * cls.POINTS_MULTIPLIER.get(activity_type, 1)
+
     def save(self, *args, **kwargs):
         # Calculate points based on activity type and duration
-        points_multiplier = {
-            'running': 3,
-            'walking': 1,
-            'cycling': 2,
-            'swimming': 3,
-            'strength_training': 2,
-            'yoga': 1,
-            'sports': 2,
-            'other': 1,
-        }
-        base_points = (self.duration // 10) * points_multiplier.get(self.activity_type, 1)
-        self.points_earned = base_points
+        self.points_earned = self.calculate_points(self.activity_type, self.duration)
         super().save(*args, **kwargs)
 
 
@@ -86,27 +136,137 @@ class Team(models.Model):
     description = models.TextField(blank=True)
     coach = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='coached_teams')
     members = models.ManyToManyField(User, related_name='teams', blank=True)
+    member_count = models.IntegerField(default=0)
     total_points = models.IntegerField(default=0)
     avatar = models.URLField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = models.DjongoManager()
+
     class Meta:
         db_table = 'teams'
         ordering = ['-total_points']
+        indexes = [
+            models.Index(fields=['total_points'], name='team_points_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @TEAM_UPDATE_POINTS_DURATION.time()
     def update_points(self):
-        """Recalculate team points from all members' activities"""
+        """Recalculate team points from all members' activities and challenge rewards
+
+        Day-to-day changes are applied as deltas by ``scoring``; this full
+        recomputation is only used for seeding and reconciliation.
+        """
         from django.db.models import Sum
-        member_ids = self.members.values_list('id', flat=True)
+        member_ids = list(self.members.values_list('id', flat=True))
         total = Activity.objects.filter(user_id__in=member_ids).aggregate(Sum('points_earned'))['points_earned__sum']
-        self.total_points = total or 0
+        rewards = ChallengeProgress.objects.filter(user_id__in=member_ids).aggregate(Sum('points_awarded'))
+        self.total_points = (total or 0) + (rewards['points_awarded__sum'] or 0)
         self.save()
 
 
+class ActivityRollup(models.Model):
+    """Activity totals for one user or team, time bucket and activity type
+
+    Maintained incrementally by ``rollups`` as activities are written, so
+    trend charts read a few bucket documents instead of scanning the
+    activity history. ``manage.py rebuild_rollups`` recomputes them.
+    """
+    _id = models.ObjectIdField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    granularity = models.CharField(
+        max_length=10,
+        choices=[
+            ('day', 'Day'),
+            ('week', 'Week'),
+            ('month', 'Month'),
+        ]
+    )
+    period_start = models.DateTimeField()
+    activity_type = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+    duration = models.IntegerField(default=0, help_text="Total duration in minutes")
+    distance = models.FloatField(default=0, help_text="Total distance in km")
+    calories = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'activity_rollups'
+        ordering = ['period_start']
+        indexes = [
+            models.Index(fields=['user', 'granularity', 'period_start'], name='rollup_user_period_idx'),
+            models.Index(fields=['team', 'granularity', 'period_start'], name='rollup_team_period_idx'),
+        ]
+        # Lets concurrent upserts of a new bucket fail instead of duplicating it
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'team', 'granularity', 'period_start', 'activity_type'],
+                name='rollup_bucket_unique'
+            ),
+        ]
+
+    def __str__(self):
+        owner = f'team {self.team_id}' if self.team_id else f'user {self.user_id}'
+        return f"{owner} {self.activity_type} {self.granularity} of {self.period_start:%Y-%m-%d}"
+
+
+class WindowScore(models.Model):
+    """A user's points, activity count and calories within a leaderboard window
+
+    Kept current by ``leaderboard_windows``: activity writes add to the
+    windows they fall in, and days that slide out are subtracted again.
+    """
+    WINDOWS = [
+        ('7d', 'Last 7 days'),
+        ('30d', 'Last 30 days'),
+        ('season', 'This season'),
+    ]
+
+    _id = models.ObjectIdField()
+    window = models.CharField(max_length=10, choices=WINDOWS)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    points = models.IntegerField(default=0)
+    activity_count = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'window_scores'
+        # Walked backwards for top-N, and range-counted for a user's rank
+        indexes = [
+            models.Index(fields=['window', 'points', 'user'], name='window_points_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['window', 'user'], name='window_user_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.window}: {self.points}"
+
+
+class LeaderboardWindow(models.Model):
+    """The day each leaderboard window was last advanced to"""
+    _id = models.ObjectIdField()
+    window = models.CharField(max_length=10, unique=True)
+    as_of = models.DateTimeField(help_text="Start of the newest UTC day the window covers")
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'leaderboard_windows'
+
+    def __str__(self):
+        return f"{self.window} as of {self.as_of:%Y-%m-%d}"
+
+
 class Challenge(models.Model):
     """Fitness challenge for engagement"""
     _id = models.ObjectIdField()
@@ -132,10 +292,56 @@ class Challenge(models.Model):
     class Meta:
         db_table = 'challenges'
         ordering = ['-start_date']
+        indexes = [
+            models.Index(fields=['start_date', 'end_date'], name='challenge_window_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def status_at(self, now):
+        """'upcoming', 'active' or 'ended' at ``now``; both boundary instants are active"""
+        if now < self.start_date:
+            return 'upcoming'
+        if now > self.end_date:
+            return 'ended'
+        return 'active'
+
+
+class ChallengeProgress(models.Model):
+    """A participant's progress towards a challenge's target
+
+    Kept current by ``challenges``: matching activity writes add to
+    ``value``, and the first update that reaches the target records the
+    completion and the points awarded for it.
+    """
+    _id = models.ObjectIdField()
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name='progress')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='challenge_progress')
+    value = models.FloatField(default=0, help_text="Progress in the challenge's unit")
+    activity_count = models.IntegerField(default=0)
+    left_at = models.DateTimeField(null=True, blank=True, help_text="Set while the user is not participating")
+    completed_at = models.DateTimeField(null=True, blank=True)
+    points_awarded = models.IntegerField(default=0)
+    rebuilt_at = models.DateTimeField(
+        null=True, blank=True, help_text="When value was last rebuilt from the activity history"
+    )
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'challenge_progress'
+        # Walked backwards for standings, and range-counted for a participant's rank
+        indexes = [
+            models.Index(fields=['challenge', 'left_at', 'value', 'user'], name='progress_standings_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['challenge', 'user'], name='progress_participant_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.challenge_id}: {self.value}"
+
 
 class WorkoutSuggestion(models.Model):
     """Personalized workout suggestions"""
@@ -161,3 +367,34 @@ class WorkoutSuggestion(models.Model):
 
     def __str__(self):
         return f"{self.title} ({self.fitness_level})"
+
+
+class Job(models.Model):
+    """A queued side effect of an API write, processed by ``jobs`` workers"""
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+    ]
+
+    _id = models.ObjectIdField()
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(help_text="Earliest time a worker may pick the job up")
+    locked_until = models.DateTimeField(null=True, blank=True, help_text="End of the running worker's lease")
+    done_steps = models.JSONField(default=list, help_text="Steps completed by earlier deliveries")
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} ({self.status})"
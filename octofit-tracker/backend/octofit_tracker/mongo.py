@@ -0,0 +1,34 @@
+"""MongoDB client options shared by djongo, raw pymongo reads and motor.
+
+djongo keeps one ``MongoClient`` per database name, configured from
+``DATABASES['default']['CLIENT']``, so every query in a process shares its
+pool. A second database alias would share that same client, which is why
+the read preference for read-only endpoints is applied per collection
+instead. ``read_only`` gives a model's collection with
+``OCTOFIT_MONGO_READ_PREFERENCE``, on the same pool.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+
+def read_preference():
+    """The configured read preference for read-only endpoints"""
+    name = settings.OCTOFIT_MONGO_READ_PREFERENCE
+    try:
+        return make_read_preference(read_pref_mode_from_name(name), None)
+    except (KeyError, ValueError):
+        raise ImproperlyConfigured(f'Unknown OCTOFIT_MONGO_READ_PREFERENCE {name!r}')
+
+
+def read_only(model):
+    """The model's collection for reads that may be served by a secondary"""
+    return database()[model._meta.db_table].with_options(read_preference=read_preference())
+
+
+def database():
+    """The pymongo database behind djongo's default connection"""
+    connection.ensure_connection()
+    return connection.connection
+
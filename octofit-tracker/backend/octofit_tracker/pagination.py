@@ -0,0 +1,158 @@
+import base64
+import bisect
+import json
+from collections import OrderedDict
+from datetime import datetime
+from bson import ObjectId
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from . import repository
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination that seeks past the last row of the previous page
+
+    Pages are ordered by the view's ``ordering`` tuple, which must end with
+    a unique field. The cursor encodes that row's ordering values, so each
+    page is a range query on an index instead of an ever-growing skip.
+    """
+    ordering = ('-pk',)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(getattr(view, 'ordering', None) or self.ordering)
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.seek_filter(position))
+
+        # Fetch one extra row to learn whether another page follows
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def paginate_find(self, model, query, request, view=None, fields=None):
+        """Paginate a native pymongo find on ``model``'s collection, see ``repository``
+
+        Pages and cursors are the same as for the equivalent queryset.
+        """
+        self.request = request
+        self.ordering = tuple(getattr(view, 'ordering', None) or self.ordering)
+        self.page_size = self.get_page_size(request)
+        self.model = model
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            query = {'$and': [query, self.seek_match(position)]}
+        results = repository.find(model, query, fields, sort=self.ordering, limit=self.page_size + 1)
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def paginate_list(self, rows, model, request, view=None):
+        """Paginate instances already held in memory in the view's ascending ordering
+
+        Pages and cursors are the same as for a queryset, so cached lists
+        can be served without touching the database.
+        """
+        self.request = request
+        self.ordering = tuple(getattr(view, 'ordering', None) or self.ordering)
+        if any(field.startswith('-') for field in self.ordering):
+            raise ValueError('In-memory pagination needs an ascending ordering')
+        self.page_size = self.get_page_size(request)
+        self.model = model
+
+        start = 0
+        position = self.decode_cursor(request)
+        if position is not None:
+            keys = [self._position(row) for row in rows]
+            start = bisect.bisect_right(keys, tuple(position))
+
+        results = rows[start:start + self.page_size + 1]
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        position = [self._encode_value(getattr(last, self._name(field))) for field in self.ordering]
+        cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return [
+                self.model._meta.get_field(self._name(field)).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def seek_filter(self, position):
+        """Rows strictly after ``position`` in lexicographic ordering order"""
+        seek = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = self._name(field)
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            seek |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return seek
+
+    def seek_match(self, position):
+        """``seek_filter`` as a MongoDB filter"""
+        clauses = []
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            column = self.model._meta.get_field(self._name(field)).column
+            clauses.append({**equal, column: {'$lt' if field.startswith('-') else '$gt': value}})
+            equal[column] = value
+        return {'$or': clauses}
+
+    def _position(self, row):
+        return tuple(getattr(row, self._name(field)) for field in self.ordering)
+
+    def _name(self, field):
+        name = field.lstrip('-')
+        return self.model._meta.pk.name if name == 'pk' else name
+
+    def _encode_value(self, value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, ObjectId):
+            return str(value)
+        return value
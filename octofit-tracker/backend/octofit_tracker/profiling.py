@@ -0,0 +1,247 @@
+"""Per-request query profiling.
+
+``QueryProfilingMiddleware`` measures how many queries a sampled request
+issues and how long it spends in MongoDB, in serializers and in rendering.
+Serializer time is collected by ``SerializationTimingMixin``. The numbers go
+out as a ``Server-Timing`` header and a structured log line. MongoDB
+commands slower than the configured threshold are written to the
+``octofit_tracker.slow_queries`` logger with the command djongo translated
+the ORM query into. Everything is configured through ``OCTOFIT_PROFILING``
+in settings; when profiling is disabled the middleware removes itself from
+the chain at startup.
+
+The middleware runs natively under ASGI too. The current request's
+profile is a context variable, which ``sync_to_async`` carries into the
+thread running a synchronous view. Under ASGI the ORM query count is not
+reported, because Django's connection wrappers belong to that thread.
+Commands that motor issues from its own thread pool are not attributed
+to the request.
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from pymongo import monitoring
+from rest_framework import serializers
+
+logger = logging.getLogger('octofit_tracker.profiling')
+slow_query_logger = logging.getLogger('octofit_tracker.slow_queries')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'SLOW_QUERY_MS': 100,
+}
+
+# Longest list kept verbatim when logging a command, e.g. inserted documents
+MAX_LOGGED_ITEMS = 5
+
+_profile = ContextVar('octofit_profile', default=None)
+_path = ContextVar('octofit_path', default=None)
+_listener = None
+
+
+class RequestProfile:
+    """Counters collected while one sampled request runs"""
+
+    def __init__(self, count_queries=True):
+        # None when ORM queries cannot be counted (under ASGI)
+        self.queries = 0 if count_queries else None
+        self.commands = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+
+
+class CommandProfiler(monitoring.CommandListener):
+    """Attribute MongoDB command time to the request that issued the command
+
+    pymongo calls listeners synchronously on the thread that issued the
+    command, so the context's profile tells requests apart.
+    This also covers raw ``DjongoManager`` calls that bypass the SQL layer.
+    """
+
+    def __init__(self, slow_query_ms):
+        self.slow_query_micros = None if slow_query_ms is None else slow_query_ms * 1000
+        self._commands = {}
+
+    def started(self, event):
+        if self.slow_query_micros is not None:
+            self._commands[event.request_id] = event.command
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        command = self._commands.pop(event.request_id, None)
+        profile = _profile.get()
+        if profile is not None:
+            profile.commands += 1
+            profile.db_time += event.duration_micros / 1e6
+        if command is not None and event.duration_micros >= self.slow_query_micros:
+            slow_query_logger.warning(json.dumps({
+                'path': _path.get(),
+                'database': event.database_name,
+                'command_name': event.command_name,
+                'duration_ms': round(event.duration_micros / 1000, 3),
+                'command': _summarize(command),
+            }, default=str))
+
+
+def options():
+    """``OCTOFIT_PROFILING`` over the defaults"""
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_PROFILING', {})}
+
+
+def install_listener():
+    """Register the command listener once per process if profiling is enabled
+
+    Only MongoClients created afterwards report to it, and djongo caches its
+    client from the first connection, which ``runserver``'s migration check
+    opens before the middleware is loaded. ``OctofitTrackerConfig.ready()``
+    therefore installs it, before anything connects.
+    """
+    global _listener
+    profiling = options()
+    if _listener is None and profiling['ENABLED']:
+        _listener = CommandProfiler(profiling['SLOW_QUERY_MS'])
+        monitoring.register(_listener)
+    return _listener
+
+
+def _summarize(command):
+    """Trim long lists (inserted documents, bulk updates) out of a logged command"""
+    summary = {}
+    for key, value in command.items():
+        if isinstance(value, list) and len(value) > MAX_LOGGED_ITEMS:
+            value = value[:MAX_LOGGED_ITEMS] + [f'... {len(value) - MAX_LOGGED_ITEMS} more']
+        summary[key] = value
+    return summary
+
+
+class QueryProfilingMiddleware:
+    """Report query count, database, render and total time for sampled requests"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        profiling = options()
+        if not profiling['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        self.sample_rate = profiling['SAMPLE_RATE']
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        path = _path.set(request.path)
+        try:
+            if random.random() >= self.sample_rate:
+                return self.get_response(request)
+            profile = RequestProfile()
+            token = _profile.set(profile)
+            started = time.perf_counter()
+            try:
+                with connection.execute_wrapper(self.count_query):
+                    response = self.get_response(request)
+            finally:
+                _profile.reset(token)
+            return self.report(request, response, profile, time.perf_counter() - started)
+        finally:
+            _path.reset(path)
+
+    async def __acall__(self, request):
+        path = _path.set(request.path)
+        try:
+            if random.random() >= self.sample_rate:
+                return await self.get_response(request)
+            profile = RequestProfile(count_queries=False)
+            token = _profile.set(profile)
+            started = time.perf_counter()
+            try:
+                response = await self.get_response(request)
+            finally:
+                _profile.reset(token)
+            return self.report(request, response, profile, time.perf_counter() - started)
+        finally:
+            _path.reset(path)
+
+    def report(self, request, response, profile, total):
+        """Add the Server-Timing header and log the request's profile"""
+        # Serializers read lazily evaluated querysets, so db time can overlap serialize time
+        app = max(total - profile.db_time - profile.serialize_time - profile.render_time, 0)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={profile.db_time * 1000:.1f};desc="{_queries(profile)}{profile.commands} commands"',
+            f'serialize;dur={profile.serialize_time * 1000:.1f}',
+            f'render;dur={profile.render_time * 1000:.1f}',
+            f'app;dur={app * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        entry = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': profile.queries,
+            'commands': profile.commands,
+            'db_ms': round(profile.db_time * 1000, 3),
+            'serialize_ms': round(profile.serialize_time * 1000, 3),
+            'render_ms': round(profile.render_time * 1000, 3),
+            'total_ms': round(total * 1000, 3),
+            # Streamed bodies are produced after this middleware returns
+            'bytes': None if response.streaming else len(response.content),
+        }
+        logger.info(json.dumps(entry), extra={'profile': entry})
+        return response
+
+    def count_query(self, execute, sql, params, many, context):
+        profile = _profile.get()
+        if profile is not None:
+            profile.queries += 1
+        return execute(sql, params, many, context)
+
+    def process_template_response(self, request, response):
+        """Time DRF's rendering, which runs after the view returns"""
+        profile = _profile.get()
+        if profile is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                profile.render_time = time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class SerializationTimingMixin:
+    """Add a top-level serializer's ``to_representation`` time to the sampled request's profile
+
+    For ``many=True`` each row is timed, so evaluating the queryset itself
+    is left to the db and app buckets.
+    """
+
+    def to_representation(self, instance):
+        profile = _profile.get()
+        parent = self.parent
+        top_level = parent is None or (parent.parent is None and isinstance(parent, serializers.ListSerializer))
+        if profile is None or not top_level:
+            return super().to_representation(instance)
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile.serialize_time += time.perf_counter() - started
+
+
+def _queries(profile):
+    return '' if profile.queries is None else f'{profile.queries} queries, '
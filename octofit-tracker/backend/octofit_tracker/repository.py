@@ -0,0 +1,187 @@
+"""Native pymongo reads and writes for the hot request paths.
+
+djongo runs every ORM query through Django's SQL compiler and then parses
+that SQL back into a MongoDB command with sqlparse, on every call. For the
+small, frequent queries behind the activity feed, the leaderboards and
+activity logging, that translation costs more CPU than the database round
+trip. ``manage.py benchmark_repository`` measures it per query.
+
+The functions here build find, update and insert commands directly,
+projected down to the fields the caller uses. The models stay the schema
+of record: collection names, columns, defaults and value conversion all
+come from the model's fields. Reads return ``Record`` objects, which the
+model serializers and the leaderboard helpers read like model instances.
+Anything that needs model behaviour (saving, signals, related managers)
+keeps using the ORM.
+"""
+from datetime import timezone as dt_timezone
+from bson import ObjectId
+from django.db import connection
+from django.db.models import DateTimeField
+from . import mongo
+
+# Django lookups understood by ``match``
+LOOKUPS = {
+    'exact': None,
+    'in': '$in',
+    'gt': '$gt',
+    'gte': '$gte',
+    'lt': '$lt',
+    'lte': '$lte',
+}
+
+
+class Record:
+    """A document read straight from MongoDB, shaped like an instance of its model
+
+    Fields are set under their attnames (``user_id``, not ``user``);
+    ``attach`` adds related records under the relation's name.
+    ``serializable_value`` is what DRF's primary key fields call.
+    """
+
+    def __init__(self, model, values):
+        self._model = model
+        self.__dict__.update(values)
+
+    @property
+    def pk(self):
+        return getattr(self, self._model._meta.pk.attname)
+
+    def serializable_value(self, field_name):
+        return getattr(self, self._model._meta.get_field(field_name).attname)
+
+    def __repr__(self):
+        return f'<{self._model.__name__} record {self.pk}>'
+
+
+def collection(model, read_only=False):
+    """The model's pymongo collection"""
+    if read_only:
+        return mongo.read_only(model)
+    return mongo.database()[model._meta.db_table]
+
+
+def match(model, **lookups):
+    """Mongo filter for Django-style ``field__lookup=value`` keyword arguments"""
+    query = {}
+    for lookup, value in lookups.items():
+        name, _, operator = lookup.partition('__')
+        field = _field(model, name)
+        operator = LOOKUPS[operator or 'exact']
+        if operator is None:
+            query[field.column] = _prep(field, value)
+        elif operator == '$in':
+            query.setdefault(field.column, {})['$in'] = [_prep(field, item) for item in value]
+        else:
+            query.setdefault(field.column, {})[operator] = _prep(field, value)
+    return query
+
+
+def find(model, query, fields=None, sort=None, limit=None, read_only=False):
+    """Records for the documents matching ``query``
+
+    ``fields`` limits the projection to those fields (the primary key is
+    always read); ``sort`` takes field names, ``-`` meaning descending.
+    """
+    projection = None
+    if fields is not None:
+        projection = {_field(model, name).column: 1 for name in fields}
+        projection[model._meta.pk.column] = 1
+    cursor = collection(model, read_only).find(query, projection)
+    if sort:
+        cursor = cursor.sort([
+            (_field(model, name.lstrip('-')).column, -1 if name.startswith('-') else 1) for name in sort
+        ])
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return [_record(model, document) for document in cursor]
+
+
+def attach(records, name, fields, read_only=False):
+    """Set each record's ``name`` relation to a record of the related row, or None
+
+    The equivalent of ``select_related`` for records: one query for all of
+    them, projected to ``fields``.
+    """
+    if not records:
+        return records
+    relation = records[0]._model._meta.get_field(name)
+    target = relation.target_field
+    ids = {getattr(record, relation.attname) for record in records} - {None}
+    related = {}
+    if ids:
+        rows = find(
+            relation.related_model,
+            {target.column: {'$in': list(ids)}},
+            fields=[target.attname, *fields],
+            read_only=read_only,
+        )
+        related = {getattr(row, target.attname): row for row in rows}
+    for record in records:
+        setattr(record, name, related.get(getattr(record, relation.attname)))
+    return records
+
+
+def top_ranked(model, query, score_field, limit, fields=None, read_only=False):
+    """``leaderboards.top_ranked`` on records: the first ``limit`` by (-score, user_id)"""
+    rows = find(model, query, fields, sort=[f'-{score_field}', '-user_id'], limit=limit, read_only=read_only)
+    if not rows:
+        return rows
+    boundary = getattr(rows[-1], score_field)
+    above = sorted(
+        (row for row in rows if getattr(row, score_field) > boundary),
+        key=lambda row: (-getattr(row, score_field), row.user_id)
+    )
+    tied = find(
+        model, {**query, _field(model, score_field).column: boundary}, fields,
+        sort=['user_id'], limit=limit - len(above), read_only=read_only
+    )
+    return above + tied
+
+
+def insert(instance):
+    """Insert a new model instance with one ``insert_one``
+
+    Defaults, ``auto_now_add`` and value conversion are applied by the
+    model's fields as in ``save()``. Model ``save()`` overrides and signals
+    do not run, so callers do that work themselves.
+    """
+    meta = instance._meta
+    if getattr(instance, meta.pk.attname) is None:
+        setattr(instance, meta.pk.attname, ObjectId())
+    document = {
+        field.column: field.get_db_prep_save(field.pre_save(instance, add=True), connection)
+        for field in meta.concrete_fields
+    }
+    collection(type(instance)).insert_one(document)
+    instance._state.adding = False
+    instance._state.db = connection.alias
+    return instance
+
+
+def _field(model, name):
+    if name == 'pk':
+        return model._meta.pk
+    for field in model._meta.concrete_fields:
+        if name in (field.name, field.attname):
+            return field
+    raise ValueError(f'{model.__name__} has no field {name!r}')
+
+
+def _prep(field, value):
+    if isinstance(value, ObjectId):
+        return value
+    return field.get_prep_value(value)
+
+
+def _record(model, document):
+    values = {}
+    for field in model._meta.concrete_fields:
+        if field.column not in document:
+            continue
+        value = document[field.column]
+        # djongo stores datetimes as naive UTC
+        if isinstance(field, DateTimeField) and value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=dt_timezone.utc)
+        values[field.attname] = value
+    return Record(model, values)
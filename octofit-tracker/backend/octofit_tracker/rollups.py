@@ -0,0 +1,218 @@
+"""Incremental maintenance of time-bucketed activity rollups.
+
+Every activity contributes to a day, a week (starting Monday) and a month
+bucket for its owner and for each of the owner's teams, broken down by
+activity type. ``scoring`` forwards activity writes and membership changes
+here, and each change becomes one unordered batch of ``$inc`` upserts.
+A team's buckets always equal the sum of its current members' buckets,
+matching how team points follow membership. ``manage.py rebuild_rollups``
+recomputes everything from the activity history.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from . import jobs
+from .models import Activity, ActivityRollup, Team
+
+GRANULARITIES = ('day', 'week', 'month')
+TOTALS = ('count', 'duration', 'distance', 'calories', 'points')
+
+# How far back trends reach when no start date is given
+DEFAULT_WINDOWS = {
+    'day': timedelta(days=30),
+    'week': timedelta(weeks=26),
+    'month': timedelta(days=365),
+}
+
+DUPLICATE_KEY = 11000
+
+
+def period_start(date, granularity):
+    """Start of the UTC bucket containing ``date``, as a naive UTC datetime"""
+    if date.tzinfo is not None:
+        date = date.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    day = datetime(date.year, date.month, date.day)
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def activities_changed(changes, marker=None):
+    """Apply ``(snapshot, sign)`` pairs from ``scoring.snapshot`` to the buckets"""
+    changes = list(changes)
+    teams = _teams_by_user({stats['user_id'] for stats, sign in changes})
+    deltas = defaultdict(lambda: dict.fromkeys(TOTALS, 0))
+    for stats, sign in changes:
+        owners = [(stats['user_id'], None)] + [(None, team_id) for team_id in teams[stats['user_id']]]
+        for granularity in GRANULARITIES:
+            start = period_start(stats['date'], granularity)
+            for user_id, team_id in owners:
+                delta = deltas[(user_id, team_id, granularity, start, stats['activity_type'])]
+                delta['count'] += sign
+                delta['duration'] += sign * stats['duration']
+                delta['distance'] += sign * (stats['distance'] or 0)
+                delta['calories'] += sign * stats['calories']
+                delta['points'] += sign * stats['points_earned']
+    _write(deltas, marker)
+
+
+def member_joined(team_id, user_id):
+    """Add the new member's buckets to the team's"""
+    _move_member(team_id, user_id, sign=1)
+
+
+def member_left(team_id, user_id):
+    """Remove the departing member's buckets from the team's"""
+    _move_member(team_id, user_id, sign=-1)
+
+
+def rebuild():
+    """Recompute every bucket from the activity history
+
+    Activities are grouped into daily totals by MongoDB; weeks, months and
+    team buckets are summed from those in Python. Returns the number of
+    bucket documents written.
+    """
+    pipeline = [
+        {'$group': {
+            '_id': {
+                'user_id': '$user_id',
+                'activity_type': '$activity_type',
+                'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+            },
+            'count': {'$sum': 1},
+            'duration': {'$sum': '$duration'},
+            'distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+            'calories': {'$sum': {'$ifNull': ['$calories', 0]}},
+            'points': {'$sum': '$points_earned'},
+        }},
+    ]
+    teams = _teams_by_user(None)
+    buckets = defaultdict(lambda: dict.fromkeys(TOTALS, 0))
+    for row in Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True):
+        key = row['_id']
+        day = datetime.strptime(key['day'], '%Y-%m-%d')
+        owners = [(key['user_id'], None)] + [(None, team_id) for team_id in teams[key['user_id']]]
+        for granularity in GRANULARITIES:
+            start = period_start(day, granularity)
+            for user_id, team_id in owners:
+                bucket = buckets[(user_id, team_id, granularity, start, key['activity_type'])]
+                for field in TOTALS:
+                    bucket[field] += row[field]
+
+    ActivityRollup.objects.mongo_delete_many({})
+    rollups = [
+        ActivityRollup(
+            _id=ObjectId(),
+            user_id=user_id,
+            team_id=team_id,
+            granularity=granularity,
+            period_start=start.replace(tzinfo=dt_timezone.utc),
+            activity_type=activity_type,
+            **totals
+        )
+        for (user_id, team_id, granularity, start, activity_type), totals in buckets.items()
+    ]
+    ActivityRollup.objects.bulk_create(rollups, batch_size=5000)
+    return len(rollups)
+
+
+def default_start(granularity, now):
+    """First bucket shown when trends are requested without a start date"""
+    return period_start(now - DEFAULT_WINDOWS[granularity], granularity).replace(tzinfo=dt_timezone.utc)
+
+
+def series(rows):
+    """Group rollup rows (as dicts) into one entry per period, with per-type totals"""
+    periods = {}
+    for row in rows:
+        period = periods.setdefault(row['period_start'], {
+            'period_start': row['period_start'].date().isoformat(),
+            **dict.fromkeys(TOTALS, 0),
+            'by_type': {},
+        })
+        for field in TOTALS:
+            period[field] += row[field]
+        period['by_type'][row['activity_type']] = {
+            field: round(row[field], 2) if field == 'distance' else row[field] for field in TOTALS
+        }
+    for period in periods.values():
+        period['distance'] = round(period['distance'], 2)
+    return [periods[start] for start in sorted(periods)]
+
+
+def _move_member(team_id, user_id, sign):
+    rows = ActivityRollup.objects.filter(user_id=user_id, team__isnull=True).values(
+        'granularity', 'period_start', 'activity_type', *TOTALS
+    )
+    deltas = {}
+    for row in rows:
+        start = row['period_start']
+        if start.tzinfo is not None:
+            start = start.astimezone(dt_timezone.utc).replace(tzinfo=None)
+        key = (None, team_id, row['granularity'], start, row['activity_type'])
+        deltas[key] = {field: sign * row[field] for field in TOTALS}
+    _write(deltas)
+
+
+def _teams_by_user(user_ids):
+    """Map user ids to their team ids; ``None`` loads every membership"""
+    memberships = Team.members.through.objects.all()
+    if user_ids is not None:
+        memberships = memberships.filter(user_id__in=list(user_ids))
+    teams = defaultdict(list)
+    for user_id, team_id in memberships.values_list('user_id', 'team_id'):
+        teams[user_id].append(team_id)
+    return teams
+
+
+def _write(deltas, marker=None):
+    """Upsert each bucket with ``$inc``, retrying upserts that raced on the unique index
+
+    With a job step's ``marker``, buckets the step already wrote are skipped.
+    """
+    operations = []
+    for (user_id, team_id, granularity, start, activity_type), delta in deltas.items():
+        inc = {field: value for field, value in delta.items() if value}
+        if not inc:
+            continue
+        operations.append(UpdateOne(
+            {
+                'user_id': user_id,
+                'team_id': team_id,
+                'granularity': granularity,
+                'period_start': start,
+                'activity_type': activity_type,
+                **jobs.unapplied(marker),
+            },
+            jobs.mark_applied(
+                {'$inc': inc, '$setOnInsert': {field: 0 for field in TOTALS if field not in inc}}, marker
+            ),
+            upsert=True
+        ))
+    if not operations:
+        return
+    try:
+        ActivityRollup.objects.mongo_bulk_write(operations, ordered=False)
+    except BulkWriteError as exc:
+        retry = _duplicates(exc, operations)
+        # The bucket was inserted by a concurrent writer; now it matches
+        try:
+            ActivityRollup.objects.mongo_bulk_write(retry, ordered=False)
+        except BulkWriteError as exc:
+            if marker is None:
+                raise
+            # The bucket exists and carries the marker: already applied
+            _duplicates(exc, retry)
+
+
+def _duplicates(exc, operations):
+    """The operations of a bulk write that failed on the unique index, re-raising any other error"""
+    errors = exc.details['writeErrors']
+    if any(error['code'] != DUPLICATE_KEY for error in errors):
+        raise exc
+    return [operations[error['index']] for error in errors]
@@ -0,0 +1,235 @@
+"""Incremental maintenance of denormalized leaderboard stats.
+
+Views call into this module whenever activities are written or team
+membership changes, so the leaderboard can be served from ``UserProfile``
+alone instead of aggregating activities per ranked user, and team totals
+are adjusted by the change instead of being re-summed from every member's
+history. ``manage.py recompute_points`` rebuilds everything from scratch.
+The same changes are forwarded to ``rollups`` for the trend buckets and
+to ``leaderboard_windows`` for the 7-day, 30-day and season scores, and
+to ``challenges`` for challenge progress. Challenge rewards are added to
+the winner's points like activity points.
+
+Activity writes only queue their changes as a ``jobs`` job, and a
+worker applies them after the response is sent. Membership changes are
+still applied in the request and read the state applied so far, so
+totals stay consistent in whatever order the work runs. Joining a
+challenge is the exception: it rebuilds progress from the activities
+themselves, including ones whose job is still queued, so the job skips
+progress rebuilt after its changes were recorded.
+"""
+from datetime import timezone as dt_timezone
+from django.contrib.auth.models import User
+from django.utils import timezone
+from . import challenges, jobs, leaderboard_windows, repository, rollups
+from .models import UserProfile, Team
+from .leaderboards import invalidate_team_leaderboard
+from .metrics import ACTIVITIES_CREATED, POINTS_AWARDED
+
+
+def snapshot(activity):
+    """Capture the fields of an activity that feed the denormalized stats"""
+    return {
+        'user_id': activity.user_id,
+        'points_earned': activity.points_earned,
+        'calories': activity.calories or 0,
+        'activity_type': activity.activity_type,
+        'duration': activity.duration,
+        'distance': activity.distance,
+        'date': activity.date,
+    }
+
+
+def activity_created(activity):
+    """Queue a newly logged activity for its owner's stats"""
+    _record([(snapshot(activity), 1)])
+    ACTIVITIES_CREATED.inc()
+    POINTS_AWARDED.inc(activity.points_earned)
+
+
+def activities_created(activities):
+    """Queue a batch of new activities as one job"""
+    _record([(snapshot(activity), 1) for activity in activities])
+    ACTIVITIES_CREATED.inc(len(activities))
+    POINTS_AWARDED.inc(sum(activity.points_earned for activity in activities))
+
+
+def activity_updated(activity, previous):
+    """Queue replacing the stats contributed by ``previous`` with the activity's current values"""
+    _record([(previous, -1), (snapshot(activity), 1)])
+
+
+def activity_deleted(previous):
+    """Queue removing a deleted activity's contribution from its owner's stats"""
+    _record([(previous, -1)])
+
+
+@jobs.handler('activities_changed')
+def apply_activity_changes(job):
+    """Apply queued ``(snapshot, sign)`` changes, one step per kind of derived state"""
+    changes = [(_restore(change['stats']), change['sign']) for change in job.payload['changes']]
+    recorded_at = job.payload.get('recorded_at')
+    if recorded_at is not None and timezone.is_naive(recorded_at):
+        recorded_at = recorded_at.replace(tzinfo=dt_timezone.utc)
+    totals = _totals_by_user(changes)
+    job.step('profiles', _update_profiles, totals)
+    job.step('teams', _update_all_teams, totals)
+    job.step('rollups', rollups.activities_changed, changes)
+    job.step('windows', leaderboard_windows.activities_changed, changes)
+    job.step('challenges', _update_challenges, changes, recorded_at)
+
+
+def member_joined(team, user):
+    """Add a new member's points to the team and update their primary team
+
+    The primary team is the oldest team the user belongs to, as in
+    ``UserProfile.refresh_stats``, so joining an older team takes it over.
+    """
+    profile, created = UserProfile.objects.get_or_create(user=user)
+    _increment_team(team, points=profile.total_points, members=1)
+    rollups.member_joined(team.pk, user.pk)
+    primary = profile.primary_team
+    if primary is None or team.created_at < primary.created_at:
+        # Write only the primary team so concurrent point increments survive
+        UserProfile.objects.filter(pk=profile.pk).update(primary_team=team)
+
+
+def member_left(team, user):
+    """Remove a departing member's points and fall back to their next oldest team"""
+    profile = UserProfile.objects.filter(user=user).first()
+    _increment_team(team, points=-profile.total_points if profile else 0, members=-1)
+    rollups.member_left(team.pk, user.pk)
+    if profile is None:
+        return
+    if profile.primary_team_id == team.pk:
+        next_team = user.teams.exclude(pk=team.pk).order_by('created_at').first()
+        UserProfile.objects.filter(pk=profile.pk).update(primary_team=next_team)
+
+
+def challenge_joined(challenge, user):
+    """Start tracking a new participant's progress, rewarding an immediate completion"""
+    rewards_awarded(challenges.participant_joined(challenge, user.pk))
+
+
+def challenge_changed(challenge):
+    """Rebuild a challenge's progress after its definition changed, rewarding new completions"""
+    rewards_awarded(challenges.rebuild_challenge(challenge))
+
+
+def challenge_left(challenge, user):
+    """Remove a departing participant from the challenge standings"""
+    challenges.participant_left(challenge, user.pk)
+
+
+def rewards_awarded(awards, marker=None):
+    """Add ``(user_id, points)`` challenge rewards to the winners' profiles and teams"""
+    totals = {}
+    for user_id, points in awards:
+        totals[user_id] = totals.get(user_id, 0) + points
+    for user_id, points in totals.items():
+        _update_profile(user_id, points=points, marker=marker)
+    _update_teams(totals, marker)
+
+
+def _record(changes):
+    jobs.enqueue('activities_changed', {
+        'changes': [{'stats': stats, 'sign': sign} for stats, sign in changes],
+        'recorded_at': timezone.now(),
+    })
+
+
+def _restore(stats):
+    # Dates come back from the queue as naive UTC
+    if timezone.is_naive(stats['date']):
+        stats = {**stats, 'date': stats['date'].replace(tzinfo=dt_timezone.utc)}
+    return stats
+
+
+def _totals_by_user(changes):
+    totals = {}
+    for stats, sign in changes:
+        user = totals.setdefault(stats['user_id'], {'points': 0, 'calories': 0, 'count': 0})
+        user['points'] += sign * stats['points_earned']
+        user['calories'] += sign * stats['calories']
+        user['count'] += sign
+    return totals
+
+
+def _update_profiles(totals, marker=None):
+    for user_id, stats in totals.items():
+        _update_profile(user_id, **stats, marker=marker)
+
+
+def _update_all_teams(totals, marker=None):
+    _update_teams({user_id: stats['points'] for user_id, stats in totals.items()}, marker)
+
+
+def _update_challenges(changes, recorded_at, marker=None):
+    # A completion claimed by a worker that died before adding the reward
+    # is not rewarded on redelivery; recompute_points restores it
+    rewards_awarded(challenges.activities_changed(changes, recorded_at, marker), marker)
+
+
+def _update_profile(user_id, points=0, calories=0, count=0, marker=None):
+    """Atomically increment the user's profile counters, creating the profile if needed
+
+    Nothing is written for users that no longer exist, or when the job step
+    behind ``marker`` already updated the profile.
+    """
+    inc = {
+        'total_points': points,
+        'total_calories': calories,
+        'activity_count': count,
+    }
+    inc = {field: value for field, value in inc.items() if value}
+    if not inc:
+        return
+    # $inc touches only the counters, so concurrent writers never lose points
+    match = {'user_id': user_id, **jobs.unapplied(marker)}
+    update = jobs.mark_applied({'$inc': inc}, marker)
+    if UserProfile.objects.mongo_update_one(match, update).matched_count:
+        return
+    if UserProfile.objects.mongo_find_one({'user_id': user_id}, {'_id': 1}) is None:
+        if User.objects.filter(pk=user_id).values_list('pk', flat=True).first() is None:
+            # A queued job can outlive its user
+            return
+        UserProfile.objects.get_or_create(user_id=user_id)
+        UserProfile.objects.mongo_update_one(match, update)
+
+
+def _update_teams(points_by_user, marker=None):
+    """Atomically add each user's points to every team they belong to
+
+    Points are summed per team first, so each team takes one write.
+    """
+    points_by_user = {user_id: points for user_id, points in points_by_user.items() if points}
+    if not points_by_user:
+        return
+    memberships = repository.find(
+        Team.members.through,
+        repository.match(Team.members.through, user_id__in=list(points_by_user)),
+        fields=['team_id', 'user_id'],
+    )
+    team_points = {}
+    for membership in memberships:
+        team_points[membership.team_id] = team_points.get(membership.team_id, 0) + points_by_user[membership.user_id]
+    for team_id, points in team_points.items():
+        if points:
+            Team.objects.mongo_update_one(
+                {'_id': team_id, **jobs.unapplied(marker)},
+                jobs.mark_applied({'$inc': {'total_points': points}}, marker),
+            )
+    if team_points:
+        invalidate_team_leaderboard()
+
+
+def _increment_team(team, points=0, members=0):
+    """Atomically adjust a single team's totals, keeping the instance in sync"""
+    inc = {'total_points': points, 'member_count': members}
+    inc = {field: value for field, value in inc.items() if value}
+    if not inc:
+        return
+    Team.objects.mongo_update_one({'_id': team.pk}, {'$inc': inc})
+    team.total_points += points
+    team.member_count += members
+    invalidate_team_leaderboard()
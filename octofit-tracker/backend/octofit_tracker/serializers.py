@@ -1,9 +1,70 @@
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.functional import cached_property
 from .models import UserProfile, Activity, Team, Challenge, WorkoutSuggestion
-
-
-class UserSerializer(serializers.ModelSerializer):
+from . import repository, scoring
+from .profiling import SerializationTimingMixin
+
+
+class SparseFieldsetMixin:
+    """Serialize only the fields named in ``?fields=``, or all but those in ``?omit=``
+
+    Both take comma-separated field names and apply to GET responses of the
+    top-level serializer. ``model_fields`` tells the view which model fields
+    the chosen serializer fields read, so it can leave the rest unloaded;
+    ``field_sources`` lists them for fields computed from other fields.
+    """
+    field_sources = {}
+
+    @classmethod
+    def requested_fields(cls, request):
+        """The serializer field names to include, or None for all of them"""
+        params = request.query_params
+        if request.method != 'GET' or not ('fields' in params or 'omit' in params):
+            return None
+        available = list(cls.Meta.fields)
+        names = set(available)
+        for param in ('fields', 'omit'):
+            if param not in params:
+                continue
+            listed = {name.strip() for name in params[param].split(',') if name.strip()}
+            unknown = listed - set(available)
+            if unknown:
+                raise ValidationError({
+                    param: f'Unknown fields: {", ".join(sorted(unknown))}. Choose from: {", ".join(available)}.'
+                })
+            names = names & listed if param == 'fields' else names - listed
+        return names
+
+    @classmethod
+    def model_fields(cls, names):
+        """Names of the model fields that serializing ``names`` reads"""
+        declared = cls().fields
+        needed = set()
+        for name in names:
+            if name in cls.field_sources:
+                needed.update(cls.field_sources[name])
+            elif declared[name].source == '*':
+                needed.add(name)
+            else:
+                needed.add(declared[name].source.split('.')[0])
+        return needed
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        top_level = self.parent is None or (self.parent.parent is None and isinstance(self.parent, serializers.ListSerializer))
+        if request is None or not top_level:
+            return fields
+        names = self.requested_fields(request)
+        if names is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in names}
+
+
+class UserSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     """Serializer for User model"""
     class Meta:
         model = User
@@ -11,7 +72,19 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class CounterSafeUpdateMixin:
+    """Save only the edited fields so atomic counter increments are not overwritten"""
+
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+
+class UserProfileSerializer(
+    SerializationTimingMixin, SparseFieldsetMixin, CounterSafeUpdateMixin, serializers.ModelSerializer
+):
     """Serializer for UserProfile model"""
     user = UserSerializer(read_only=True)
     _id = serializers.SerializerMethodField()
@@ -27,7 +100,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return str(obj._id) if obj._id else None
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(SerializationTimingMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Activity model"""
     user_name = serializers.CharField(source='user.username', read_only=True)
     _id = serializers.SerializerMethodField()
@@ -43,7 +116,7 @@ class ActivitySerializer(serializers.ModelSerializer):
         return str(obj._id) if obj._id else None
 
 
-class ActivityCreateSerializer(serializers.ModelSerializer):
+class ActivityCreateSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     """Serializer for creating activities"""
     class Meta:
         model = Activity
@@ -51,13 +124,19 @@ class ActivityCreateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
-        return super().create(validated_data)
+        # One insert_one instead of a translated SQL INSERT, see repository;
+        # points are computed here because Activity.save() does not run
+        activity = Activity(**validated_data)
+        activity.points_earned = Activity.calculate_points(activity.activity_type, activity.duration)
+        return repository.insert(activity)
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(
+    SerializationTimingMixin, SparseFieldsetMixin, CounterSafeUpdateMixin, serializers.ModelSerializer
+):
     """Serializer for Team model"""
+    id = serializers.CharField(source='pk', read_only=True)
     coach_name = serializers.CharField(source='coach.username', read_only=True)
-    member_count = serializers.SerializerMethodField()
     members = UserSerializer(many=True, read_only=True)
     _id = serializers.SerializerMethodField()
 
@@ -66,18 +145,24 @@ class TeamSerializer(serializers.ModelSerializer):
         fields = ['id', '_id', 'name', 'description', 'coach', 'coach_name', 
                   'members', 'member_count', 'total_points', 'avatar', 
                   'created_at', 'updated_at']
-        read_only_fields = ['id', '_id', 'total_points', 'created_at', 'updated_at']
+        read_only_fields = ['id', '_id', 'member_count', 'total_points', 'created_at', 'updated_at']
 
     def get__id(self, obj):
         """Convert ObjectId to string"""
         return str(obj._id) if obj._id else None
 
-    def get_member_count(self, obj):
-        """Get the number of members in the team"""
-        return obj.members.count()
 
+class TeamListSerializer(TeamSerializer):
+    """Lightweight team representation for list pages, with member ids only"""
+    member_ids = serializers.PrimaryKeyRelatedField(source='members', many=True, read_only=True)
 
-class TeamCreateSerializer(serializers.ModelSerializer):
+    class Meta(TeamSerializer.Meta):
+        fields = ['id', '_id', 'name', 'description', 'coach', 'coach_name',
+                  'member_ids', 'member_count', 'total_points', 'avatar',
+                  'created_at', 'updated_at']
+
+
+class TeamCreateSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     """Serializer for creating teams"""
     class Meta:
         model = Team
@@ -88,20 +173,28 @@ class TeamCreateSerializer(serializers.ModelSerializer):
         team = Team.objects.create(**validated_data)
         # Add coach as a member
         team.members.add(self.context['request'].user)
+        scoring.member_joined(team, self.context['request'].user)
         return team
 
 
-class ChallengeSerializer(serializers.ModelSerializer):
+class ChallengeSerializer(SerializationTimingMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Challenge model"""
     participant_count = serializers.SerializerMethodField()
+    status = serializers.SerializerMethodField()
     is_active = serializers.SerializerMethodField()
     _id = serializers.SerializerMethodField()
 
+    field_sources = {
+        'participant_count': ['participants'],
+        'status': ['start_date', 'end_date'],
+        'is_active': ['start_date', 'end_date'],
+    }
+
     class Meta:
         model = Challenge
         fields = ['_id', 'title', 'description', 'challenge_type', 'target_value',
                   'activity_types', 'start_date', 'end_date', 'points_reward',
-                  'participant_count', 'is_active', 'created_at']
+                  'participant_count', 'status', 'is_active', 'created_at']
         read_only_fields = ['_id', 'created_at']
 
     def get__id(self, obj):
@@ -109,17 +202,26 @@ class ChallengeSerializer(serializers.ModelSerializer):
         return str(obj._id) if obj._id else None
 
     def get_participant_count(self, obj):
-        """Get the number of participants"""
+        """Get the number of participants, preferring the queryset annotation"""
+        if hasattr(obj, 'num_participants'):
+            return obj.num_participants
         return obj.participants.count()
 
+    @cached_property
+    def now(self):
+        """One clock reading for every challenge in the response, from the view when given"""
+        return self.context.get('now') or timezone.now()
+
+    def get_status(self, obj):
+        """Upcoming, active or ended at the time of the request"""
+        return obj.status_at(self.now)
+
     def get_is_active(self, obj):
         """Check if challenge is currently active"""
-        from django.utils import timezone
-        now = timezone.now()
-        return obj.start_date <= now <= obj.end_date
+        return obj.status_at(self.now) == 'active'
 
 
-class WorkoutSuggestionSerializer(serializers.ModelSerializer):
+class WorkoutSuggestionSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     """Serializer for WorkoutSuggestion model"""
     _id = serializers.SerializerMethodField()
 
@@ -134,7 +236,7 @@ class WorkoutSuggestionSerializer(serializers.ModelSerializer):
         return str(obj._id) if obj._id else None
 
 
-class LeaderboardSerializer(serializers.Serializer):
+class LeaderboardSerializer(SerializationTimingMixin, serializers.Serializer):
     """Serializer for leaderboard data"""
     user_id = serializers.IntegerField()
     username = serializers.CharField()
@@ -143,3 +245,17 @@ class LeaderboardSerializer(serializers.Serializer):
     total_calories = serializers.IntegerField()
     team_name = serializers.CharField(allow_null=True)
     rank = serializers.IntegerField()
+
+
+class ChallengeProgressSerializer(SerializationTimingMixin, serializers.Serializer):
+    """Serializer for a participant's challenge progress and rank"""
+    user_id = serializers.IntegerField()
+    username = serializers.CharField()
+    value = serializers.FloatField()
+    target_value = serializers.FloatField()
+    percent_complete = serializers.FloatField()
+    activity_count = serializers.IntegerField()
+    completed = serializers.BooleanField()
+    completed_at = serializers.DateTimeField(allow_null=True)
+    points_awarded = serializers.IntegerField()
+    rank = serializers.IntegerField()
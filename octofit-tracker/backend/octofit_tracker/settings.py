@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.metrics.MetricsMiddleware',
+    'octofit_tracker.profiling.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -81,20 +83,105 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
+# CLIENT is passed to pymongo's MongoClient (and motor's, for the async
+# views). Every process has its own pool of up to maxPoolSize connections
+# shared by its request and job worker threads, so size it against the
+# server's connection limit divided by the number of gunicorn workers.
+# Unset options keep pymongo's defaults; /api/health/ reports how busy the
+# pools are.
+
+def _env_int(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+_mongo_client = {
+    'host': os.environ.get('OCTOFIT_MONGO_HOST', 'localhost'),
+    'port': _env_int('OCTOFIT_MONGO_PORT', 27017),
+    'maxPoolSize': _env_int('OCTOFIT_MONGO_MAX_POOL_SIZE', 100),
+    'minPoolSize': _env_int('OCTOFIT_MONGO_MIN_POOL_SIZE', 0),
+    'maxIdleTimeMS': _env_int('OCTOFIT_MONGO_MAX_IDLE_TIME_MS'),
+    'waitQueueTimeoutMS': _env_int('OCTOFIT_MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+    # Comma-separated, in order of preference, e.g. "zstd,snappy,zlib";
+    # zstd and snappy need the zstandard and python-snappy packages
+    'compressors': os.environ.get('OCTOFIT_MONGO_COMPRESSORS'),
+}
 
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
-        'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
-        }
+        'CLIENT': {option: value for option, value in _mongo_client.items() if value is not None},
+    }
+}
+
+# Read preference for raw reads on read-only endpoints (the activity
+# summary, the async API), e.g. "secondaryPreferred" to offload them to
+# replica set secondaries. ORM queries and all writes use the primary.
+
+OCTOFIT_MONGO_READ_PREFERENCE = os.environ.get('OCTOFIT_MONGO_READ_PREFERENCE', 'primary')
+
+
+# Cache
+# Process-local by default; point this at a shared backend (Redis or
+# Memcached) so leaderboard invalidations reach every worker
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit',
     }
 }
 
 
+# Request profiling
+# QueryProfilingMiddleware adds Server-Timing headers and a structured log
+# line (octofit_tracker.profiling logger) to SAMPLE_RATE of requests, and
+# logs MongoDB commands slower than SLOW_QUERY_MS to the
+# octofit_tracker.slow_queries logger (None turns that off). When disabled
+# the middleware is dropped at startup and costs nothing.
+
+OCTOFIT_PROFILING = {
+    'ENABLED': os.environ.get('OCTOFIT_PROFILING') == '1',
+    'SAMPLE_RATE': float(os.environ.get('OCTOFIT_PROFILING_SAMPLE_RATE', '1.0')),
+    'SLOW_QUERY_MS': 100,
+}
+
+# Background jobs
+# Side effects of activity writes (profile and team totals, rollups,
+# windowed leaderboards, challenge progress) are queued in the jobs
+# collection and applied by WORKERS threads started in the process that
+# queues them; `manage.py run_jobs` runs a standalone worker. A job whose
+# worker dies is delivered again once its LEASE_SECONDS lease expires.
+# EAGER applies side effects inside the request instead.
+
+OCTOFIT_JOBS = {
+    'EAGER': os.environ.get('OCTOFIT_JOBS_EAGER') == '1',
+    'WORKERS': int(os.environ.get('OCTOFIT_JOB_WORKERS', '2')),
+    'POLL_INTERVAL': 1.0,
+    'LEASE_SECONDS': 60,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_DELAY': 5,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'octofit_tracker': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -136,6 +223,15 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST framework
+# List endpoints use keyset (cursor) pagination; each viewset declares its
+# ordering, and ?page_size= is capped by KeysetPagination.max_page_size
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -0,0 +1,763 @@
+import io
+import json
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from bson import ObjectId
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from . import challenges, jobs, leaderboard_windows, mongo, repository, rollups
+from .models import (
+    Activity, ActivityRollup, Challenge, ChallengeProgress, Job, LeaderboardWindow, Team, UserProfile,
+    WindowScore,
+)
+from .serializers import TeamSerializer, UserProfileSerializer
+from .views import ActivityViewSet
+
+
+class QueryCountMixin:
+    """Assertions about how many queries a request issues
+
+    Queries are the ORM's SQL statements plus the native reads made
+    through ``repository``, which bypass the SQL layer.
+    """
+
+    def count_queries(self, url):
+        finds = mock.patch.object(repository, 'find', wraps=repository.find)
+        with CaptureQueriesContext(connection) as queries, finds as find:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries) + find.call_count
+
+    def assertConstantQueries(self, url, seed, rows=3):
+        """Assert ``url`` issues as many queries after ``seed(rows)`` as after ``seed`` doubles them"""
+        seed(rows)
+        cache.clear()
+        few = self.count_queries(url)
+        seed(rows)
+        cache.clear()
+        many = self.count_queries(url)
+        self.assertEqual(few, many, f'{url} issued {few} queries for {rows} rows and {many} for {rows * 2}')
+
+
+class ListQueryCountTests(QueryCountMixin, TransactionTestCase):
+    """List endpoints issue a constant number of queries, however many rows they return"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='octofit', is_staff=True)
+        self.client.force_login(self.staff)
+        self.users = 0
+
+    def add_users(self, count):
+        users = []
+        for _ in range(count):
+            self.users += 1
+            user = User.objects.create_user(f'athlete{self.users}', password='octofit')
+            UserProfile.objects.create(_id=ObjectId(), user=user, total_points=self.users)
+            users.append(user)
+        return users
+
+    def add_teams(self, count):
+        for _ in range(count):
+            members = self.add_users(2)
+            team = Team.objects.create(
+                _id=ObjectId(), name=f'Team {ObjectId()}', coach=members[0], member_count=len(members)
+            )
+            team.members.add(*members)
+
+    def add_challenges(self, count):
+        now = timezone.now()
+        for index in range(count):
+            challenge = Challenge.objects.create(
+                _id=ObjectId(),
+                title=f'Challenge {ObjectId()}',
+                description='Log 100 minutes',
+                challenge_type='duration',
+                target_value=100,
+                start_date=now - timedelta(days=index + 1),
+                end_date=now + timedelta(days=7),
+                points_reward=10,
+            )
+            challenge.participants.add(*self.add_users(2))
+
+    def add_activities(self, count):
+        now = timezone.now()
+        for index, user in enumerate(self.add_users(count)):
+            Activity.objects.create(
+                _id=ObjectId(),
+                user=user,
+                activity_type='running',
+                duration=30,
+                points_earned=9,
+                date=now - timedelta(hours=index),
+            )
+
+    def test_team_list(self):
+        self.assertConstantQueries('/api/teams/', self.add_teams)
+
+    def test_challenge_list(self):
+        self.assertConstantQueries('/api/challenges/', self.add_challenges)
+
+    def test_activity_list(self):
+        self.assertConstantQueries('/api/activities/', self.add_activities)
+
+    def test_profile_list(self):
+        self.assertConstantQueries('/api/profiles/', self.add_users)
+
+
+class JobQueueMixin:
+    """Queued jobs stay in the queue until the test runs them
+
+    The worker pool is never started, so ``run_next`` and ``drain`` are the
+    only ways jobs run.
+    """
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(jobs, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def queued(self):
+        return list(Job.objects.mongo_find({}))
+
+    def expire_lease(self, job_id):
+        Job.objects.mongo_update_one(
+            {'_id': job_id}, {'$set': {'locked_until': timezone.now() - timedelta(seconds=1)}}
+        )
+
+
+class ActivityJobTests(JobQueueMixin, TransactionTestCase):
+    """Activity side effects are applied exactly once, however often their job runs"""
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.user = User.objects.create_user('runner', password='octofit')
+        UserProfile.objects.create(_id=ObjectId(), user=self.user)
+        self.team = Team.objects.create(_id=ObjectId(), name='Harriers', member_count=1)
+        self.team.members.add(self.user)
+        self.challenge = Challenge.objects.create(
+            _id=ObjectId(),
+            title='Run 100 minutes',
+            description='Log 100 minutes of running',
+            challenge_type='duration',
+            target_value=100,
+            start_date=now - timedelta(days=1),
+            end_date=now + timedelta(days=7),
+            points_reward=25,
+        )
+        self.challenge.participants.add(self.user)
+        challenges.participant_joined(self.challenge, self.user.pk)
+        leaderboard_windows.ensure_current()
+        self.client.force_login(self.user)
+
+    def log(self, duration):
+        response = self.client.post('/api/activities/', {
+            'activity_type': 'running',
+            'duration': duration,
+            'date': timezone.now().isoformat(),
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def state(self):
+        """Every counter an activity job moves"""
+        profile = UserProfile.objects.get(user=self.user)
+        progress = ChallengeProgress.objects.get(challenge=self.challenge, user=self.user)
+        return {
+            'profile_points': profile.total_points,
+            'activity_count': profile.activity_count,
+            'team_points': Team.objects.get(pk=self.team.pk).total_points,
+            'rollup_points': sum(
+                ActivityRollup.objects.filter(user=self.user, granularity='day').values_list('points', flat=True)
+            ),
+            'window_points': WindowScore.objects.get(window='7d', user=self.user).points,
+            'challenge_value': progress.value,
+            'completed': progress.completed_at is not None,
+        }
+
+    def expected(self, *durations):
+        points = sum(Activity.calculate_points('running', duration) for duration in durations)
+        reward = self.challenge.points_reward if sum(durations) >= self.challenge.target_value else 0
+        return {
+            'profile_points': points + reward,
+            'activity_count': len(durations),
+            'team_points': points + reward,
+            'rollup_points': points,
+            'window_points': points,
+            'challenge_value': sum(durations),
+            'completed': bool(reward),
+        }
+
+    def test_side_effects_wait_for_the_job(self):
+        self.log(60)
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_points, 0)
+        self.assertEqual(jobs.drain(), 1)
+        self.assertEqual(self.state(), self.expected(60))
+        self.assertEqual(self.queued(), [])
+
+    def test_redelivered_job_applies_once(self):
+        self.log(60)
+        self.log(50)
+        delivered = self.queued()
+        self.assertEqual(jobs.drain(), 2)
+        applied = self.state()
+        self.assertEqual(applied, self.expected(60, 50))
+
+        # The worker died after the handler's writes, before recording any
+        # step or deleting the job; the next worker runs it from the start
+        Job.objects.mongo_insert_many(delivered)
+        self.assertEqual(jobs.drain(), 2)
+        self.assertEqual(self.state(), applied)
+
+    @override_settings(OCTOFIT_JOBS={'RETRY_DELAY': 0})
+    def test_failed_step_is_retried_without_repeating_earlier_steps(self):
+        self.log(60)
+        apply_windows = leaderboard_windows.activities_changed
+        attempts = []
+
+        def fail_once(*args, **kwargs):
+            attempts.append(kwargs['marker'])
+            if len(attempts) == 1:
+                raise RuntimeError('boom')
+            return apply_windows(*args, **kwargs)
+
+        failing = mock.patch.object(leaderboard_windows, 'activities_changed', fail_once)
+        with failing, mock.patch('octofit_tracker.jobs.logger'):
+            self.assertTrue(jobs.run_next())
+            job, = self.queued()
+            self.assertEqual(job['status'], 'pending')
+            self.assertEqual(job['attempts'], 1)
+            self.assertEqual(job['done_steps'], ['profiles', 'teams', 'rollups'])
+            self.assertIn('boom', job['last_error'])
+            self.assertTrue(jobs.run_next())
+        self.assertEqual(attempts[0], attempts[1])
+        self.assertEqual(self.state(), self.expected(60))
+        self.assertEqual(self.queued(), [])
+
+    def test_expired_lease_is_claimed_again(self):
+        self.log(60)
+        crashed = jobs.claim()
+        self.assertIsNone(jobs.claim())
+
+        self.expire_lease(crashed.id)
+        reclaimed = jobs.claim()
+        self.assertEqual(reclaimed.id, crashed.id)
+        self.assertEqual(reclaimed.attempts, 2)
+        self.assertNotEqual(reclaimed.lease, crashed.lease)
+
+        # The first worker no longer owns the job and cannot fail or delete it
+        with mock.patch('octofit_tracker.jobs.logger'):
+            jobs._failed(crashed, 'late failure')
+        Job.objects.mongo_delete_one(crashed.owned())
+        job, = self.queued()
+        self.assertEqual(job['status'], 'running')
+        self.assertEqual(job['last_error'], '')
+
+        self.expire_lease(reclaimed.id)
+        self.assertTrue(jobs.run_next())
+        self.assertEqual(self.state(), self.expected(60))
+        self.assertEqual(self.queued(), [])
+
+    def test_heartbeat_notices_a_lost_lease(self):
+        self.log(60)
+        job = jobs.claim()
+        self.expire_lease(job.id)
+        jobs.claim()
+        heartbeat = jobs.Heartbeat(job, mongo.database()[Job._meta.db_table], lease_seconds=0.03)
+        heartbeat.start()
+        heartbeat.join(timeout=5)
+        self.assertTrue(job.lease_lost)
+        with self.assertRaises(jobs.LeaseLost):
+            job.step('profiles', lambda marker: None)
+
+
+class JobRetryTests(JobQueueMixin, TransactionTestCase):
+    """Failing jobs back off between attempts and are left failed after the last"""
+
+    def setUp(self):
+        super().setUp()
+        self.calls = 0
+        handlers = mock.patch.dict(jobs.HANDLERS, {'broken': self.broken})
+        handlers.start()
+        self.addCleanup(handlers.stop)
+        logger = mock.patch('octofit_tracker.jobs.logger')
+        self.logger = logger.start()
+        self.addCleanup(logger.stop)
+
+    def broken(self, job):
+        self.calls += 1
+        raise ValueError(f'attempt {self.calls}')
+
+    @override_settings(OCTOFIT_JOBS={'MAX_ATTEMPTS': 2, 'RETRY_DELAY': 60})
+    def test_backoff_then_give_up(self):
+        jobs.enqueue('broken', {})
+        started = timezone.now()
+        self.assertTrue(jobs.run_next())
+        job, = self.queued()
+        self.assertEqual((job['status'], job['attempts']), ('pending', 1))
+        self.assertGreaterEqual(job['run_after'], (started + timedelta(seconds=59)).replace(tzinfo=None))
+        self.assertFalse(jobs.run_next())
+
+        Job.objects.mongo_update_one({'_id': job['_id']}, {'$set': {'run_after': started}})
+        self.assertTrue(jobs.run_next())
+        job, = self.queued()
+        self.assertEqual((job['status'], job['attempts']), ('failed', 2))
+        self.assertIn('attempt 2', job['last_error'])
+        self.assertFalse(jobs.run_next())
+        self.assertEqual(self.calls, 2)
+        self.logger.error.assert_called_once()
+
+
+class AthleteMixin(JobQueueMixin):
+    """Athletes who log activities and join teams through the API"""
+
+    def athlete(self, username):
+        user = User.objects.create_user(username, password='octofit')
+        UserProfile.objects.create(_id=ObjectId(), user=user)
+        return user
+
+    def team(self, name):
+        return Team.objects.create(_id=ObjectId(), name=name)
+
+    def post(self, user, url, data=None, status=200, **extra):
+        self.client.force_login(user)
+        response = self.client.post(url, data, **extra)
+        self.assertEqual(response.status_code, status, response.content)
+        return response
+
+    def log(self, user, duration, activity_type='running', days_ago=0, calories=None):
+        activity = {
+            'activity_type': activity_type,
+            'duration': duration,
+            'date': (timezone.now() - timedelta(days=days_ago)).isoformat(),
+        }
+        if calories is not None:
+            activity['calories'] = calories
+        self.post(user, '/api/activities/', activity, status=201)
+        return Activity.calculate_points(activity_type, duration)
+
+    def join(self, user, team):
+        self.post(user, f'/api/teams/{team.pk}/join/')
+
+    def leave(self, user, team):
+        self.post(user, f'/api/teams/{team.pk}/leave/')
+
+    def profile(self, user):
+        return UserProfile.objects.get(user=user)
+
+
+class LeaderboardTests(AthleteMixin, TransactionTestCase):
+    """The user leaderboard is served from the stats kept on each profile"""
+
+    def test_ranks_by_profile_stats(self):
+        ada, bob = self.athlete('ada'), self.athlete('bob')
+        harriers = self.team('Harriers')
+        self.join(ada, harriers)
+        ada_points = self.log(ada, 60, calories=400) + self.log(ada, 30, calories=200)
+        bob_points = self.log(bob, 20, 'swimming', calories=150)
+        jobs.drain()
+
+        rows = self.client.get('/api/leaderboard/').json()
+        self.assertEqual(
+            [(row['username'], row['rank'], row['total_points'], row['activity_count'], row['total_calories'],
+              row['team_name']) for row in rows],
+            [('ada', 1, ada_points, 2, 600, 'Harriers'), ('bob', 2, bob_points, 1, 150, None)],
+        )
+
+    def test_incremental_stats_match_a_refresh(self):
+        ada = self.athlete('ada')
+        self.join(ada, self.team('Harriers'))
+        self.log(ada, 60, calories=400)
+        self.log(ada, 45, 'cycling', calories=300)
+        jobs.drain()
+        kept = self.profile(ada)
+        refreshed = self.profile(ada)
+        refreshed.refresh_stats()
+        self.assertEqual(
+            (kept.total_points, kept.activity_count, kept.total_calories, kept.primary_team_id),
+            (refreshed.total_points, refreshed.activity_count, refreshed.total_calories, refreshed.primary_team_id),
+        )
+
+    def test_primary_team_is_the_oldest_team(self):
+        ada = self.athlete('ada')
+        older, newer = self.team('Harriers'), self.team('Striders')
+        self.join(ada, newer)
+        self.assertEqual(self.profile(ada).primary_team_id, newer.pk)
+        self.join(ada, older)
+        self.assertEqual(self.profile(ada).primary_team_id, older.pk)
+        self.leave(ada, older)
+        self.assertEqual(self.profile(ada).primary_team_id, newer.pk)
+
+
+class TeamPointsTests(AthleteMixin, TransactionTestCase):
+    """Team totals move by each change instead of being re-summed"""
+
+    def assertMatchesRecompute(self, team):
+        team.refresh_from_db()
+        kept = team.total_points
+        team.update_points()
+        self.assertEqual(kept, team.total_points)
+        return kept
+
+    def test_activity_changes_move_every_team(self):
+        ada, bob = self.athlete('ada'), self.athlete('bob')
+        harriers, striders = self.team('Harriers'), self.team('Striders')
+        for team in (harriers, striders):
+            self.join(ada, team)
+        self.join(bob, harriers)
+        ada_points = self.log(ada, 60)
+        bob_points = self.log(bob, 40)
+        jobs.drain()
+        self.assertEqual(self.assertMatchesRecompute(harriers), ada_points + bob_points)
+        self.assertEqual(self.assertMatchesRecompute(striders), ada_points)
+
+        activity = Activity.objects.get(user=ada)
+        self.client.force_login(ada)
+        response = self.client.patch(
+            f'/api/activities/{activity.pk}/', {'duration': 90}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        jobs.drain()
+        ada_points = Activity.calculate_points('running', 90)
+        self.assertEqual(self.assertMatchesRecompute(striders), ada_points)
+
+        self.assertEqual(self.client.delete(f'/api/activities/{activity.pk}/').status_code, 204)
+        jobs.drain()
+        self.assertEqual(self.assertMatchesRecompute(harriers), bob_points)
+        self.assertEqual(self.assertMatchesRecompute(striders), 0)
+
+    def test_membership_moves_the_members_points(self):
+        ada, bob = self.athlete('ada'), self.athlete('bob')
+        harriers = self.team('Harriers')
+        self.join(bob, harriers)
+        points = self.log(ada, 60)
+        jobs.drain()
+        self.join(ada, harriers)
+        self.assertEqual(self.assertMatchesRecompute(harriers), points)
+        self.assertEqual(harriers.member_count, 2)
+        self.leave(ada, harriers)
+        self.assertEqual(self.assertMatchesRecompute(harriers), 0)
+        self.assertEqual(harriers.member_count, 1)
+
+
+class ProfileCounterTests(AthleteMixin, TransactionTestCase):
+    """Counter increments are atomic and survive concurrent edits"""
+
+    def test_edits_keep_counters_incremented_meanwhile(self):
+        ada = self.athlete('ada')
+        harriers = self.team('Harriers')
+        self.join(ada, harriers)
+        profile, team = self.profile(ada), Team.objects.get(pk=harriers.pk)
+        points = self.log(ada, 60, calories=400)
+        jobs.drain()
+
+        for serializer in (
+            UserProfileSerializer(profile, data={'age': 31}, partial=True),
+            TeamSerializer(team, data={'description': 'Early risers'}, partial=True),
+        ):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            serializer.save()
+        profile = self.profile(ada)
+        self.assertEqual((profile.age, profile.total_points, profile.activity_count), (31, points, 1))
+        team.refresh_from_db()
+        self.assertEqual((team.description, team.total_points), ('Early risers', points))
+
+    def test_increment_creates_a_missing_profile(self):
+        ada = User.objects.create_user('ada', password='octofit')
+        points = self.log(ada, 60, calories=400)
+        points += self.log(ada, 30, calories=200)
+        jobs.drain()
+        profile = self.profile(ada)
+        self.assertEqual((profile.total_points, profile.activity_count, profile.total_calories), (points, 2, 600))
+
+
+class BulkImportTests(AthleteMixin, TransactionTestCase):
+    """Bulk imports insert every activity and queue one job for the batch"""
+
+    def setUp(self):
+        super().setUp()
+        self.ada = self.athlete('ada')
+        today = timezone.now().isoformat()
+        self.activities = [
+            {'activity_type': 'running', 'duration': 60, 'calories': 400, 'date': today},
+            {'activity_type': 'cycling', 'duration': 45, 'calories': 300, 'date': today},
+            {'activity_type': 'yoga', 'duration': 30, 'date': today},
+        ]
+        self.points = sum(
+            Activity.calculate_points(activity['activity_type'], activity['duration']) for activity in self.activities
+        )
+
+    def bulk(self, body, content_type='application/json', status=201):
+        return self.post(self.ada, '/api/activities/bulk/', body, status=status, content_type=content_type)
+
+    def assertImported(self, response):
+        self.assertEqual(response.json()['created'], 3)
+        self.assertEqual(response.json()['points_earned'], self.points)
+        self.assertEqual(Activity.objects.filter(user=self.ada).count(), 3)
+        self.assertEqual(len(self.queued()), 1)
+        jobs.drain()
+        profile = self.profile(self.ada)
+        self.assertEqual((profile.total_points, profile.activity_count, profile.total_calories), (self.points, 3, 700))
+
+    def test_json_array(self):
+        self.assertImported(self.bulk(json.dumps(self.activities)))
+
+    def test_ndjson(self):
+        body = '\n'.join(json.dumps(activity) for activity in self.activities)
+        self.assertImported(self.bulk(body, content_type='application/x-ndjson'))
+
+    def test_invalid_batch_inserts_nothing(self):
+        self.activities[1]['duration'] = 'long'
+        self.bulk(json.dumps(self.activities), status=400)
+        self.assertEqual(Activity.objects.count(), 0)
+        self.assertEqual(self.queued(), [])
+
+    def test_batch_size_is_capped(self):
+        with mock.patch.object(ActivityViewSet, 'bulk_max_size', 2):
+            self.bulk(json.dumps(self.activities), status=400)
+        self.assertEqual(Activity.objects.count(), 0)
+
+
+class RollupTests(AthleteMixin, TransactionTestCase):
+    """Activity writes keep the day, week and month buckets of users and teams"""
+
+    def buckets(self):
+        """Non-empty buckets by owner, granularity, period and type"""
+        rows = ActivityRollup.objects.filter(count__gt=0).values(
+            'user_id', 'team_id', 'granularity', 'period_start', 'activity_type', *rollups.TOTALS
+        )
+        return {
+            (row.pop('user_id'), row.pop('team_id'), row.pop('granularity'), row.pop('period_start'),
+             row.pop('activity_type')): {**row, 'distance': round(row['distance'], 2)}
+            for row in rows
+        }
+
+    def test_trends_by_day(self):
+        ada = self.athlete('ada')
+        running = self.log(ada, 60, calories=400)
+        cycling = self.log(ada, 30, 'cycling', days_ago=2, calories=200)
+        jobs.drain()
+        response = self.client.get('/api/activities/trends/', {'granularity': 'day'})
+        self.assertEqual(response.status_code, 200, response.content)
+        periods = response.json()['results']
+        self.assertEqual(
+            [(period['count'], period['points'], period['calories'], list(period['by_type'])) for period in periods],
+            [(1, cycling, 200, ['cycling']), (1, running, 400, ['running'])],
+        )
+
+    def test_team_buckets_follow_membership(self):
+        ada, bob = self.athlete('ada'), self.athlete('bob')
+        harriers = self.team('Harriers')
+        self.join(bob, harriers)
+        ada_points = self.log(ada, 60)
+        bob_points = self.log(bob, 40)
+        jobs.drain()
+
+        def team_points():
+            self.client.force_login(ada)
+            response = self.client.get('/api/activities/trends/', {'granularity': 'month', 'team': str(harriers.pk)})
+            return sum(period['points'] for period in response.json()['results'])
+
+        self.assertEqual(team_points(), bob_points)
+        self.join(ada, harriers)
+        self.assertEqual(team_points(), ada_points + bob_points)
+        self.leave(ada, harriers)
+        self.assertEqual(team_points(), bob_points)
+
+    def test_incremental_buckets_match_a_rebuild(self):
+        ada, bob = self.athlete('ada'), self.athlete('bob')
+        harriers = self.team('Harriers')
+        self.join(ada, harriers)
+        self.join(bob, harriers)
+        self.log(ada, 60, calories=400)
+        self.log(ada, 45, 'cycling', days_ago=9, calories=300)
+        self.log(bob, 30, days_ago=40)
+        self.log(bob, 20, 'swimming', days_ago=40)
+        jobs.drain()
+        self.client.force_login(bob)
+        swim = Activity.objects.get(user=bob, activity_type='swimming')
+        self.assertEqual(self.client.delete(f'/api/activities/{swim.pk}/').status_code, 204)
+        jobs.drain()
+
+        kept = self.buckets()
+        self.assertTrue(kept)
+        rollups.rebuild()
+        self.assertEqual(kept, self.buckets())
+
+
+class WindowLeaderboardTests(AthleteMixin, TransactionTestCase):
+    """Windowed leaderboards count only the activities inside the window"""
+
+    def ranking(self, window, **params):
+        response = self.client.get('/api/leaderboard/', {'window': window, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(row['username'], row['total_points']) for row in response.json()]
+
+    def test_windows_count_recent_activities(self):
+        ada, bob = self.athlete('ada'), self.athlete('bob')
+        ada_points = self.log(ada, 30)
+        bob_points = self.log(bob, 60, days_ago=10)
+        jobs.drain()
+        self.assertEqual(self.ranking('7d'), [('ada', ada_points)])
+        self.assertEqual(self.ranking('30d'), [('bob', bob_points), ('ada', ada_points)])
+
+        self.client.force_login(ada)
+        response = self.client.get('/api/leaderboard/me/', {'window': '30d'})
+        self.assertEqual(response.json()['rank'], 2)
+
+    def test_limits_below_one_are_empty(self):
+        self.log(self.athlete('ada'), 30)
+        jobs.drain()
+        for window in ('7d', '30d', 'season'):
+            for limit in (0, -1):
+                self.assertEqual(self.ranking(window, limit=limit), [])
+
+    def test_days_sliding_out_are_subtracted(self):
+        ada, bob = self.athlete('ada'), self.athlete('bob')
+        self.assertEqual(self.ranking('7d'), [])
+        # The window was last advanced three days ago, while an eight day
+        # old activity was still inside it
+        state = LeaderboardWindow.objects.get(window='7d')
+        LeaderboardWindow.objects.mongo_update_one(
+            {'window': '7d'}, {'$set': {'as_of': state.as_of - timedelta(days=3)}}
+        )
+        ada_points = self.log(ada, 30)
+        bob_points = self.log(bob, 60, days_ago=8)
+        jobs.drain()
+        self.assertEqual(WindowScore.objects.get(window='7d', user=bob).points, bob_points)
+
+        self.assertEqual(self.ranking('7d'), [('ada', ada_points)])
+        self.assertFalse(WindowScore.objects.filter(window='7d', user=bob).exists())
+
+
+class ChallengeProgressTests(AthleteMixin, TransactionTestCase):
+    """Challenge progress follows activity writes and rewards a completion once"""
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.ada = self.athlete('ada')
+        self.harriers = self.team('Harriers')
+        self.join(self.ada, self.harriers)
+        self.challenge = Challenge.objects.create(
+            _id=ObjectId(),
+            title='Run 100 minutes',
+            description='Log 100 minutes of running',
+            challenge_type='duration',
+            target_value=100,
+            activity_types=['running'],
+            start_date=now - timedelta(days=3),
+            end_date=now + timedelta(days=7),
+            points_reward=25,
+        )
+
+    def progress(self):
+        self.client.force_login(self.ada)
+        response = self.client.get(f'/api/challenges/{self.challenge.pk}/progress/')
+        self.assertEqual(response.status_code, 200, response.content)
+        progress = response.json()
+        return progress['value'], progress['completed'], progress['points_awarded']
+
+    def points(self):
+        return self.profile(self.ada).total_points, Team.objects.get(pk=self.harriers.pk).total_points
+
+    def test_joining_counts_earlier_matching_activities(self):
+        self.log(self.ada, 40)
+        self.log(self.ada, 30, days_ago=1)
+        self.log(self.ada, 90, 'cycling')
+        self.log(self.ada, 50, days_ago=5)
+        jobs.drain()
+        self.post(self.ada, f'/api/challenges/{self.challenge.pk}/join/')
+        self.assertEqual(self.progress(), (70, False, 0))
+
+    def test_completion_is_rewarded_once(self):
+        self.post(self.ada, f'/api/challenges/{self.challenge.pk}/join/')
+        points = self.log(self.ada, 60)
+        jobs.drain()
+        self.assertEqual(self.progress(), (60, False, 0))
+
+        points += self.log(self.ada, 50)
+        jobs.drain()
+        self.assertEqual(self.progress(), (110, True, 25))
+        self.assertEqual(self.points(), (points + 25, points + 25))
+
+        points += self.log(self.ada, 30)
+        jobs.drain()
+        self.post(self.ada, f'/api/challenges/{self.challenge.pk}/leave/')
+        self.post(self.ada, f'/api/challenges/{self.challenge.pk}/join/')
+        self.assertEqual(self.progress(), (140, True, 25))
+        self.assertEqual(self.points(), (points + 25, points + 25))
+
+    def edit(self, **fields):
+        self.client.force_login(self.ada)
+        response = self.client.patch(
+            f'/api/challenges/{self.challenge.pk}/', json.dumps(fields), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_editing_the_definition_rebuilds_progress(self):
+        self.post(self.ada, f'/api/challenges/{self.challenge.pk}/join/')
+        points = self.log(self.ada, 60)
+        points += self.log(self.ada, 30, 'cycling')
+        jobs.drain()
+        self.assertEqual(self.progress(), (60, False, 0))
+
+        self.edit(activity_types=['running', 'cycling'])
+        self.assertEqual(self.progress(), (90, False, 0))
+        self.edit(target_value=80)
+        self.assertEqual(self.progress(), (90, True, 25))
+        self.assertEqual(self.points(), (points + 25, points + 25))
+
+        # Completions stay final when the challenge gets harder
+        self.edit(target_value=200, activity_types=['running'])
+        self.assertEqual(self.progress(), (60, True, 25))
+        self.assertEqual(self.points(), (points + 25, points + 25))
+
+    def test_editing_the_description_keeps_progress(self):
+        self.post(self.ada, f'/api/challenges/{self.challenge.pk}/join/')
+        with mock.patch.object(challenges, 'participant_joined') as rebuild:
+            self.edit(description='Log 100 minutes of running this week')
+        rebuild.assert_not_called()
+
+
+class PopulateDbTests(TransactionTestCase):
+    """Seeded data is reproducible and replaces everything from earlier runs"""
+
+    def populate(self, **options):
+        call_command('populate_db', users=4, activities_per_user=3, teams=2, stdout=io.StringIO(), **options)
+        return sorted(
+            Activity.objects.values_list('user__username', 'activity_type', 'duration', 'calories', 'date')
+        )
+
+    def test_seed_and_anchor_date_reproduce_the_data(self):
+        first = self.populate(seed=7, anchor_date=date(2026, 1, 15))
+        later = timezone.now() + timedelta(days=3)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            second = self.populate(seed=7, anchor_date=date(2026, 1, 15))
+        self.assertEqual(first, second)
+        anchor = datetime(2026, 1, 15, tzinfo=dt_timezone.utc)
+        self.assertTrue(all(anchor - timedelta(days=30) <= activity[-1] <= anchor for activity in first))
+
+    def test_reseeding_removes_challenges(self):
+        self.populate(seed=7)
+        user = User.objects.first()
+        challenge = Challenge.objects.create(
+            _id=ObjectId(),
+            title='Stale challenge',
+            description='From an earlier seed',
+            challenge_type='frequency',
+            target_value=1,
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1),
+        )
+        challenge.participants.add(user)
+        challenges.participant_joined(challenge, user.pk)
+        self.populate(seed=7)
+        self.assertFalse(Challenge.objects.exists())
+        self.assertFalse(ChallengeProgress.objects.exists())
@@ -17,10 +17,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
 from rest_framework.routers import DefaultRouter
+from octofit_tracker import async_views
 from octofit_tracker.views import (
     api_root, UserViewSet, UserProfileViewSet, ActivityViewSet,
     TeamViewSet, ChallengeViewSet, WorkoutSuggestionViewSet,
-    leaderboard, team_leaderboard
+    leaderboard, leaderboard_me, leaderboard_around, team_leaderboard, health, prometheus_metrics
 )
 import os
 
@@ -46,6 +47,14 @@ urlpatterns = [
     path('api/', api_root, name='api-root'),
     path('api/', include(router.urls)),
     path('api/leaderboard/', leaderboard, name='leaderboard'),
+    path('api/leaderboard/me/', leaderboard_me, name='leaderboard-me'),
+    path('api/leaderboard/around/<int:user_id>/', leaderboard_around, name='leaderboard-around'),
     path('api/team-leaderboard/', team_leaderboard, name='team-leaderboard'),
+    path('api/async/leaderboard/', async_views.leaderboard, name='async-leaderboard'),
+    path('api/async/team-leaderboard/', async_views.team_leaderboard, name='async-team-leaderboard'),
+    path('api/async/activities/', async_views.activity_list, name='async-activity-list'),
+    path('api/async/activities/summary/', async_views.activity_summary, name='async-activity-summary'),
+    path('api/health/', health, name='health'),
+    path('metrics', prometheus_metrics, name='metrics'),
 ]
 
@@ -1,17 +1,42 @@
+import csv
+import json
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotAuthenticated, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Count, Sum, Q
+from django.db.models import Count, Prefetch
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
 from django.utils import timezone
-from .models import UserProfile, Activity, Team, Challenge, WorkoutSuggestion
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time
+from .models import UserProfile, Activity, ActivityRollup, Team, Challenge, WorkoutSuggestion
+from . import (
+    challenges, leaderboard_windows, leaderboards, metrics, mongo, repository, rollups, scoring, workouts
+)
+from .parsers import NDJSONParser
+from .renderers import CSVRenderer, NDJSONRenderer
 from .serializers import (
-    UserSerializer, UserProfileSerializer, ActivitySerializer, 
+    SparseFieldsetMixin, UserSerializer, UserProfileSerializer, ActivitySerializer, 
     ActivityCreateSerializer, TeamSerializer, TeamCreateSerializer,
-    ChallengeSerializer, WorkoutSuggestionSerializer, LeaderboardSerializer
+    TeamListSerializer, ChallengeSerializer, ChallengeProgressSerializer,
+    WorkoutSuggestionSerializer, LeaderboardSerializer
 )
 
+# Neighbours shown on each side of a user's leaderboard position
+LEADERBOARD_RADIUS = 5
+MAX_LEADERBOARD_RADIUS = 50
+
+# MongoClient options reported by the health endpoint
+POOL_OPTIONS = ('maxPoolSize', 'minPoolSize', 'maxIdleTimeMS', 'waitQueueTimeoutMS', 'compressors')
+
 
 @api_view(['GET'])
 def api_root(request):
@@ -37,24 +62,126 @@ def api_root(request):
     })
 
 
+def parse_date_param(request, name):
+    """Parse an optional ISO date or datetime query parameter into an aware datetime"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            parsed = datetime.combine(date, time.min) if date else None
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Enter a valid date or datetime.'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class EchoBuffer:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+def _with_header(header, rows):
+    yield header
+    yield from rows
+
+
+def _export_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _has_member(members, user):
+    """Check membership with one indexed lookup
+
+    djongo cannot decode the ``SELECT 1 AS a`` that ``exists()`` issues once
+    a row matches, so the primary key is fetched instead.
+    """
+    return members.filter(pk=user.pk).values_list('pk', flat=True).first() is not None
+
+
+class ObjectIdLookupMixin:
+    """Convert the URL lookup value to an ObjectId for models keyed by ``_id``"""
+
+    def get_object(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            self.kwargs[lookup_url_kwarg] = ObjectId(self.kwargs[lookup_url_kwarg])
+        except (InvalidId, TypeError):
+            raise Http404
+        return super().get_object()
+
+
+class SparseFieldsetViewMixin:
+    """Load only what a ``?fields=`` / ``?omit=`` response serializes
+
+    ``requested_fields`` is the sparse fieldset of the view's serializer
+    (see ``SparseFieldsetMixin``), ``wants`` tells whether to join,
+    prefetch or annotate for a field, and ``model_fields`` are the columns
+    to read: those the fields are built from, plus the primary key and the
+    ordering fields the pagination cursors need.
+    """
+
+    def requested_fields(self):
+        if not hasattr(self, '_requested_fields'):
+            serializer_class = self.get_serializer_class()
+            self._requested_fields = None
+            if issubclass(serializer_class, SparseFieldsetMixin):
+                self._requested_fields = serializer_class.requested_fields(self.request)
+        return self._requested_fields
+
+    def wants(self, name):
+        fields = self.requested_fields()
+        return fields is None or name in fields
+
+    def model_fields(self, model):
+        """Names of the concrete fields of ``model`` to read, or None for all"""
+        fields = self.requested_fields()
+        if fields is None:
+            return None
+        needed = self.get_serializer_class().model_fields(fields)
+        needed.update(name.lstrip('-') for name in self.ordering)
+        needed.add(model._meta.pk.name)
+        return [field.name for field in model._meta.concrete_fields if field.name in needed]
+
+    def only_requested(self, queryset):
+        fields = self.model_fields(queryset.model)
+        return queryset if fields is None else queryset.only(*fields)
+
+
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for viewing users"""
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
+    ordering = ('id',)
 
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(SparseFieldsetViewMixin, ObjectIdLookupMixin, viewsets.ModelViewSet):
     """ViewSet for user profiles"""
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
     permission_classes = [IsAuthenticated]
+    ordering = ('-total_points', '_id')
 
     def get_queryset(self):
         """Filter profiles based on user permissions"""
+        queryset = self.only_requested(UserProfile.objects.all())
+        if self.wants('user'):
+            queryset = queryset.select_related('user')
         if self.request.user.is_staff:
-            return UserProfile.objects.all()
-        return UserProfile.objects.filter(user=self.request.user)
+            return queryset
+        return queryset.filter(user=self.request.user)
 
     @action(detail=False, methods=['get'])
     def me(self, request):
@@ -74,37 +201,86 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(SparseFieldsetViewMixin, ObjectIdLookupMixin, viewsets.ModelViewSet):
     """ViewSet for activities"""
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
     permission_classes = [AllowAny]
+    ordering = ('-date', '_id')
+    bulk_max_size = 1000
+    export_chunk_size = 2000
+    export_fields = [
+        ('_id', '_id'),
+        ('user', 'user_id'),
+        ('user_name', 'user__username'),
+        ('activity_type', 'activity_type'),
+        ('duration', 'duration'),
+        ('distance', 'distance'),
+        ('calories', 'calories'),
+        ('points_earned', 'points_earned'),
+        ('notes', 'notes'),
+        ('date', 'date'),
+        ('created_at', 'created_at'),
+    ]
 
     def get_queryset(self):
-        """Filter activities based on user"""
-        queryset = Activity.objects.all()
+        """Filter activities based on user or team"""
+        queryset = self.only_requested(Activity.objects.filter(**self.filter_lookups()))
+        if self.wants('user_name'):
+            queryset = queryset.select_related('user')
+        return queryset
+
+    def filter_lookups(self):
+        """Field lookups for the list filters, shared by the ORM and pymongo reads"""
+        lookups = {}
         
-        # Filter by user
+        # Filter by user, or by every member of a team
         user_id = self.request.query_params.get('user', None)
+        team_id = self.request.query_params.get('team', None)
         if user_id:
-            queryset = queryset.filter(user_id=user_id)
+            try:
+                lookups['user_id'] = int(user_id)
+            except ValueError:
+                raise ValidationError({'user': 'Enter a whole number.'})
+        elif team_id:
+            try:
+                team_id = ObjectId(team_id)
+            except InvalidId:
+                raise ValidationError({'team': 'Enter a valid team id.'})
+            memberships = repository.find(
+                Team.members.through, repository.match(Team.members.through, team_id=team_id), fields=['user_id']
+            )
+            lookups['user_id__in'] = [membership.user_id for membership in memberships]
         elif self.request.user.is_authenticated and not self.request.user.is_staff:
-            queryset = queryset.filter(user=self.request.user)
+            lookups['user_id'] = self.request.user.pk
         
         # Filter by activity type
         activity_type = self.request.query_params.get('type', None)
         if activity_type:
-            queryset = queryset.filter(activity_type=activity_type)
+            lookups['activity_type'] = activity_type
         
         # Filter by date range
-        start_date = self.request.query_params.get('start_date', None)
-        end_date = self.request.query_params.get('end_date', None)
+        start_date = parse_date_param(self.request, 'start_date')
+        end_date = parse_date_param(self.request, 'end_date')
         if start_date:
-            queryset = queryset.filter(date__gte=start_date)
+            lookups['date__gte'] = start_date
         if end_date:
-            queryset = queryset.filter(date__lte=end_date)
+            lookups['date__lte'] = end_date
         
-        return queryset
+        return lookups
+
+    def list(self, request, *args, **kwargs):
+        """List activities with native pymongo reads, see ``repository``"""
+        return self.activity_page(repository.match(Activity, **self.filter_lookups()))
+
+    def activity_page(self, query):
+        activities = self.paginator.paginate_find(
+            Activity, query, self.request, view=self, fields=self.model_fields(Activity)
+        )
+        if self.wants('user_name'):
+            repository.attach(activities, 'user', fields=['username'])
+        serializer = self.get_serializer(activities, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def get_serializer_class(self):
         """Use different serializers for create vs read"""
@@ -113,82 +289,231 @@ class ActivityViewSet(viewsets.ModelViewSet):
         return ActivitySerializer
 
     def perform_create(self, serializer):
-        """Create activity and update user profile points"""
+        """Create activity and queue the update of user profile points"""
         activity = serializer.save(user=self.request.user)
         
-        # Update user profile total points
-        profile, created = UserProfile.objects.get_or_create(user=self.request.user)
-        profile.total_points += activity.points_earned
-        profile.save()
+        # Profile stats, team totals and the other derived state are updated
+        # by a background job, so the request only pays for the inserts
+        scoring.activity_created(activity)
+
+    def perform_update(self, serializer):
+        """Update activity and adjust the owner's stats and team totals"""
+        previous = scoring.snapshot(serializer.instance)
+        activity = serializer.save()
+        scoring.activity_updated(activity, previous)
+
+    def perform_destroy(self, instance):
+        """Delete activity and remove it from the owner's stats and team totals"""
+        previous = scoring.snapshot(instance)
+        instance.delete()
+        scoring.activity_deleted(previous)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated],
+            parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """Create many activities at once from a JSON array or NDJSON body"""
+        if not isinstance(request.data, list):
+            return Response(
+                {'message': 'Expected a list of activities'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(request.data) > self.bulk_max_size:
+            return Response(
+                {'message': f'At most {self.bulk_max_size} activities can be imported per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = ActivityCreateSerializer(data=request.data, many=True, context=self.get_serializer_context())
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        # bulk_create skips Activity.save(), so points are computed here; ids
+        # are assigned client-side because djongo cannot return them
+        activities = [
+            Activity(
+                _id=ObjectId(),
+                user=request.user,
+                points_earned=Activity.calculate_points(item['activity_type'], item['duration']),
+                **item
+            )
+            for item in serializer.validated_data
+        ]
+        Activity.objects.bulk_create(activities)
+        
+        # One queued job updates the stats for the whole batch
+        scoring.activities_created(activities)
+        
+        return Response({
+            'created': len(activities),
+            'points_earned': sum(activity.points_earned for activity in activities),
+            'ids': [str(activity.pk) for activity in activities]
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """Stream the filtered activity history as CSV (default) or NDJSON"""
+        names = [name for name, column in self.export_fields]
+        columns = [column for name, column in self.export_fields]
+        # values_list + iterator reads the Mongo cursor in chunks without
+        # building model instances, so memory stays flat for any row count
+        rows = self.get_queryset().values_list(*columns).iterator(chunk_size=self.export_chunk_size)
+        rows = ([_export_value(value) for value in row] for row in rows)
+        
+        if request.accepted_renderer.format == 'ndjson':
+            content = (json.dumps(dict(zip(names, row))) + '\n' for row in rows)
+            filename = 'activities.ndjson'
+        else:
+            writer = csv.writer(EchoBuffer())
+            content = (writer.writerow(row) for row in _with_header(names, rows))
+            filename = 'activities.csv'
         
-        # Update team points if user is in a team
-        for team in self.request.user.teams.all():
-            team.update_points()
+        response = StreamingHttpResponse(content, content_type=request.accepted_media_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
     @action(detail=False, methods=['get'])
     def my_activities(self, request):
         """Get current user's activities"""
-        activities = Activity.objects.filter(user=request.user)
-        serializer = self.get_serializer(activities, many=True)
-        return Response(serializer.data)
+        return self.activity_page(repository.match(Activity, user_id=request.user.pk))
 
     @action(detail=False, methods=['get'])
     def summary(self, request):
-        """Get activity summary for current user"""
-        activities = Activity.objects.filter(user=request.user)
+        """Get activity summary for current user, optionally within start_date/end_date"""
+        match = {'user_id': request.user.id}
+        start_date = parse_date_param(request, 'start_date')
+        end_date = parse_date_param(request, 'end_date')
+        if start_date or end_date:
+            match['date'] = {}
+            if start_date:
+                match['date']['$gte'] = start_date
+            if end_date:
+                match['date']['$lte'] = end_date
+        
+        # One grouped scan yields both the per-type breakdown and the totals
+        groups = mongo.read_only(Activity).aggregate([
+            {'$match': match},
+            {'$group': {
+                '_id': '$activity_type',
+                'count': {'$sum': 1},
+                'duration': {'$sum': '$duration'},
+                'distance': {'$sum': '$distance'},
+                'points': {'$sum': '$points_earned'},
+            }},
+            {'$sort': {'_id': 1}},
+        ])
+        
+        summary = {
+            'total_activities': 0,
+            'total_duration': 0,
+            'total_distance': 0,
+            'total_points': 0,
+            'activity_breakdown': {}
+        }
+        for group in groups:
+            summary['total_activities'] += group['count']
+            summary['total_duration'] += group['duration']
+            summary['total_distance'] += group['distance']
+            summary['total_points'] += group['points']
+            summary['activity_breakdown'][group['_id']] = group['count']
+        
+        return Response(summary)
+
+    @action(detail=False, methods=['get'])
+    def trends(self, request):
+        """Get activity totals per day, week or month from the rollup buckets
         
-        total_activities = activities.count()
-        total_duration = activities.aggregate(Sum('duration'))['duration__sum'] or 0
-        total_distance = activities.aggregate(Sum('distance'))['distance__sum'] or 0
-        total_points = activities.aggregate(Sum('points_earned'))['points_earned__sum'] or 0
+        Defaults to the current user; ``user`` or ``team`` select another
+        owner, and ``start_date``/``end_date`` or ``type`` narrow the series.
+        """
+        granularity = request.query_params.get('granularity', 'week')
+        if granularity not in rollups.GRANULARITIES:
+            raise ValidationError({'granularity': f'Choose one of: {", ".join(rollups.GRANULARITIES)}.'})
         
-        activity_breakdown = {}
-        for activity_type in ['running', 'walking', 'cycling', 'swimming', 'strength_training', 'yoga', 'sports']:
-            count = activities.filter(activity_type=activity_type).count()
-            if count > 0:
-                activity_breakdown[activity_type] = count
+        user_id = request.query_params.get('user', None)
+        team_id = request.query_params.get('team', None)
+        if team_id:
+            try:
+                queryset = ActivityRollup.objects.filter(team_id=ObjectId(team_id))
+            except InvalidId:
+                raise ValidationError({'team': 'Enter a valid team id.'})
+        elif user_id:
+            queryset = ActivityRollup.objects.filter(user_id=user_id)
+        elif request.user.is_authenticated:
+            queryset = ActivityRollup.objects.filter(user_id=request.user.id)
+        else:
+            raise NotAuthenticated
         
+        start_date = parse_date_param(request, 'start_date') or rollups.default_start(granularity, timezone.now())
+        end_date = parse_date_param(request, 'end_date')
+        queryset = queryset.filter(granularity=granularity, period_start__gte=start_date, count__gt=0)
+        if end_date:
+            queryset = queryset.filter(period_start__lte=end_date)
+        activity_type = request.query_params.get('type', None)
+        if activity_type:
+            queryset = queryset.filter(activity_type=activity_type)
+        
+        rows = queryset.values('period_start', 'activity_type', *rollups.TOTALS)
         return Response({
-            'total_activities': total_activities,
-            'total_duration': total_duration,
-            'total_distance': total_distance,
-            'total_points': total_points,
-            'activity_breakdown': activity_breakdown
+            'granularity': granularity,
+            'results': rollups.series(rows)
         })
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(SparseFieldsetViewMixin, ObjectIdLookupMixin, viewsets.ModelViewSet):
     """ViewSet for teams"""
     queryset = Team.objects.all().prefetch_related('members', 'coach')
     serializer_class = TeamSerializer
     permission_classes = [AllowAny]
+    ordering = ('-total_points', '_id')
 
     def get_queryset(self):
-        """Optimize queryset with prefetch_related"""
-        return Team.objects.all().prefetch_related('members', 'coach')
+        """Prefetch coach and members in a constant number of queries"""
+        queryset = self.only_requested(Team.objects.all())
+        if self.wants('coach_name'):
+            queryset = queryset.prefetch_related('coach')
+        if self.action in ('list', 'my_teams'):
+            # List pages only expose member ids
+            if self.wants('member_ids'):
+                queryset = queryset.prefetch_related(Prefetch('members', queryset=User.objects.only('id')))
+            return queryset
+        if self.wants('members'):
+            queryset = queryset.prefetch_related('members')
+        return queryset
 
     def get_serializer_class(self):
-        """Use different serializers for create vs read"""
+        """Use different serializers for create, list and detail"""
         if self.action == 'create':
             return TeamCreateSerializer
+        if self.action in ('list', 'my_teams'):
+            return TeamListSerializer
         return TeamSerializer
 
+    def perform_update(self, serializer):
+        """Update team and refresh the cached team leaderboard"""
+        serializer.save()
+        leaderboards.invalidate_team_leaderboard()
+
+    def perform_destroy(self, instance):
+        """Delete team and refresh the cached team leaderboard"""
+        instance.delete()
+        leaderboards.invalidate_team_leaderboard()
+
     @action(detail=True, methods=['post'])
     def join(self, request, pk=None):
         """Join a team"""
         team = self.get_object()
         user = request.user
         
-        if user in team.members.all():
+        if _has_member(team.members, user):
             return Response(
                 {'message': 'You are already a member of this team'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         team.members.add(user)
-        team.update_points()
+        scoring.member_joined(team, user)
         
-        serializer = self.get_serializer(team)
+        serializer = self.get_serializer(self.get_object())
         return Response(serializer.data)
 
     @action(detail=True, methods=['post'])
@@ -197,7 +522,7 @@ class TeamViewSet(viewsets.ModelViewSet):
         team = self.get_object()
         user = request.user
         
-        if user not in team.members.all():
+        if not _has_member(team.members, user):
             return Response(
                 {'message': 'You are not a member of this team'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -210,51 +535,83 @@ class TeamViewSet(viewsets.ModelViewSet):
             )
         
         team.members.remove(user)
-        team.update_points()
+        scoring.member_left(team, user)
         
         return Response({'message': 'Successfully left the team'})
 
     @action(detail=False, methods=['get'])
     def my_teams(self, request):
         """Get teams the current user is a member of"""
-        teams = Team.objects.filter(members=request.user).prefetch_related('members', 'coach')
+        team_ids = Team.members.through.objects.filter(user=request.user).values_list('team_id', flat=True)
+        teams = self.paginate_queryset(self.get_queryset().filter(pk__in=list(team_ids)))
         serializer = self.get_serializer(teams, many=True)
-        return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
 
-class ChallengeViewSet(viewsets.ModelViewSet):
+class ChallengeViewSet(SparseFieldsetViewMixin, ObjectIdLookupMixin, viewsets.ModelViewSet):
     """ViewSet for challenges"""
     queryset = Challenge.objects.all()
     serializer_class = ChallengeSerializer
     permission_classes = [IsAuthenticated]
+    ordering = ('-start_date', '_id')
+
+    def initial(self, request, *args, **kwargs):
+        # Filtering and every serialized status use the same instant
+        self.now = timezone.now()
+        super().initial(request, *args, **kwargs)
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'now': self.now}
 
     def get_queryset(self):
         """Filter challenges based on status"""
-        queryset = Challenge.objects.all()
+        queryset = self.only_requested(Challenge.objects.all())
+        if self.wants('participant_count'):
+            queryset = queryset.annotate(num_participants=Count('participants'))
         
-        # Filter by active status
-        active = self.request.query_params.get('active', None)
-        if active == 'true':
-            now = timezone.now()
-            queryset = queryset.filter(start_date__lte=now, end_date__gte=now)
+        # Filter by status; ?active=true is the older spelling of ?status=active
+        challenge_status = self.request.query_params.get('status', None)
+        if challenge_status is None and self.request.query_params.get('active', None) == 'true':
+            challenge_status = 'active'
+        if challenge_status is not None:
+            if challenge_status not in challenges.STATUSES:
+                raise ValidationError({'status': f'Choose one of: {", ".join(challenges.STATUSES)}.'})
+            queryset = queryset.filter(challenges.status_filter(challenge_status, self.now))
         
         return queryset
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        challenges.invalidate_active_challenges()
+
+    def perform_update(self, serializer):
+        """Update challenge and rebuild progress if what counts towards it changed"""
+        previous = {field: getattr(serializer.instance, field) for field in challenges.DEFINITION_FIELDS}
+        challenge = serializer.save()
+        challenges.invalidate_active_challenges()
+        if any(getattr(challenge, field) != value for field, value in previous.items()):
+            scoring.challenge_changed(challenge)
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        challenges.invalidate_active_challenges()
+
     @action(detail=True, methods=['post'])
     def join(self, request, pk=None):
         """Join a challenge"""
         challenge = self.get_object()
         user = request.user
         
-        if user in challenge.participants.all():
+        if _has_member(challenge.participants, user):
             return Response(
                 {'message': 'You are already participating in this challenge'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         challenge.participants.add(user)
+        scoring.challenge_joined(challenge, user)
         
-        serializer = self.get_serializer(challenge)
+        serializer = self.get_serializer(self.get_object())
         return Response(serializer.data)
 
     @action(detail=True, methods=['post'])
@@ -263,112 +620,196 @@ class ChallengeViewSet(viewsets.ModelViewSet):
         challenge = self.get_object()
         user = request.user
         
-        if user not in challenge.participants.all():
+        if not _has_member(challenge.participants, user):
             return Response(
                 {'message': 'You are not participating in this challenge'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         challenge.participants.remove(user)
+        scoring.challenge_left(challenge, user)
         
         return Response({'message': 'Successfully left the challenge'})
 
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """Get the current user's progress and rank in a challenge"""
+        challenge = self.get_object()
+        progress = challenges.participant_progress(challenge, request.user.pk)
+        if progress is None:
+            raise Http404('You are not participating in this challenge.')
+        return Response(ChallengeProgressSerializer(progress).data)
+
+    @action(detail=True, methods=['get'])
+    def standings(self, request, pk=None):
+        """Get the participants furthest along in a challenge"""
+        challenge = self.get_object()
+        limit = int(request.query_params.get('limit', 10))
+        rows = challenges.standings(challenge, limit)
+        return Response(ChallengeProgressSerializer(rows, many=True).data)
+
     @action(detail=False, methods=['get'])
     def my_challenges(self, request):
         """Get challenges the current user is participating in"""
-        challenges = Challenge.objects.filter(participants=request.user)
+        challenge_ids = Challenge.participants.through.objects.filter(
+            user=request.user
+        ).values_list('challenge_id', flat=True)
+        challenges = self.paginate_queryset(self.get_queryset().filter(pk__in=list(challenge_ids)))
         serializer = self.get_serializer(challenges, many=True)
-        return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
 
-class WorkoutSuggestionViewSet(viewsets.ReadOnlyModelViewSet):
-    """ViewSet for workout suggestions"""
+class WorkoutSuggestionViewSet(ObjectIdLookupMixin, viewsets.ReadOnlyModelViewSet):
+    """ViewSet for workout suggestions, served from the in-process catalog"""
     queryset = WorkoutSuggestion.objects.all()
     serializer_class = WorkoutSuggestionSerializer
     permission_classes = [AllowAny]
+    ordering = ('_id',)
 
-    def get_queryset(self):
-        """Filter workout suggestions based on fitness level"""
-        queryset = WorkoutSuggestion.objects.all()
-        
-        # Filter by fitness level
-        fitness_level = self.request.query_params.get('fitness_level', None)
-        if fitness_level:
-            queryset = queryset.filter(fitness_level=fitness_level)
-        
-        # Filter by activity type
-        activity_type = self.request.query_params.get('activity_type', None)
-        if activity_type:
-            queryset = queryset.filter(activity_type=activity_type)
-        
-        return queryset
+    def list(self, request, *args, **kwargs):
+        """List workout suggestions, filtered by fitness level and activity type"""
+        return self.catalog_response(
+            request.query_params.get('fitness_level', None),
+            request.query_params.get('activity_type', None),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            pk = ObjectId(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except (InvalidId, TypeError):
+            raise Http404
+        payload = workouts.catalog().payloads.get(pk)
+        if payload is None:
+            raise Http404
+        return Response(payload)
 
     @action(detail=False, methods=['get'])
     def for_me(self, request):
         """Get workout suggestions for current user's fitness level"""
-        try:
-            profile = UserProfile.objects.get(user=request.user)
-            suggestions = WorkoutSuggestion.objects.filter(fitness_level=profile.fitness_level)
-            serializer = self.get_serializer(suggestions, many=True)
-            return Response(serializer.data)
-        except UserProfile.DoesNotExist:
+        fitness_level = workouts.fitness_level(request.user.pk)
+        if fitness_level is None:
             return Response(
                 {'message': 'Please complete your profile first'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        return self.catalog_response(fitness_level, request.query_params.get('activity_type', None))
+
+    def catalog_response(self, fitness_level, activity_type):
+        catalog = workouts.catalog()
+        page = self.paginator.paginate_list(
+            catalog.filter(fitness_level, activity_type), WorkoutSuggestion, self.request, view=self
+        )
+        return self.get_paginated_response([catalog.payloads[workout.pk] for workout in page])
 
 
 @api_view(['GET'])
 def leaderboard(request):
-    """Get leaderboard with top users by points"""
+    """Get leaderboard with top users by points, optionally for a time window"""
     limit = int(request.query_params.get('limit', 10))
+    window = leaderboard_window_param(request)
     
-    # Get user profiles ordered by points
-    profiles = UserProfile.objects.select_related('user').order_by('-total_points')[:limit]
-    
-    leaderboard_data = []
-    for rank, profile in enumerate(profiles, start=1):
-        activity_count = Activity.objects.filter(user=profile.user).count()
-        
-        # Calculate total calories
-        from django.db.models import Sum
-        total_calories = Activity.objects.filter(user=profile.user).aggregate(
-            Sum('calories')
-        )['calories__sum'] or 0
-        
-        # Get user's primary team (first team they're a member of)
-        user_team = Team.objects.filter(members=profile.user).first()
-        team_name = user_team.name if user_team else None
-        
-        leaderboard_data.append({
-            'user_id': profile.user.id,
-            'username': profile.user.username,
-            'total_points': profile.total_points,
-            'activity_count': activity_count,
-            'total_calories': total_calories,
-            'team_name': team_name,
-            'rank': rank
-        })
+    # Activity count, calories and primary team are kept denormalized on the
+    # profile (or the window score), so any limit is served by a single query
+    if window is None:
+        leaderboard_data = leaderboards.user_leaderboard(limit)
+    else:
+        leaderboard_data = leaderboard_windows.leaderboard(window, limit)
     
     serializer = LeaderboardSerializer(leaderboard_data, many=True)
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+def leaderboard_me(request):
+    """Get the current user's rank with the users ranked around them"""
+    if not request.user.is_authenticated:
+        raise NotAuthenticated()
+    return leaderboard_neighborhood(request, request.user.pk)
+
+
+@api_view(['GET'])
+def leaderboard_around(request, user_id):
+    """Get a user's rank with the users ranked around them"""
+    return leaderboard_neighborhood(request, user_id)
+
+
+def leaderboard_window_param(request):
+    """The validated ``window`` query parameter, or None for the overall leaderboard"""
+    window = request.query_params.get('window')
+    if window is not None and window not in leaderboard_windows.WINDOWS:
+        raise ValidationError({'window': f'Choose one of: {", ".join(leaderboard_windows.WINDOWS)}.'})
+    return window
+
+
+def leaderboard_neighborhood(request, user_id):
+    """Rank of ``user_id`` and up to ``radius`` neighbours on each side
+
+    Users with equal points are ranked by ascending user id, so ranks are
+    unique and stable between requests.
+    """
+    try:
+        radius = int(request.query_params.get('radius', LEADERBOARD_RADIUS))
+    except ValueError:
+        raise ValidationError({'radius': 'Enter a whole number.'})
+    if not 0 <= radius <= MAX_LEADERBOARD_RADIUS:
+        raise ValidationError({'radius': f'Must be between 0 and {MAX_LEADERBOARD_RADIUS}.'})
+    window = leaderboard_window_param(request)
+    
+    if window is None:
+        rank, rows = leaderboards.user_neighborhood(user_id, radius)
+    else:
+        rank, rows = leaderboard_windows.user_neighborhood(window, user_id, radius)
+    if rank is None:
+        raise Http404('This user is not on the leaderboard.')
+    
+    return Response({
+        'user_id': user_id,
+        'rank': rank,
+        'results': LeaderboardSerializer(rows, many=True).data,
+    })
+
+
 @api_view(['GET'])
 def team_leaderboard(request):
-    """Get team leaderboard"""
+    """Get team leaderboard, served from cache with ETag revalidation"""
     limit = int(request.query_params.get('limit', 10))
     
-    teams = Team.objects.all().order_by('-total_points')[:limit]
+    team_data, etag = leaderboards.team_leaderboard(limit)
     
-    team_data = []
-    for rank, team in enumerate(teams, start=1):
-        team_data.append({
-            'team_id': team.id,
-            'team_name': team.name,
-            'total_points': team.total_points,
-            'member_count': team.members.count(),
-            'rank': rank
-        })
-    
-    return Response(team_data)
+    # Polling clients that already hold this ranking get an empty 304
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(team_data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def prometheus_metrics(request):
+    """Expose in-process metrics in the Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def health(request):
+    """MongoDB reachability plus this process's pool settings and usage
+
+    Pool figures are per process, like the metrics; compare checkouts and
+    wait times across workers when sizing maxPoolSize.
+    """
+    try:
+        mongo.database().command('ping')
+        database = 'ok'
+    except PyMongoError as exc:
+        database = f'unavailable: {exc.__class__.__name__}'
+    client = settings.DATABASES['default'].get('CLIENT', {})
+    return JsonResponse({
+        'status': 'ok' if database == 'ok' else 'degraded',
+        'database': database,
+        'pool': {
+            'options': {option: client.get(option) for option in POOL_OPTIONS},
+            'read_only_preference': settings.OCTOFIT_MONGO_READ_PREFERENCE,
+            'servers': metrics.pool_stats(),
+        },
+    }, status=200 if database == 'ok' else 503)
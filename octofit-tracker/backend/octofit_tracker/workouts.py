@@ -0,0 +1,106 @@
+"""In-process read-through cache of the workout suggestion catalog.
+
+The catalog is small and changes only through the admin, so each process
+loads it in one query and keeps every workout's serialized payload in
+memory, listed under each ``(fitness_level, activity_type)`` filter
+combination (``None`` standing for "any"). Saving or deleting a workout
+bumps a version number in the Django cache; a process reloads its catalog
+when the version moves on or the catalog is older than the timeout, which
+also covers bulk writes that send no signals. Users' fitness levels are
+cached the same way for ``for_me``, so catalog reads issue no queries.
+"""
+import threading
+import time
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .metrics import record_cache_lookup
+from .models import UserProfile, WorkoutSuggestion
+from .serializers import WorkoutSuggestionSerializer
+
+CATALOG_VERSION_KEY = 'workout-catalog:version'
+
+# Safety net for changes that send no signals (bulk writes, other processes
+# when the cache backend is per-process)
+CATALOG_TIMEOUT = 300
+
+FITNESS_LEVEL_TIMEOUT = 3600
+
+_catalog = None
+_lock = threading.Lock()
+
+
+class Catalog:
+    """Every workout, ordered by id, with its payload and the filtered lists"""
+
+    def __init__(self, workouts, version):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.workouts = {}
+        self.payloads = {}
+        self.lists = {}
+        for workout in sorted(workouts, key=lambda workout: workout.pk):
+            self.workouts[workout.pk] = workout
+            self.payloads[workout.pk] = WorkoutSuggestionSerializer(workout).data
+            for fitness_level in (workout.fitness_level, None):
+                for activity_type in (workout.activity_type, None):
+                    self.lists.setdefault((fitness_level, activity_type), []).append(workout)
+
+    def filter(self, fitness_level=None, activity_type=None):
+        """Workouts matching both filters, ordered by id; ``None`` matches any value"""
+        return self.lists.get((fitness_level or None, activity_type or None), [])
+
+
+def catalog():
+    """The current catalog, reloaded when its version or age says it is stale"""
+    global _catalog
+    version = cache.get_or_set(CATALOG_VERSION_KEY, 1, None)
+    current = _catalog
+    hit = _is_fresh(current, version)
+    record_cache_lookup('workout_catalog', hit=hit)
+    if hit:
+        return current
+    with _lock:
+        # Another thread may have reloaded while this one waited
+        if not _is_fresh(_catalog, version):
+            _catalog = Catalog(WorkoutSuggestion.objects.all(), version)
+        return _catalog
+
+
+def invalidate_catalog():
+    """Make every process reload the catalog on its next read"""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, 1, None)
+
+
+def fitness_level(user_id):
+    """The user's fitness level, or None without a profile"""
+    key = f'fitness-level:{user_id}'
+    level = cache.get(key)
+    record_cache_lookup('fitness_level', hit=level is not None)
+    if level is None:
+        level = UserProfile.objects.filter(user_id=user_id).values_list('fitness_level', flat=True).first()
+        if level is None:
+            return None
+        cache.set(key, level, FITNESS_LEVEL_TIMEOUT)
+    return level
+
+
+def _is_fresh(current, version):
+    return (
+        current is not None
+        and current.version == version
+        and time.monotonic() - current.loaded_at < CATALOG_TIMEOUT
+    )
+
+
+@receiver([post_save, post_delete], sender=WorkoutSuggestion)
+def workout_changed(sender, **kwargs):
+    invalidate_catalog()
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    cache.delete(f'fitness-level:{instance.user_id}')